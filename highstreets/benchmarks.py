@@ -0,0 +1,588 @@
+"""
+Benchmarks of the package's hot paths on deterministic synthetic data (see
+highstreets.data.synthetic).
+
+Each benchmark is registered with the @benchmark decorator on a setup
+function. The setup function receives the data scale (1 = London-sized) and
+a scratch directory, prepares its inputs and returns the zero-argument
+function that is timed, so data generation is never included in the timings.
+
+The benchmarks run under pytest-benchmark from tests/test_benchmarks.py:
+once each on small data in every test run, and timed at London scale by CI,
+which fails if any is more than 20% slower than on the parent commit. Saving
+and comparing timings is left to pytest-benchmark (--benchmark-save,
+--benchmark-compare and --benchmark-compare-fail).
+
+Usage from the command line, to print the timings without pytest:
+    - run every benchmark at London scale:
+        python -m highstreets.benchmarks
+    - run a subset at 10x London scale:
+        python -m highstreets.benchmarks --scale 10 --only clean. features.
+    - time the start up of the command line entry points, which import their
+      heavy dependencies (sklearn, scipy, plotting) only in the functions
+      that use them:
+        python -m highstreets.benchmarks --only startup.
+"""
+import argparse
+import functools
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from highstreets import config
+from highstreets.data import synthetic
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registers a benchmark setup function under name"""
+
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return decorator
+
+
+# ================ ingest =====================================================
+def _bt_ingest(kind, daily, scale, tmpdir):
+    make = synthetic.make_bt_daily if daily else synthetic.make_bt_monthly
+    file = os.path.join(tmpdir, f"{kind}_{'daily' if daily else 'monthly'}.csv")
+    if not os.path.exists(file):
+        make(kind, scale=scale).to_csv(file, index=False)
+    return lambda: pd.read_csv(file, low_memory=False)
+
+
+for _kind in synthetic.BT_AREA_COLUMNS:
+    benchmark(f"ingest.{_kind}_daily")(
+        lambda scale, tmpdir, kind=_kind: _bt_ingest(kind, True, scale, tmpdir)
+    )
+    benchmark(f"ingest.{_kind}_monthly")(
+        lambda scale, tmpdir, kind=_kind: _bt_ingest(kind, False, scale, tmpdir)
+    )
+
+
+def _write_compressed(csv_file, compression):
+    """Compressed copy of a csv file, as BT might deliver it"""
+    import gzip
+    import shutil
+    import zipfile
+
+    if compression == "gzip":
+        out_file = csv_file + ".gz"
+        if not os.path.exists(out_file):
+            with open(csv_file, "rb") as f, gzip.open(out_file, "wb") as out:
+                shutil.copyfileobj(f, out)
+    elif compression == "zstd":
+        import zstandard
+
+        out_file = csv_file + ".zst"
+        if not os.path.exists(out_file):
+            with open(csv_file, "rb") as f, open(out_file, "wb") as out:
+                zstandard.ZstdCompressor().copy_stream(f, out)
+    else:
+        out_file = os.path.splitext(csv_file)[0] + ".zip"
+        if not os.path.exists(out_file):
+            with zipfile.ZipFile(out_file, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.write(csv_file, os.path.basename(csv_file))
+    return out_file
+
+
+def _bt_ingest_compressed(kind, compression, scale, tmpdir):
+    """End-to-end ingest of a daily file: detect the format, decompress,
+    parse and clean"""
+    from highstreets.data import bt_scanner, schema
+
+    file = os.path.join(tmpdir, f"{kind}_daily.csv")
+    if not os.path.exists(file):
+        synthetic.make_bt_daily(kind, scale=scale).to_csv(file, index=False)
+    if compression != "none":
+        file = _write_compressed(file, compression)
+
+    clean = getattr(schema, f"clean_{kind}_daily")
+    file_date = pd.Timestamp("2022-02-01")
+
+    def run():
+        deliveries = bt_scanner.scan_files(tmpdir, file_date)
+        bt_file = next(f for f in deliveries if f.path == file)
+        with bt_scanner.open_file(bt_file) as stream:
+            df = pd.read_csv(stream, low_memory=False)
+        return clean(df, file_date, bt_file.name)
+
+    return run
+
+
+_compressions = ["none", "gzip", "zip"]
+if importlib.util.find_spec("zstandard") is not None:
+    _compressions.append("zstd")
+
+for _kind in synthetic.BT_AREA_COLUMNS:
+    for _compression in _compressions:
+        benchmark(f"ingest_compressed.{_kind}_daily.{_compression}")(
+            lambda scale, tmpdir, kind=_kind, compression=_compression: (
+                _bt_ingest_compressed(kind, compression, scale, tmpdir)
+            )
+        )
+
+
+# ================ cleaning ===================================================
+def _bt_clean(kind, daily, scale):
+    from highstreets.data import schema
+
+    if daily:
+        df = synthetic.make_bt_daily(kind, scale=scale)
+        clean = getattr(schema, f"clean_{kind}_daily")
+    else:
+        df = synthetic.make_bt_monthly(kind, scale=scale)
+        clean = getattr(schema, f"clean_{kind}_monthly")
+
+    file_date = pd.Timestamp("2022-02-01")
+    # the cleaning functions modify their input, so each run gets a copy
+    return lambda: clean(df.copy(), file_date, "synthetic.csv")
+
+
+for _kind in synthetic.BT_AREA_COLUMNS:
+    benchmark(f"clean.{_kind}_daily")(
+        lambda scale, tmpdir, kind=_kind: _bt_clean(kind, True, scale)
+    )
+    benchmark(f"clean.{_kind}_monthly")(
+        lambda scale, tmpdir, kind=_kind: _bt_clean(kind, False, scale)
+    )
+
+
+# ================ apportioning ===============================================
+def _bt_apportion(kind, scale):
+    from highstreets.data import area_weights, schema
+
+    df = getattr(schema, f"clean_{kind}_daily")(
+        synthetic.make_bt_daily(kind, scale=scale),
+        pd.Timestamp("2022-02-01"),
+        "synthetic.csv",
+    )
+    weights = synthetic.make_area_weights(kind, scale=scale)
+    return lambda: area_weights.apportion(df, weights)
+
+
+for _kind in synthetic.BT_AREA_COLUMNS:
+    benchmark(f"apportion.{_kind}_daily")(
+        lambda scale, tmpdir, kind=_kind: _bt_apportion(kind, scale)
+    )
+
+
+# ================ feature building ===========================================
+def _mcard_long(scale):
+    from highstreets.data import make_dataset
+
+    hsd_yoy = synthetic.make_mcard_yoy(scale=scale)
+    return make_dataset.stack_retail_we_wd(hsd_yoy, "yoy_").dropna(
+        how="any", axis="rows"
+    )
+
+
+def _mcard_monthly(scale):
+    """Non-yoy spend in the layout processing_functions expects"""
+    hs = synthetic.make_mcard_yoy(scale=scale, spend_col_prefix="")
+    hs["month_year"] = hs["week_start"].dt.to_period("M")
+    return hs[["week_start", "highstreet_name", "month_year", "txn_amt_wd_retail"]]
+
+
+@benchmark("features.stack_retail_we_wd")
+def _(scale, tmpdir):
+    from highstreets.data import make_dataset
+
+    hsd_yoy = synthetic.make_mcard_yoy(scale=scale)
+    return lambda: make_dataset.stack_retail_we_wd(hsd_yoy, "yoy_")
+
+
+@benchmark("features.avg_retail_wd_we")
+def _(scale, tmpdir):
+    from highstreets.data import make_dataset
+
+    hsd_yoy = synthetic.make_mcard_yoy(scale=scale)
+    return lambda: make_dataset.avg_retail_wd_we(hsd_yoy, "yoy_")
+
+
+@benchmark("features.spend_long_format")
+def _(scale, tmpdir):
+    from highstreets.data import make_dataset
+
+    hsd_yoy = synthetic.make_mcard_yoy(scale=scale)
+    return lambda: make_dataset.spend_long_format(hsd_yoy, "yoy_")
+
+
+@benchmark("features.stack_spend_we_wd")
+def _(scale, tmpdir):
+    from highstreets.data import make_dataset
+
+    hsd_yoy = synthetic.make_mcard_yoy(scale=scale)
+    return lambda: make_dataset.stack_spend_we_wd(hsd_yoy, "yoy_")
+
+
+@benchmark("features.extract_data_array")
+def _(scale, tmpdir):
+    from highstreets.data import make_dataset
+
+    hsd_long = _mcard_long(scale)
+    return lambda: make_dataset.extract_data_array(
+        hsd_long, ("2020-01-01", "2021-12-31"), "txn_amt"
+    )
+
+
+@benchmark("features.create_mean_sd_mcard")
+def _(scale, tmpdir):
+    from highstreets.features import processing_functions as pf
+
+    hs = _mcard_monthly(scale)
+    months = pd.date_range("2021-03", "2022-03", freq="M").to_period("M")
+    return lambda: pf.create_mean_sd_mcard(hs, months)
+
+
+@benchmark("features.create_gradient")
+def _(scale, tmpdir):
+    from highstreets.features import processing_functions as pf
+
+    hs = _mcard_monthly(scale)
+    months = pd.date_range("2021-03", "2021-06", freq="M").to_period("M")
+    return lambda: pf.create_gradient(hs, months)
+
+
+def _o2_hs(scale):
+    o2 = synthetic.make_o2_hourly(scale=scale, count_types=["Visitor"])
+    lookup = synthetic.make_hs_msoa_lookup(scale=scale)
+    return pd.merge(o2, lookup[["msoa11cd", "highstreet_name"]], on="msoa11cd")
+
+
+@benchmark("features.create_mean_sd_o2")
+def _(scale, tmpdir):
+    from highstreets.features import processing_functions as pf
+
+    o2_hs = _o2_hs(scale)
+    days = pd.date_range("2021-05-08", "2022-04-01", freq="d")
+    return lambda: pf.create_mean_sd_o2(o2_hs, days)
+
+
+@benchmark("features.build_feature_frame")
+def _(scale, tmpdir):
+    from highstreets.features import processing_functions as pf
+
+    o2_hs = _o2_hs(scale)
+    windows = [
+        pd.date_range("2021-05-08", "2021-08-01", freq="d"),
+        pd.date_range("2021-05-08", "2022-04-01", freq="d"),
+    ]
+    specs = [
+        (column, statistic, window)
+        for column in ["h08", "h13", "h18"]
+        for statistic in ["mean", "std", "max"]
+        for window in windows
+    ]
+    return lambda: pf.build_feature_frame(o2_hs, specs, time_col="count_date")
+
+
+@benchmark("features.create_gradient_o2")
+def _(scale, tmpdir):
+    from highstreets.features import processing_functions as pf
+
+    o2_hs = _o2_hs(scale)
+    days = pd.date_range("2021-05-08", "2021-08-01", freq="d")
+    return lambda: pf.create_gradient_o2(o2_hs, days)
+
+
+@benchmark("features.o2_hourly_features")
+def _(scale, tmpdir):
+    from highstreets.features import o2_hourly
+
+    o2_hs = _o2_hs(scale)
+    return lambda: o2_hourly.o2_hourly_features(o2_hs)
+
+
+@benchmark("clustering.o2_clusters")
+def _(scale, tmpdir):
+    from highstreets.features import clustering
+
+    o2 = synthetic.make_o2_hourly(scale=scale, count_types=["Visitor"])
+    lookup = synthetic.make_hs_msoa_lookup(scale=scale)
+    o2_hs = pd.merge(o2, lookup[["msoa11cd", "highstreet_id"]], on="msoa11cd")
+    return lambda: clustering.o2_clusters(o2_hs)
+
+
+@benchmark("similarity.query_all")
+def _(scale, tmpdir):
+    from highstreets.data import make_dataset
+    from highstreets.features.similarity import SimilarityIndex
+
+    data = make_dataset.extract_data_array(
+        _mcard_long(scale), ("2020-01-01", "2021-12-31"), "txn_amt"
+    )
+    index = SimilarityIndex.build(data)
+    return lambda: index.query_all(k=10)
+
+
+# ================ grouping ===================================================
+def _recovery_stats(scale):
+    """2020 recovery data with per high street mean and slope columns"""
+    from highstreets.data import make_dataset
+    from highstreets.features import build_features
+
+    data = make_dataset.extract_data_array(
+        _mcard_long(scale), ("2020-04-15", "2020-10-31"), "txn_amt"
+    )
+    reg, _ = build_features.get_fit_lines(
+        "2020-04-01", data.index, np.transpose(data.to_numpy())
+    )
+    means = data.mean().to_numpy()[:, np.newaxis]
+    slopes = reg.coef_.reshape(-1, 1)
+    return data, means, slopes
+
+
+@benchmark("grouping.group_highstreets")
+def _(scale, tmpdir):
+    from highstreets.features import build_features
+
+    data, means, slopes = _recovery_stats(scale)
+    return lambda: build_features.group_highstreets(data, (means, slopes), 4)
+
+
+@benchmark("grouping.hist2d_highstreets")
+def _(scale, tmpdir):
+    from highstreets.features import build_features
+
+    _, means, slopes = _recovery_stats(scale)
+    stats = pd.DataFrame({"mean 2020": means[:, 0], "slope 2020": slopes[:, 0]})
+    return lambda: build_features.hist2d_highstreets(stats.copy())
+
+
+@benchmark("grouping.bootstrap_recovery")
+def _(scale, tmpdir):
+    from highstreets.features import bootstrap
+
+    data, _, _ = _recovery_stats(scale)
+    return lambda: bootstrap.bootstrap_recovery(data, n_resamples=1000)
+
+
+# ================ decomposition ==============================================
+# the same weekly series repeated 1, 4 and 16 times, so the timings show how
+# the decomposition scales with the number of series
+def _decomposition(scale, n_copies):
+    from highstreets.data import make_dataset
+    from highstreets.features import decomposition
+
+    data = make_dataset.extract_data_array(
+        _mcard_long(scale), ("2019-01-01", "2022-12-31"), "txn_amt"
+    )
+    values = np.tile(data.to_numpy(), (1, n_copies))
+    return lambda: decomposition.decompose(values, period=52)
+
+
+for _n_copies in [1, 4, 16]:
+    benchmark(f"decomposition.decompose_x{_n_copies}")(
+        lambda scale, tmpdir, n_copies=_n_copies: _decomposition(scale, n_copies)
+    )
+
+
+# ================ model fitting ==============================================
+@benchmark("models.get_fit_lines")
+def _(scale, tmpdir):
+    from highstreets.data import make_dataset
+    from highstreets.features import build_features
+
+    data = make_dataset.extract_data_array(
+        _mcard_long(scale), ("2020-04-15", "2020-10-31"), "txn_amt"
+    )
+    array_in = np.transpose(data.to_numpy())
+    return lambda: build_features.get_fit_lines("2020-04-01", data.index, array_in)
+
+
+@benchmark("models.run_experiment")
+def _(scale, tmpdir):
+    from sklearn.linear_model import Ridge
+    from sklearn.model_selection import train_test_split
+
+    from highstreets.models import train_model
+
+    rng = np.random.default_rng(0)
+    n_hs = synthetic._n(synthetic.N_HIGHSTREETS, scale)
+    X = pd.DataFrame(rng.normal(size=(n_hs, 20)))
+    y = X.iloc[:, :3].sum(axis=1) + rng.normal(size=n_hs)
+    split = train_test_split(X, y, random_state=0)
+    return lambda: train_model.run_experiment(Ridge(), *split)
+
+
+@benchmark("models.score_highstreets")
+def _(scale, tmpdir):
+    from sklearn.linear_model import Ridge
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    from highstreets.models import predict_model
+
+    rng = np.random.default_rng(0)
+    n_hs = synthetic._n(synthetic.N_HIGHSTREETS, scale)
+    X = pd.DataFrame(rng.normal(size=(n_hs, 20)))
+    pipeline = Pipeline([("scaler", StandardScaler()), ("model", Ridge())])
+    pipeline.fit(X, X.iloc[:, 0])
+    predict_model.set_label_edges(pipeline, X)
+    return lambda: predict_model.score_highstreets(pipeline, X)
+
+
+@benchmark("models.fit_hierarchical")
+def _(scale, tmpdir):
+    from highstreets.models import hierarchical_model
+
+    data = hierarchical_model.simulate_data(
+        synthetic._n(synthetic.N_HIGHSTREETS, scale), 30
+    )
+    return lambda: hierarchical_model.fit_hierarchical(*data)
+
+
+# every high street's weekly spend forecast (or backtested from every week of
+# the second half) at once
+def _forecast(scale, name, method):
+    from highstreets.data import make_dataset
+    from highstreets.models import forecast
+
+    data = make_dataset.extract_data_array(
+        _mcard_long(scale), ("2019-01-01", "2022-12-31"), "txn_amt"
+    )
+    return lambda: getattr(forecast, name)(data, horizon=8, method=method)
+
+
+for _name in ["forecast", "backtest"]:
+    for _method in ["ses", "holt", "snaive"]:
+        benchmark(f"models.{_name}_{_method}")(
+            lambda scale, tmpdir, name=_name, method=_method: _forecast(
+                scale, name, method
+            )
+        )
+
+
+# ================ plotting ===================================================
+@benchmark("plotting.plot_highstreets_grouped")
+def _(scale, tmpdir):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    from highstreets.visualisation import visualise
+
+    os.makedirs(os.path.join(tmpdir, "reports", "figures"), exist_ok=True)
+
+    data, means, slopes = _recovery_stats(scale)
+    plot_array = np.transpose(data.to_numpy())
+    nb_dates = pd.to_datetime(["2020-06-15", "2020-11-05"])
+
+    def run():
+        settings = config.get_settings()
+        project_root, settings.PROJECT_ROOT = settings.PROJECT_ROOT, tmpdir
+        try:
+            visualise.plot_highstreets_grouped(
+                plot_array, data.index, (means, slopes), nb_dates, "benchmark.png"
+            )
+        finally:
+            settings.PROJECT_ROOT = project_root
+        plt.close("all")
+
+    return run
+
+
+# ================ startup ====================================================
+# modules imported by the command line entry points, whose import time is
+# paid on every run. tests/test_imports.py checks that they leave sklearn,
+# scipy.stats and the plotting libraries to the functions that use them
+STARTUP_MODULES = [
+    "highstreets.config",
+    "highstreets.instrumentation",
+    "highstreets.data.bt_read_raw",
+    "highstreets.data.bt_out_of_core",
+    "highstreets.data.make_dataset",
+    "highstreets.features.build_features",
+    "highstreets.models.predict_model",
+    "highstreets.visualisation.visualise",
+]
+
+
+def _import_time(module):
+    """Imports a module in a fresh interpreter, so nothing is already
+    imported"""
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run(  # noqa: S603
+        [sys.executable, "-c", f"import {module}"], cwd=package_root, check=True
+    )
+
+
+for _module in STARTUP_MODULES:
+    benchmark(f"startup.import_{_module.split('.')[-1]}")(
+        lambda scale, tmpdir, module=_module: functools.partial(_import_time, module)
+    )
+
+
+# ================ running and comparing ======================================
+def run_benchmarks(scale=1, repeats=3, only=None, verbose=True):
+    """Runs the registered benchmarks
+
+    :param scale: data scale, 1 being London-sized, defaults to 1
+    :type scale: float, optional
+    :param repeats: number of timed runs per benchmark, defaults to 3
+    :type repeats: int, optional
+    :param only: run only benchmarks whose names start with one of these
+    prefixes, defaults to None (all)
+    :type only: list[str], optional
+    :param verbose: print each result as it is measured, defaults to True
+    :type verbose: bool, optional
+    :return: one row per benchmark with the minimum and median run time
+    :rtype: pandas dataframe
+    """
+    names = [
+        name
+        for name in BENCHMARKS
+        if only is None or any(name.startswith(prefix) for prefix in only)
+    ]
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in names:
+            func = BENCHMARKS[name](scale, tmpdir)
+            timings = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - t0)
+
+            rows.append(
+                {
+                    "benchmark": name,
+                    "scale": scale,
+                    "min_s": min(timings),
+                    "median_s": float(np.median(timings)),
+                }
+            )
+            if verbose:
+                print(f"{name:<40} {min(timings):10.4f} s")
+
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run highstreets benchmarks")
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--only", nargs="*", help="benchmark name prefixes")
+    parser.add_argument("--output", help="csv file for the timings")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(scale=args.scale, repeats=args.repeats, only=args.only)
+    if args.output:
+        results.to_csv(args.output, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
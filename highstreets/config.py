@@ -1,26 +1,74 @@
+"""
+Project settings, read from the environment (and the .env file found by
+python-dotenv) the first time one is used.
+
+Every setting read from the environment is listed in ENV_SETTINGS with its
+default. get_settings loads the .env file once and caches the settings, and
+the settings are also available as module attributes, so modules read e.g.
+config.YOY_FILE without each calling load_dotenv at import.
+
+Usage:
+    from highstreets import config
+    yoy_file = config.YOY_FILE            # or config.get_settings().YOY_FILE
+"""
+import functools
 import os
+from types import SimpleNamespace
+
+ENV_SETTINGS = {
+    # ==================== PROJECT CONFIG =====================================
+    "PROJECT_FILE": None,
+    "PROJECT_ROOT": None,
+    "DATA_PATH": None,
+    # ==================== POSTGRES CONFIG ====================================
+    "PG11_DATABASE": None,
+    "PG11_USER": None,
+    "PG11_PASSWORD": None,
+    "PG11_HOST": None,
+    "PG11_PORT": None,
+    # ================ MCARD CONFIG ===========================================
+    "YOY_FILE": None,
+    "PROFILE_FILE": None,
+    # ================ O2 CONFIG ==============================================
+    "O2_CLUSTERS": None,
+    # ================ LOOKUP CONFIG ==========================================
+    # high street to town centre and borough lookup
+    "TC_LOOKUP": None,
+    # ================ INSTRUMENTATION CONFIG =================================
+    # set HIGHSTREETS_INSTRUMENT=1 to record timings and memory use of each stage
+    "HIGHSTREETS_INSTRUMENT": "0",
+    "HIGHSTREETS_INSTRUMENT_LOG": None,
+    # ================ MODEL CONFIG ===========================================
+    "MODEL_REGISTRY_DIR": None,
+    # ================ BT CONFIG ==============================================
+    "BT_DIR": None,
+    # cached area to high street weight tables (see highstreets/data/area_weights.py)
+    "BT_AREA_WEIGHTS_DIR": None,
+}
+
 
-from dotenv import find_dotenv, load_dotenv
+@functools.lru_cache(maxsize=None)
+def get_settings():
+    """Settings read from the environment, loading the .env file on first use
 
-load_dotenv(find_dotenv())
+    :return: one attribute per entry of ENV_SETTINGS
+    :rtype: SimpleNamespace
+    """
+    from dotenv import find_dotenv, load_dotenv
 
+    load_dotenv(find_dotenv())
+    return SimpleNamespace(
+        **{name: os.getenv(name, default) for name, default in ENV_SETTINGS.items()}
+    )
 
-# ==================== PROJECT CONFIG =========================================
-PROJECT_FILE = os.getenv("PROJECT_FILE")
-PROJECT_ROOT = os.getenv("PROJECT_ROOT")
 
-# ==================== POSTGRES CONFIG ========================================
-PG11_DATABASE = os.getenv("PG11_DATABASE")
-PG11_USER = os.getenv("PG11_USER")
-PG11_PASSWORD = os.getenv("PG11_PASSWORD")
-PG11_HOST = os.getenv("PG11_HOST")
-PG11_PORT = os.getenv("PG11_PORT")
+def __getattr__(name):
+    if name in ENV_SETTINGS:
+        return getattr(get_settings(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# ================ MCARD CONFIG ===============================================
-YOY_FILE = os.getenv("YOY_FILE")
 
 # ================ BT CONFIG ==================================================
-BT_DIR = os.getenv("BT_DIR")
 BT_LSOA_DAILY_PREFIX = "lsoa_daily_agg"
 BT_MSOA_DAILY_PREFIX = "msoa_daily_agg"
 BT_LSOA_MONTHLY_PREFIX = "lsoa_monthly_agg"
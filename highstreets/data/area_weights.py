@@ -0,0 +1,280 @@
+"""
+Weights mapping the BT footfall areas (LSOAs, MSOAs and TfL hex cells) onto
+high streets, and apportioning of BT data to high streets with them.
+
+A weight table has one row per (area, high street) pair that overlap, with
+columns:
+    - <area id>: lsoa_id, msoa_id or hex_grid_id
+    - highstreet_id
+    - weight: the fraction of the area that lies within the high street
+        polygon
+
+Weight tables are computed once from the area and high street boundaries with
+compute_area_weights (which needs geopandas, the 'geo' extra) and cached as csv files in
+BT_AREA_WEIGHTS_DIR, named <kind>_highstreet_weights.csv. load_area_weights
+reads them back, keeping them in memory until the file changes.
+
+apportion turns any BT frame into per high street footfall: the frame is
+pivoted to a sparse (areas x groups) matrix and multiplied by the sparse
+(high streets x areas) weight matrix, so every high street, group and column
+is computed in one sparse matrix multiply. Counts (scaled_volume) are
+apportioned by weight; averages (dwell_time, loyalty_percentage) are averaged
+weighted by the apportioned counts.
+
+Usage:
+    weights = load_area_weights("lsoa")
+    hs_daily = apportion(lsoa_daily, weights)
+"""
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from highstreets import config
+from highstreets import instrumentation as instr
+
+# area id column for each kind of BT area
+AREA_COLUMNS = {"lsoa": "lsoa_id", "msoa": "msoa_id", "hex": "hex_grid_id"}
+
+
+def weights_file(kind, weights_dir=None):
+    """Path of the cached weight table for a kind of area
+
+    :param kind: 'lsoa', 'msoa' or 'hex'
+    :type kind: str
+    :param weights_dir: directory of the cached tables, defaults to
+    BT_AREA_WEIGHTS_DIR
+    :type weights_dir: str, optional
+    :rtype: str
+    """
+    if kind not in AREA_COLUMNS:
+        raise ValueError(f"Unknown area kind: {kind}")
+    weights_dir = weights_dir or config.BT_AREA_WEIGHTS_DIR
+    if weights_dir is None:
+        raise ValueError("No weights directory given and BT_AREA_WEIGHTS_DIR not set")
+    return os.path.join(weights_dir, f"{kind}_highstreet_weights.csv")
+
+
+def compute_area_weights(
+    areas, highstreets, area_col, highstreet_col="highstreet_id", min_weight=1e-6
+):
+    """Overlap fractions of areas with high street polygons
+
+    :param areas: area boundaries
+    :type areas: geopandas geodataframe
+    :param highstreets: high street polygons
+    :type highstreets: geopandas geodataframe
+    :param area_col: area id column of areas
+    :type area_col: str
+    :param highstreet_col: high street id column of highstreets, defaults to
+    'highstreet_id'
+    :type highstreet_col: str, optional
+    :param min_weight: overlaps smaller than this fraction of the area are
+    dropped, defaults to 1e-6
+    :type min_weight: float, optional
+    :return: weight table with columns area_col, highstreet_id and weight
+    :rtype: pandas dataframe
+    """
+    import geopandas as gpd
+
+    # areas are needed in a projected CRS for areas to be meaningful
+    if highstreets.crs != areas.crs:
+        highstreets = highstreets.to_crs(areas.crs)
+
+    areas = areas[[area_col, "geometry"]].copy()
+    areas["area_size"] = areas.geometry.area
+
+    overlap = gpd.overlay(
+        areas,
+        highstreets[[highstreet_col, "geometry"]],
+        how="intersection",
+        keep_geom_type=True,
+    )
+    overlap["weight"] = overlap.geometry.area / overlap["area_size"]
+
+    weights = (
+        overlap.rename(columns={highstreet_col: "highstreet_id"})
+        .groupby([area_col, "highstreet_id"], as_index=False)["weight"]
+        .sum()
+    )
+    return weights[weights["weight"] >= min_weight].reset_index(drop=True)
+
+
+def save_area_weights(weights, kind, weights_dir=None):
+    """Caches a weight table as csv
+
+    :param weights: weight table
+    :type weights: pandas dataframe
+    :param kind: 'lsoa', 'msoa' or 'hex'
+    :type kind: str
+    :param weights_dir: directory of the cached tables, defaults to
+    BT_AREA_WEIGHTS_DIR
+    :type weights_dir: str, optional
+    :return: path of the file written
+    :rtype: str
+    """
+    path = weights_file(kind, weights_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    weights[[AREA_COLUMNS[kind], "highstreet_id", "weight"]].to_csv(path, index=False)
+    return path
+
+
+@functools.lru_cache(maxsize=8)
+def _read_weights(path, mtime):
+    return pd.read_csv(path)
+
+
+def load_area_weights(kind, weights_dir=None):
+    """Reads a cached weight table. Tables are kept in memory and only
+    re-read if the file has changed
+
+    :param kind: 'lsoa', 'msoa' or 'hex'
+    :type kind: str
+    :param weights_dir: directory of the cached tables, defaults to
+    BT_AREA_WEIGHTS_DIR
+    :type weights_dir: str, optional
+    :rtype: pandas dataframe
+    """
+    path = weights_file(kind, weights_dir)
+    return _read_weights(path, os.path.getmtime(path)).copy()
+
+
+def write_lookup_table(weights, kind, engine):
+    """Writes a weight table to the database as the lookup table used by the
+    high street rollups in highstreets/data/bt_rollups.py
+
+    :param weights: weight table
+    :type weights: pandas dataframe
+    :param kind: 'lsoa', 'msoa' or 'hex'
+    :type kind: str
+    :param engine: SQLAlchemy engine
+    :type engine: sqlalchemy engine
+    """
+    weights[[AREA_COLUMNS[kind], "highstreet_id", "weight"]].to_sql(
+        f"bt_{kind}_highstreet_lookup", engine, if_exists="replace", index=False
+    )
+
+
+def weight_matrix(weights, area_col, area_ids=None, highstreet_ids=None):
+    """Sparse (high streets x areas) matrix of a weight table
+
+    :param weights: weight table
+    :type weights: pandas dataframe
+    :param area_col: area id column of weights
+    :type area_col: str
+    :param area_ids: order of the matrix columns, defaults to the areas in
+    weights. Areas not in the weight table get zero columns
+    :type area_ids: array-like, optional
+    :param highstreet_ids: order of the matrix rows, defaults to the sorted
+    high streets in weights
+    :type highstreet_ids: array-like, optional
+    :return: the matrix, and the area and high street ids of its columns and
+    rows
+    :rtype: tuple(scipy csr matrix, pandas index, pandas index)
+    """
+    area_ids = pd.Index(
+        np.sort(weights[area_col].unique()) if area_ids is None else area_ids
+    )
+    highstreet_ids = pd.Index(
+        np.sort(weights["highstreet_id"].unique())
+        if highstreet_ids is None
+        else highstreet_ids
+    )
+
+    cols = area_ids.get_indexer(weights[area_col])
+    rows = highstreet_ids.get_indexer(weights["highstreet_id"])
+    keep = (cols >= 0) & (rows >= 0)
+
+    matrix = sparse.csr_matrix(
+        (weights["weight"].to_numpy(dtype=float)[keep], (rows[keep], cols[keep])),
+        shape=(len(highstreet_ids), len(area_ids)),
+    )
+    return matrix, area_ids, highstreet_ids
+
+
+@instr.instrument()
+def apportion(
+    df,
+    weights,
+    area_col=None,
+    by=("date", "time_indicator"),
+    sum_cols=("scaled_volume",),
+    mean_cols=("dwell_time", "loyalty_percentage"),
+    weight_col="scaled_volume",
+):
+    """Apportions a BT frame to high streets
+
+    :param df: BT data, one row per area and group, as cleaned by
+    highstreets.data.schema
+    :type df: pandas dataframe
+    :param weights: weight table for the kind of area in df
+    :type weights: pandas dataframe
+    :param area_col: area id column, defaults to the one of df's kind
+    :type area_col: str, optional
+    :param by: columns identifying a group (e.g. a date and time band),
+    defaults to ('date', 'time_indicator')
+    :type by: tuple, optional
+    :param sum_cols: count columns, apportioned by weight, defaults to
+    ('scaled_volume',)
+    :type sum_cols: tuple, optional
+    :param mean_cols: average columns, averaged weighted by the apportioned
+    weight_col, defaults to ('dwell_time', 'loyalty_percentage')
+    :type mean_cols: tuple, optional
+    :param weight_col: column weighting the averages, defaults to
+    'scaled_volume'
+    :type weight_col: str, optional
+    :return: one row per high street and group, with the by, sum_cols and
+    mean_cols columns. Groups with no data for any of a high street's areas
+    are left out
+    :rtype: pandas dataframe
+    """
+    if area_col is None:
+        area_col = next(col for col in AREA_COLUMNS.values() if col in df.columns)
+    by, sum_cols, mean_cols = list(by), list(sum_cols), list(mean_cols)
+
+    matrix, area_ids, highstreet_ids = weight_matrix(weights, area_col)
+    area_codes = area_ids.get_indexer(df[area_col])
+    in_weights = area_codes >= 0
+    df, area_codes = df[in_weights], area_codes[in_weights]
+
+    group_codes = df.groupby(by, sort=False).ngroup().to_numpy()
+    _, first_rows = np.unique(group_codes, return_index=True)
+    groups = df[by].iloc[first_rows].reset_index(drop=True)
+    n_groups = len(groups)
+
+    # one block of n_groups columns per quantity: counts, weighted sums of
+    # the averages and their denominators, and a count of contributing rows
+    w = df[weight_col].to_numpy(dtype=float)
+    blocks = [df[col].to_numpy(dtype=float) for col in sum_cols]
+    for col in mean_cols:
+        values = df[col].to_numpy(dtype=float)
+        present = ~np.isnan(values) & ~np.isnan(w)
+        blocks.append(np.where(present, values * w, 0.0))
+        blocks.append(np.where(present, w, 0.0))
+    blocks.append(np.ones(len(df)))
+
+    n_blocks = len(blocks)
+    data = np.concatenate(blocks)
+    missing = np.isnan(data)
+    cols = np.concatenate([group_codes + i * n_groups for i in range(n_blocks)])
+    rows = np.tile(area_codes, n_blocks)
+    values = sparse.csr_matrix(
+        (np.where(missing, 0.0, data), (rows, cols)),
+        shape=(len(area_ids), n_blocks * n_groups),
+    )
+
+    result = (matrix @ values).toarray().reshape(len(highstreet_ids), n_blocks, -1)
+
+    hs_idx, group_idx = np.nonzero(result[:, -1, :])
+    out = groups.iloc[group_idx].reset_index(drop=True)
+    out.insert(0, "highstreet_id", highstreet_ids[hs_idx])
+    for i, col in enumerate(sum_cols):
+        out[col] = result[hs_idx, i, group_idx]
+    for j, col in enumerate(mean_cols):
+        i = len(sum_cols) + 2 * j
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[col] = result[hs_idx, i, group_idx] / result[hs_idx, i + 1, group_idx]
+
+    return out.sort_values(by + ["highstreet_id"], ignore_index=True)
@@ -0,0 +1,389 @@
+"""
+Out-of-core processing of the BT daily archive, producing high street x week
+aggregates from every delivery without holding the archive in memory.
+
+The archive is processed partition by partition, a partition being one daily
+file of one delivery (or its Parquet copy). Each partition is read in chunks
+of at most chunksize rows, cleaned with the same functions as the loader
+(highstreets.data.schema) and apportioned to high streets with the area
+weights (highstreets.data.area_weights). Only additive partial aggregates
+by high street and day are kept: total scaled_volume, and volume weighted
+sums of dwell_time and loyalty_percentage with their weights. These are
+combined as partitions finish and turned into weekly totals and averages at
+the end, so memory use is bounded by chunksize x workers plus the (small)
+high street x day aggregates.
+
+Partitions are spread over a local process pool. Each one reports its rows,
+bytes, chunks, seconds and rows per second.
+
+When dates are re-issued in several deliveries only the latest delivery's
+copy is counted: each partition reports the dates it contains, and the
+aggregates of a day are kept from the latest delivery containing it.
+
+Optionally the csv files can first be staged as Parquet (one file per
+partition, needs pyarrow), which is much faster to re-read for repeated
+analyses.
+
+Usage:
+    python -m highstreets.data.bt_out_of_core --kind hex --output hs_weekly.csv
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from highstreets import config
+from highstreets.data import area_weights, bt_scanner
+from highstreets.data import schema as bt_schema
+
+# daily file prefix and cleaning function for each kind of area
+DAILY_FILES = {
+    "lsoa": (config.BT_LSOA_DAILY_PREFIX, bt_schema.clean_lsoa_daily),
+    "msoa": (config.BT_MSOA_DAILY_PREFIX, bt_schema.clean_msoa_daily),
+    "hex": (config.BT_TFL_HEX_DAILY_PREFIX, bt_schema.clean_hex_daily),
+}
+
+MEAN_COLS = ["dwell_time", "loyalty_percentage"]
+WEIGHT_COL = "scaled_volume"
+
+
+def list_partitions(kind, input_dir=None):
+    """Daily files of one kind in every delivery, oldest delivery first
+
+    :param kind: 'lsoa', 'msoa' or 'hex'
+    :type kind: str
+    :param input_dir: folder the deliveries are received in, defaults to
+    BT_DIR/received
+    :type input_dir: str, optional
+    :return: one (delivery date, file) pair per partition
+    :rtype: list[tuple]
+    """
+    prefix, _ = DAILY_FILES[kind]
+    deliveries, _ = bt_scanner.scan_deliveries(input_dir)
+    return [
+        (delivery.date, bt_file)
+        for delivery in deliveries
+        for bt_file in delivery.files
+        if bt_file.name.startswith(prefix)
+    ]
+
+
+def _read_chunks(bt_file, chunksize, **kwargs):
+    """Reads a (possibly compressed) csv or Parquet partition in chunks of
+    raw rows"""
+    if bt_file.path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(bt_file.path).iter_batches(
+            batch_size=chunksize, columns=kwargs.get("usecols")
+        )
+        for batch in batches:
+            yield batch.to_pandas()
+    else:
+        with bt_scanner.open_file(bt_file) as stream:
+            yield from pd.read_csv(
+                stream, chunksize=chunksize, low_memory=False, **kwargs
+            )
+
+
+def _partial_aggregate(df, weights, area_col):
+    """Additive high street x day aggregates of a cleaned chunk"""
+    df = df[["date", area_col, WEIGHT_COL] + MEAN_COLS].copy()
+
+    sum_cols = [WEIGHT_COL]
+    for col in MEAN_COLS:
+        present = df[col].notna() & df[WEIGHT_COL].notna()
+        df[f"{col}_wsum"] = np.where(present, df[col] * df[WEIGHT_COL], 0.0)
+        df[f"{col}_weight"] = np.where(present, df[WEIGHT_COL], 0.0)
+        sum_cols += [f"{col}_wsum", f"{col}_weight"]
+
+    return area_weights.apportion(
+        df, weights, area_col, by=["date"], sum_cols=sum_cols, mean_cols=()
+    )
+
+
+def process_partition(kind, bt_file, file_date, weights, chunksize=500_000):
+    """Cleans and aggregates one partition chunk by chunk
+
+    :param kind: 'lsoa', 'msoa' or 'hex'
+    :type kind: str
+    :param bt_file: csv or Parquet file of the partition
+    :type bt_file: highstreets.data.bt_scanner.BTFile
+    :param file_date: delivery date of the partition
+    :type file_date: datetime-like
+    :param weights: area to high street weight table
+    :type weights: pandas dataframe
+    :param chunksize: most raw rows held in memory at once, defaults to
+    500,000
+    :type chunksize: int, optional
+    :return: additive high street x day aggregates (with the delivery's
+    file_date), the dates in the partition and the partition's throughput
+    :rtype: tuple(pandas dataframe, pandas index, dict)
+    """
+    _, clean_func = DAILY_FILES[kind]
+    area_col = area_weights.AREA_COLUMNS[kind]
+    start = time.perf_counter()
+
+    partials, dates, n_rows, n_chunks = [], [], 0, 0
+    for chunk in _read_chunks(bt_file, chunksize):
+        n_rows += len(chunk)
+        n_chunks += 1
+        chunk = clean_func(chunk, file_date, bt_file.name)
+        dates.append(chunk["date"].unique())
+        partials.append(_partial_aggregate(chunk, weights, area_col))
+
+    partial = combine_partials(partials)
+    partial["file_date"] = pd.Timestamp(file_date)
+    dates = pd.DatetimeIndex(np.concatenate(dates) if dates else [], name="date")
+    seconds = time.perf_counter() - start
+    stats = {
+        "partition": bt_file.name,
+        "file_date": file_date,
+        "rows": n_rows,
+        "chunks": n_chunks,
+        "mb": bt_file.size / 2**20,
+        "seconds": seconds,
+        "rows_per_s": n_rows / seconds if seconds else np.nan,
+    }
+    return partial, dates.unique(), stats
+
+
+def combine_partials(partials):
+    """Sums partial aggregates over high street and day (and delivery, if
+    they have a file_date)"""
+    partials = [p for p in partials if len(p)]
+    if not partials:
+        return pd.DataFrame(columns=["highstreet_id", "date"])
+    keys = ["highstreet_id", "date"] + (
+        ["file_date"] if "file_date" in partials[0] else []
+    )
+    return pd.concat(partials, ignore_index=True).groupby(keys, as_index=False).sum()
+
+
+def _latest_deliveries(partial, latest):
+    """Rows of partial from the latest delivery of their date
+
+    :param partial: aggregates with date and file_date columns
+    :type partial: pandas dataframe
+    :param latest: latest file_date of each date
+    :type latest: pandas series
+    :rtype: pandas dataframe
+    """
+    if partial.empty:
+        return partial
+    keep = partial["file_date"].to_numpy() == latest.reindex(partial["date"]).to_numpy()
+    return partial[keep]
+
+
+def finalise(partial):
+    """Turns additive high street x day aggregates into weekly totals and
+    weighted averages"""
+    dates = partial["date"]
+    partial = (
+        partial.drop(columns=["date", "file_date"], errors="ignore")
+        .assign(week_start=dates - pd.to_timedelta(dates.dt.dayofweek, unit="D"))
+        .groupby(["highstreet_id", "week_start"], as_index=False)
+        .sum()
+    )
+    out = partial[["highstreet_id", "week_start", WEIGHT_COL]].copy()
+    for col in MEAN_COLS:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[col] = partial[f"{col}_wsum"] / partial[f"{col}_weight"].replace(
+                0, np.nan
+            )
+    return out.sort_values(["week_start", "highstreet_id"], ignore_index=True)
+
+
+def run_out_of_core(
+    kind="hex",
+    weights=None,
+    input_dir=None,
+    parquet_dir=None,
+    chunksize=500_000,
+    max_workers=None,
+    verbose=True,
+):
+    """High street x week aggregates of every delivery of one kind of daily
+    file, processed partition by partition
+
+    :param kind: 'lsoa', 'msoa' or 'hex', defaults to 'hex'
+    :type kind: str, optional
+    :param weights: area to high street weight table, defaults to the cached
+    table for kind
+    :type weights: pandas dataframe, optional
+    :param input_dir: folder the deliveries are received in, defaults to
+    BT_DIR/received
+    :type input_dir: str, optional
+    :param parquet_dir: read the Parquet copies staged by stage_to_parquet in
+    this folder instead of the csv files, defaults to None
+    :type parquet_dir: str, optional
+    :param chunksize: most raw rows each worker holds at once, defaults to
+    500,000
+    :type chunksize: int, optional
+    :param max_workers: number of worker processes, defaults to the number
+    of CPUs. 1 processes partitions in this process
+    :type max_workers: int, optional
+    :param verbose: print each partition's throughput, defaults to True
+    :type verbose: bool, optional
+    :return: one row per high street and week with total scaled_volume and
+    volume weighted dwell_time and loyalty_percentage, and one row of
+    throughput per partition
+    :rtype: tuple(pandas dataframe, pandas dataframe)
+    """
+    if weights is None:
+        weights = area_weights.load_area_weights(kind)
+
+    partitions = list_partitions(kind, input_dir)
+    if parquet_dir is not None:
+        partitions = [
+            (date, _parquet_file(parquet_dir, bt_file)) for date, bt_file in partitions
+        ]
+    jobs = [(kind, bt_file, date, weights, chunksize) for date, bt_file in partitions]
+
+    total, stats = None, []
+    latest = pd.Series(dtype="datetime64[ns]")
+
+    def collect(partial, dates, partition_stats):
+        nonlocal total, latest
+        # the latest delivery of each date so far; rows of earlier ones are
+        # dropped as partitions finish, so only one delivery's are kept
+        delivered = pd.Series(pd.Timestamp(partition_stats["file_date"]), index=dates)
+        latest = pd.concat([latest, delivered]).groupby(level=0).max()
+        total = combine_partials([total, partial] if total is not None else [partial])
+        total = _latest_deliveries(total, latest)
+        stats.append(partition_stats)
+        if verbose:
+            print(
+                f"{partition_stats['partition']} "
+                f"({partition_stats['file_date']:%Y-%m-%d}): "
+                f"{partition_stats['rows']} rows in "
+                f"{partition_stats['seconds']:.2f} s, "
+                f"{partition_stats['rows_per_s']:.0f} rows/s"
+            )
+
+    if max_workers == 1:
+        for job in jobs:
+            collect(*process_partition(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(process_partition, *job) for job in jobs]
+            for future in as_completed(futures):
+                collect(*future.result())
+
+    throughput = pd.DataFrame(stats)
+    if total is None or total.empty:
+        return pd.DataFrame(), throughput
+    return finalise(total), throughput.sort_values("file_date", ignore_index=True)
+
+
+def _parquet_path(parquet_dir, bt_file):
+    delivery = os.path.basename(os.path.dirname(os.path.dirname(bt_file.path)))
+    # strip every extension, e.g. .csv.gz
+    name = bt_file.name.split(".")[0]
+    return os.path.join(parquet_dir, delivery, f"{name}.parquet")
+
+
+def _parquet_file(parquet_dir, bt_file):
+    """The staged Parquet copy of a partition"""
+    path = _parquet_path(parquet_dir, bt_file)
+    return bt_scanner.BTFile(
+        path,
+        os.path.basename(path),
+        bt_file.delivery_date,
+        os.path.getsize(path),
+        os.path.getmtime(path),
+    )
+
+
+def stage_to_parquet(kind, parquet_dir, input_dir=None, chunksize=500_000):
+    """Copies every delivery's daily csv files of one kind to Parquet, chunk
+    by chunk, keeping the raw columns. Files already staged are skipped
+
+    :param kind: 'lsoa', 'msoa' or 'hex'
+    :type kind: str
+    :param parquet_dir: folder to write to, with one subfolder per delivery
+    :type parquet_dir: str
+    :param input_dir: folder the deliveries are received in, defaults to
+    BT_DIR/received
+    :type input_dir: str, optional
+    :param chunksize: rows per row group, defaults to 500,000
+    :type chunksize: int, optional
+    :return: paths of the files written
+    :rtype: list[str]
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    written = []
+    for _, bt_file in list_partitions(kind, input_dir):
+        out_path = _parquet_path(parquet_dir, bt_file)
+        if os.path.exists(out_path):
+            continue
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+        writer = None
+        # raw measure columns mix numbers and 'IDE', so are kept as strings
+        for chunk in _read_chunks(bt_file, chunksize, dtype=str):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+            written.append(out_path)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="High street x week aggregates of the BT daily archive"
+    )
+    parser.add_argument("--kind", default="hex", choices=sorted(DAILY_FILES))
+    parser.add_argument("--input-dir", help="defaults to BT_DIR/received")
+    parser.add_argument("--weights-dir", help="defaults to BT_AREA_WEIGHTS_DIR")
+    parser.add_argument("--parquet-dir", help="read/stage Parquet copies here")
+    parser.add_argument(
+        "--stage-parquet",
+        action="store_true",
+        help="copy the csv files to --parquet-dir before processing",
+    )
+    parser.add_argument("--chunksize", type=int, default=500_000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", help="csv file for the aggregates")
+    parser.add_argument("--throughput-output", help="csv file for the throughput")
+    args = parser.parse_args(argv)
+
+    if args.stage_parquet:
+        if args.parquet_dir is None:
+            parser.error("--stage-parquet needs --parquet-dir")
+        stage_to_parquet(args.kind, args.parquet_dir, args.input_dir, args.chunksize)
+
+    weights = area_weights.load_area_weights(args.kind, args.weights_dir)
+    result, throughput = run_out_of_core(
+        args.kind,
+        weights,
+        input_dir=args.input_dir,
+        parquet_dir=args.parquet_dir,
+        chunksize=args.chunksize,
+        max_workers=args.workers,
+    )
+
+    if throughput.empty:
+        print(f"No {args.kind} daily files found")
+        return
+    print(
+        f"\n{len(throughput)} partitions, {throughput['rows'].sum()} rows, "
+        f"{throughput['rows'].sum() / throughput['seconds'].sum():.0f} rows/s "
+        "per worker"
+    )
+    if args.output:
+        result.to_csv(args.output, index=False)
+    if args.throughput_output:
+        throughput.to_csv(args.throughput_output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,29 +10,51 @@ The file types are those we receive from BT:
     - MSOA monthly
     - TFL hex daily
     - TFL hex monthly
+
+There are two ways of loading a file:
+    - by default a file is skipped if all of its rows are already in the table
+        (matched on file_name), and reloaded if only some of them are
+    - with --incremental, rows are matched on their key (area id, date or
+        month/day_name, time_indicator) instead. Only rows that are new, or
+        whose values have changed, are written, through a staging table and
+        INSERT ... ON CONFLICT. This handles monthly deliveries that re-issue
+        overlapping date ranges without reloading or duplicating data, so
+        ingest time scales with the amount of new data. The loader creates
+        the unique index on the key columns that the upsert relies on.
+
+After each daily file is loaded, the periods it covers are recomputed in the
+pre-aggregated rollup tables (see highstreets/data/bt_rollups.py) unless
+--no-rollups is given.
+
+Deliveries are found with highstreets/data/bt_scanner.py and processed
+oldest first, the next files being read in the background while the current
+one is cleaned and loaded.
+
+Usage:
+    python -m highstreets.data.bt_read_raw [--incremental] [--no-rollups]
 """
-import os
+import argparse
 
+import numpy as np
 import pandas as pd
-from sqlalchemy import URL, MetaData, Table, create_engine, func, inspect, select
+from sqlalchemy import (
+    URL,
+    MetaData,
+    Table,
+    and_,
+    create_engine,
+    func,
+    inspect,
+    select,
+    text,
+)
 from tqdm import tqdm
 
 from highstreets import config
+from highstreets import instrumentation as instr
+from highstreets.data import bt_rollups, bt_scanner
 from highstreets.data import schema as bt_schema
 
-# this is where received data should be stored
-BT_INPUT_DIR = os.path.join(config.BT_DIR, "received")
-
-# each month's data is stored in a separate folder
-# and inside that folder is a 'files' folder, containing csv files with
-# the actual data for that month
-data_folders = [
-    os.path.join(BT_INPUT_DIR, f, "files")
-    for f in os.listdir(BT_INPUT_DIR)
-    if os.path.isdir(os.path.join(BT_INPUT_DIR, f))
-]
-
-
 # make database url for connecting to Postgres
 db_url = URL.create(
     "postgresql+psycopg2",
@@ -44,8 +66,9 @@ db_url = URL.create(
 )
 
 # make SQLAlchemy engine for connecting to Postgres
+# (no connection is made until the engine is first used)
 engine = create_engine(db_url)
-metadata_obj = MetaData(engine)
+metadata_obj = MetaData()
 
 # get expected file prefixes from config and assign a
 # corresponding table in the database
@@ -76,126 +99,295 @@ db_prefixes_tables = {
     ),
 }
 
-# for each file prefix check if the corresponding table exists
-# and store the results in a dictionary
-db_tables_exist = {
-    table: inspect(engine).has_table(table)
-    for _, (table, _) in db_prefixes_tables.items()
+# columns that uniquely identify a row in each table; the first column is the
+# area id and the second the date (or month) used to select a file's date range
+db_table_keys = {
+    "bt_footfall_lsoa_daily": ["lsoa_id", "date", "time_indicator"],
+    "bt_footfall_msoa_daily": ["msoa_id", "date", "time_indicator"],
+    "bt_footfall_lsoa_monthly": ["lsoa_id", "month", "day_name", "time_indicator"],
+    "bt_footfall_msoa_monthly": ["msoa_id", "month", "day_name", "time_indicator"],
+    "bt_footfall_tfl_hex_daily": ["hex_grid_id", "date", "time_indicator"],
+    "bt_footfall_tfl_hex_monthly": [
+        "hex_grid_id",
+        "month",
+        "day_name",
+        "time_indicator",
+    ],
 }
-# print whether each table exists
-print("Tables in database:")
-for table, exists in db_tables_exist.items():
-    print(f"{table}: {exists}")
-
-
-# loop over the folders for each month
-# each file for each month is processed in turn
-# processing involves validating the file's data against a schema for that file type
-# and then adding the data to the database if it has not already been added
-for dir in data_folders:
-    # extract date from folder name
-    date = pd.to_datetime(
-        dir.split("/")[-2][-10:].replace("_", "/"),
-        dayfirst=True,
+
+# columns recording where a row came from rather than what was measured,
+# these are updated on upsert but not compared
+provenance_columns = ["file_date", "file_name"]
+
+
+def count_file_records(table, file):
+    """Number of records in table that were loaded from file"""
+    table_obj = Table(table, metadata_obj, autoload_with=engine)
+    query = (
+        select(func.count()).select_from(table_obj).where(table_obj.c.file_name == file)
+    )
+    with engine.connect() as conn:
+        return conn.execute(query).scalar()
+
+
+def delete_file_records(table, file):
+    """Deletes the records in table that were loaded from file"""
+    table_obj = Table(table, metadata_obj, autoload_with=engine)
+    with engine.begin() as conn:
+        conn.execute(table_obj.delete().where(table_obj.c.file_name == file))
+
+
+def load_file(df, table, file, table_exists):
+    """Adds a cleaned file to table, matching rows on file_name: the file is
+    skipped if it has already been entered and re-entered if only some (or
+    too many) of its rows are present. Returns the number of rows written"""
+    n_records = count_file_records(table, file) if table_exists else 0
+    print(f"{n_records} records in {table} for {file}")
+
+    if n_records == df.shape[0]:
+        print(f"File {file} has already been entered into {table}")
+        print(f"Skipping {file} \n")
+        return 0
+
+    if n_records == 0:
+        print(f"File {file} has not been entered into {table}")
+        print(f"Reading {file} into {table} \n")
+    else:
+        if n_records < df.shape[0]:
+            print(f"File {file} has been incompletely entered into {table}")
+        else:
+            print(f"Too many records in {table} for {file}")
+        print(f"Removing {file} from {table} and re-entering \n")
+
+        # drop the records that have already been entered
+        delete_file_records(table, file)
+
+    # write the dataframe to the database
+    df.to_sql(
+        table,
+        engine,
+        if_exists="append",
+        index=False,
+    )
+    return len(df)
+
+
+def ensure_unique_index(table):
+    """Creates the unique index on the table's key columns that
+    INSERT ... ON CONFLICT relies on. Rows loaded before the index existed
+    may contain duplicate keys, in which case all but the most recently
+    received copy of each row are deleted first"""
+    keys = db_table_keys[table]
+    index_name = f"{table}_key_idx"
+    key_list = ", ".join(keys)
+
+    existing = {ix["name"] for ix in inspect(engine).get_indexes(table)}
+    if index_name in existing:
+        return
+
+    with engine.begin() as conn:
+        print(f"Creating unique index on {table} ({key_list})")
+        conn.execute(
+            text(
+                f"DELETE FROM {table} a USING {table} b "  # noqa: S608
+                f"WHERE ({', '.join('a.' + k for k in keys)}) "
+                f"= ({', '.join('b.' + k for k in keys)}) "
+                "AND (a.file_date, a.ctid) < (b.file_date, b.ctid)"
+            )
+        )
+        conn.execute(
+            text(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table} ({key_list})"
+            )
+        )
+
+
+def _comparable(df, keys):
+    """Casts categorical key columns to strings and the date (or month) key
+    to datetimes, so frames read from the database and freshly cleaned
+    frames can be merged on them"""
+    df = df.astype(
+        {c: str for c in keys if isinstance(df[c].dtype, pd.CategoricalDtype)}
+    )
+    date_col = keys[1]
+    if not pd.api.types.is_datetime64_any_dtype(df[date_col]):
+        df = df.assign(**{date_col: pd.to_datetime(df[date_col])})
+    return df
+
+
+def new_or_changed_rows(df, table):
+    """Compares a cleaned file with the rows already in the table for the
+    file's date range, returning only the rows that are new, or changed and
+    not already loaded from a more recent delivery
+
+    :param df: cleaned file
+    :type df: pandas dataframe
+    :param table: table the file is loaded into
+    :type table: str
+    :rtype: pandas dataframe
+    """
+    keys = db_table_keys[table]
+    date_col = keys[1]
+    value_cols = [c for c in df.columns if c not in keys + provenance_columns]
+
+    dates = pd.to_datetime(df[date_col])
+    table_obj = Table(table, metadata_obj, autoload_with=engine)
+    query = select(*[table_obj.c[c] for c in keys + value_cols + ["file_date"]]).where(
+        and_(
+            table_obj.c[date_col] >= dates.min().to_pydatetime(),
+            table_obj.c[date_col] <= dates.max().to_pydatetime(),
+        )
+    )
+    with engine.connect() as conn:
+        existing = pd.read_sql_query(query, conn, parse_dates=[date_col, "file_date"])
+
+    if existing.empty:
+        return df
+
+    merged = _comparable(df, keys).merge(
+        _comparable(existing, keys),
+        on=keys,
+        how="left",
+        suffixes=("", "_existing"),
+        indicator=True,
     )
+    is_new = (merged["_merge"] == "left_only").to_numpy()
+    is_changed = np.zeros(len(merged), dtype=bool)
+    for c in value_cols:
+        new, old = merged[c], merged[c + "_existing"]
+        is_changed |= ~((new == old) | (new.isna() & old.isna())).to_numpy()
+    is_newer = (merged["file_date"] >= merged["file_date_existing"]).to_numpy()
+
+    return df.loc[is_new | (is_changed & is_newer)]
+
+
+def upsert_file(df, table, table_exists):
+    """Writes the new or changed rows of a cleaned file into the table
+    through a staging table and INSERT ... ON CONFLICT on the table's key
+
+    :param df: cleaned file
+    :type df: pandas dataframe
+    :param table: table the file is loaded into
+    :type table: str
+    :param table_exists: whether the table already exists
+    :type table_exists: bool
+    :return: number of rows written
+    :rtype: int
+    """
+    if not table_exists:
+        # create the empty table with the file's column types
+        df.head(0).to_sql(table, engine, index=False)
+    ensure_unique_index(table)
+
+    with instr.stage(f"bt_read_raw.diff.{table}", rows_in=len(df)) as record:
+        df = new_or_changed_rows(df, table)
+        record["rows_out"] = len(df)
+
+    if df.empty:
+        return 0
+
+    keys = db_table_keys[table]
+    columns = ", ".join(df.columns)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in df.columns if c not in keys)
+    staging = f"{table}_staging"
 
-    # list the files in the directory
-    files = [f for f in os.listdir(dir) if os.path.isfile(os.path.join(dir, f))]
+    with engine.begin() as conn:
+        df.to_sql(staging, conn, if_exists="replace", index=False)
+        conn.execute(
+            text(
+                f"INSERT INTO {table} ({columns}) "  # noqa: S608
+                f"SELECT {columns} FROM {staging} "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates} "
+                f"WHERE {table}.file_date <= EXCLUDED.file_date"
+            )
+        )
+        conn.execute(text(f"DROP TABLE {staging}"))
+
+    return len(df)
+
+
+def main(incremental=False, rollups=True):
+    # for each file prefix check if the corresponding table exists
+    # and store the results in a dictionary
+    db_tables_exist = {
+        table: inspect(engine).has_table(table)
+        for _, (table, _) in db_prefixes_tables.items()
+    }
+    # print whether each table exists
+    print("Tables in database:")
+    for table, exists in db_tables_exist.items():
+        print(f"{table}: {exists}")
+
+    # hex dates used to be loaded as text, convert them before comparing
+    for table in bt_rollups.DAILY_TABLES:
+        if bt_rollups.ensure_date_column(engine, table):
+            print(f"Converted {table}.date to timestamps")
+
+    # scan the folders for each month, oldest delivery first, so re-issued
+    # rows end up with the latest values
+    # each file for each month is processed in turn, while the next files are
+    # read in the background
+    # processing involves validating the file's data against a schema for that
+    # file type and then adding the data to the database if it has not already
+    # been added
+    deliveries, _ = bt_scanner.scan_deliveries()
+    files = []
+    for delivery in deliveries:
+        for bt_file in delivery.files:
+            # if the file prefix does not match any of the prefixes in the
+            # config, skip it
+            if any(bt_file.name.startswith(prefix) for prefix in db_prefixes_tables):
+                files.append(bt_file)
+            else:
+                print(f"File {bt_file.name} does not match any known prefix")
+                print(f"Skipping {bt_file.name} \n")
     n_files = len(files)
 
-    # looping over the files, check if the file prefix matches
-    # a prefix in the config and if the date of the file is
-    # greater than the date of the most recent record in the
-    # corresponding table. If so, add the file's data to the database,
-    # skipping otherwise
-    for file_no, file in tqdm(enumerate(files)):
+    for file_no, (bt_file, data) in tqdm(enumerate(bt_scanner.prefetch(files))):
+        file, date = bt_file.name, bt_file.delivery_date
         # display progress
         print(f"Processing {file}, file {file_no+1} of {n_files}...")
 
-        # loop over the file prefixes looking for a match
-        # if a match is found, check if this file has already been added
-        # if only some rows have been added, drop those rows and re-add the file
-        # if the file has not been added, add it
-        # if the file has already been added, skip it
-        # if the file prefix does not match any of the prefixes in the config, skip it
-        matching_table_found = False
         for prefix, (table, clean_func) in db_prefixes_tables.items():
-            if file.startswith(prefix):
-                matching_table_found = True
-
-                # get the number of records in the table with the current
-                # file in the file_name column
-                if db_tables_exist[table]:
-                    table_obj = Table(table, metadata_obj, autoload_with=engine)
-                    query = (
-                        select(func.count())
-                        .select_from(table_obj)
-                        .where(table.c.file_name == file)
-                    )
-                    n_records = pd.read_sql_query(
-                        sql=query,
-                        con=engine.connect(),
-                    ).iloc[0, 0]
-                    # print the number of records
-                    print(f"{n_records} records in {table} for {file}")
-                else:
-                    n_records = 0
+            if not file.startswith(prefix):
+                continue
 
-                # read the file into a dataframe
-                df = pd.read_csv(os.path.join(dir, file), low_memory=False)
+            # read the file into a dataframe
+            with instr.stage(f"bt_read_raw.read_csv.{prefix}") as record:
+                df = pd.read_csv(data, low_memory=False)
+                record["rows_out"] = len(df)
 
-                # clean data and validate the dataframe against the schema
-                df = clean_func(df, date, file)
+            # clean data and validate the dataframe against the schema
+            df = clean_func(df, date, file)
 
-                if n_records == 0:
-                    print(f"File {file} has not been entered into {table}")
-                    print(f"Reading {file} into {table} \n")
-
-                    # write the dataframe to the database
-                    df.to_sql(
-                        table,
-                        engine,
-                        if_exists="append",
-                        index=False,
-                    )
-                elif n_records > 0 and n_records < df.shape[0]:
-                    print(f"File {file} has been incompletely entered into {table}")
-                    print(f"Deleting {file} from {table} and re-entering \n")
-
-                    # create table object for the table
-                    table_obj = Table(table, metadata_obj, autoload_with=engine)
-
-                    # drop the records that have already been entered
-                    table_obj.delete().where(table_obj.c.file_name == file).execute()
-
-                    # write the dataframe to the database
-                    df.to_sql(
-                        table,
-                        engine,
-                        if_exists="append",
-                        index=False,
-                    )
-                elif n_records == df.shape[0]:
-                    print(f"File {file} has already been entered into {table}")
-                    print(f"Skipping {file} \n")
+            with instr.stage(f"bt_read_raw.to_sql.{table}", rows_in=len(df)):
+                if incremental:
+                    n_written = upsert_file(df, table, db_tables_exist[table])
+                    print(f"{n_written} new or changed rows written to {table}\n")
                 else:
-                    print(f"Too many records in {table} for {file}")
-                    print(f"Removing {file} from {table} and re-entering \n")
+                    n_written = load_file(df, table, file, db_tables_exist[table])
+            db_tables_exist[table] = True
 
-                    # create table object for the table
-                    table_obj = Table(table, metadata_obj, autoload_with=engine)
+            # recompute the rollup periods covered by the file
+            if rollups and n_written and table in bt_rollups.DAILY_TABLES:
+                with instr.stage(f"bt_read_raw.rollups.{table}"):
+                    bt_rollups.refresh_rollups(
+                        engine, table, df["date"].min(), df["date"].max()
+                    )
 
-                    # drop the records that have already been entered
-                    table_obj.delete().where(table_obj.c.file_name == file).execute()
 
-                    # write the dataframe to the database
-                    df.to_sql(
-                        table,
-                        engine,
-                        if_exists="append",
-                        index=False,
-                    )
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load BT footfall deliveries")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="upsert only new or changed rows, matched on each table's key",
+    )
+    parser.add_argument(
+        "--no-rollups",
+        action="store_true",
+        help="don't refresh the rollup tables after loading daily files",
+    )
+    args = parser.parse_args()
 
-        if not matching_table_found:
-            print(f"File {file} does not match any known prefix")
-            print(f"Skipping {file} \n")
+    main(incremental=args.incremental, rollups=not args.no_rollups)
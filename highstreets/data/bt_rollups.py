@@ -0,0 +1,331 @@
+"""
+Pre-aggregated rollup tables of the BT daily footfall tables, kept up to date
+by the loader (bt_read_raw) after each file is ingested, and a query helper
+that answers requests from the coarsest rollup that can serve them.
+
+For each daily table (LSOA, MSOA, TfL hex) the following rollups are kept:
+    - <area>_day / _week / _month: the time bands of each day summed to a
+        day, and days summed to weeks (starting Monday) and months, per area
+    - highstreet_day / _week / _month: areas apportioned to high streets
+        using a lookup table in the database, bt_<area>_highstreet_lookup,
+        with columns (<area id>, highstreet_id, weight)
+    - borough_month: LSOAs summed to boroughs using bt_lsoa_borough_lookup,
+        with columns (lsoa_id, borough, weight)
+
+Rollups whose lookup table does not exist are skipped. In every rollup
+scaled_volume is summed, dwell_time and loyalty_percentage are averaged
+weighted by scaled_volume, and n_records counts the rows aggregated.
+
+Rollups are tables rather than Postgres materialised views so they can be
+refreshed incrementally: after a file is loaded only the periods overlapping
+the file's date range are deleted and recomputed.
+"""
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.types import Date, DateTime
+
+# date_trunc unit for each time grain, finest first
+TIME_GRAINS = {"day": "day", "week": "week", "month": "month"}
+
+# time grains a request can be answered from, coarsest first
+COMPATIBLE_GRAINS = {
+    "day": ["day"],
+    "week": ["week", "day"],
+    "month": ["month", "day"],
+}
+
+# area id column and name used in rollup table names for each daily table
+DAILY_TABLES = {
+    "bt_footfall_lsoa_daily": ("lsoa_id", "lsoa"),
+    "bt_footfall_msoa_daily": ("msoa_id", "msoa"),
+    "bt_footfall_tfl_hex_daily": ("hex_grid_id", "hex"),
+}
+
+
+def _rollup_specs():
+    """Every rollup, as dicts of name, source table, source area column,
+    area level, time grain and (optionally) lookup table and column"""
+    specs = []
+    for source, (area_col, area) in DAILY_TABLES.items():
+        for grain in TIME_GRAINS:
+            specs.append(
+                {
+                    "name": f"bt_footfall_{area}_{grain}",
+                    "source": source,
+                    "area_col": area_col,
+                    "area_level": area,
+                    "grain": grain,
+                    "lookup": None,
+                    "group_col": area_col,
+                }
+            )
+            specs.append(
+                {
+                    "name": f"bt_footfall_{area}_highstreet_{grain}",
+                    "source": source,
+                    "area_col": area_col,
+                    "area_level": "highstreet",
+                    "grain": grain,
+                    "lookup": f"bt_{area}_highstreet_lookup",
+                    "group_col": "highstreet_id",
+                }
+            )
+    specs.append(
+        {
+            "name": "bt_footfall_lsoa_borough_month",
+            "source": "bt_footfall_lsoa_daily",
+            "area_col": "lsoa_id",
+            "area_level": "borough",
+            "grain": "month",
+            "lookup": "bt_lsoa_borough_lookup",
+            "group_col": "borough",
+        }
+    )
+    return specs
+
+
+ROLLUPS = _rollup_specs()
+
+
+def _select_sql(spec):
+    """SELECT statement computing a rollup from its source table, with
+    :start and :end parameters bounding the source dates"""
+    unit = TIME_GRAINS[spec["grain"]]
+    weight = "l.weight" if spec["lookup"] else "1.0"
+    join = (
+        f"JOIN {spec['lookup']} l ON l.{spec['area_col']} = s.{spec['area_col']}"
+        if spec["lookup"]
+        else ""
+    )
+    group = f"l.{spec['group_col']}" if spec["lookup"] else f"s.{spec['group_col']}"
+
+    def weighted_mean(col):
+        return (
+            f"SUM(s.{col} * s.scaled_volume * {weight}) / NULLIF(SUM("
+            f"CASE WHEN s.{col} IS NOT NULL THEN s.scaled_volume * {weight} END"
+            f"), 0) AS {col}"
+        )
+
+    return (
+        f"SELECT {group} AS {spec['group_col']}, "  # noqa: S608
+        f"date_trunc('{unit}', s.date) AS period_start, "
+        f"SUM(s.scaled_volume * {weight}) AS scaled_volume, "
+        f"{weighted_mean('dwell_time')}, "
+        f"{weighted_mean('loyalty_percentage')}, "
+        "COUNT(*) AS n_records "
+        f"FROM {spec['source']} s {join} "
+        "WHERE s.date >= :start AND s.date < :end "
+        f"GROUP BY {group}, date_trunc('{unit}', s.date)"
+    )
+
+
+def _period_bounds(grain, start, end):
+    """Extends [start, end] to whole periods of the grain, returning the
+    first period start and the start of the period after the last"""
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if grain == "day":
+        return start.normalize(), end.normalize() + pd.Timedelta(days=1)
+    if grain == "week":
+        first = start.normalize() - pd.Timedelta(days=start.dayofweek)
+        last = end.normalize() - pd.Timedelta(days=end.dayofweek)
+        return first, last + pd.Timedelta(weeks=1)
+    first = start.normalize().replace(day=1)
+    return first, end.normalize().replace(day=1) + pd.DateOffset(months=1)
+
+
+def available_rollups(engine, source=None):
+    """Rollups whose source (and lookup) tables exist in the database
+
+    :param engine: SQLAlchemy engine
+    :type engine: sqlalchemy engine
+    :param source: only return rollups of this daily table, defaults to None
+    :type source: str, optional
+    :rtype: list[dict]
+    """
+    tables = set(inspect(engine).get_table_names())
+    return [
+        spec
+        for spec in ROLLUPS
+        if spec["source"] in tables
+        and (spec["lookup"] is None or spec["lookup"] in tables)
+        and (source is None or spec["source"] == source)
+    ]
+
+
+def ensure_date_column(engine, source):
+    """Converts the date column of a daily table to timestamps if it was
+    loaded as text (hex tables loaded before their dates were converted), so
+    the rollups can truncate and compare it as a date
+
+    :param engine: SQLAlchemy engine
+    :type engine: sqlalchemy engine
+    :param source: daily table
+    :type source: str
+    :return: whether the column was converted
+    :rtype: bool
+    """
+    if engine.dialect.name != "postgresql" or not inspect(engine).has_table(source):
+        return False
+    column = next(c for c in inspect(engine).get_columns(source) if c["name"] == "date")
+    if isinstance(column["type"], (Date, DateTime)):
+        return False
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"ALTER TABLE {source} ALTER COLUMN date TYPE timestamp "
+                "USING date::timestamp"
+            )
+        )
+    return True
+
+
+def _refresh_statements(spec, start, end):
+    """SQL statements (and their parameters) recomputing the periods of a
+    rollup that overlap the dates [start, end]"""
+    select_sql = _select_sql(spec)
+    first, stop = _period_bounds(spec["grain"], start, end)
+    bounds = {"start": first, "end": stop}
+    return [
+        (
+            f"CREATE TABLE IF NOT EXISTS {spec['name']} AS {select_sql} WITH NO DATA",
+            bounds,
+        ),
+        (
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {spec['name']}_key_idx "
+            f"ON {spec['name']} (period_start, {spec['group_col']})",
+            {},
+        ),
+        (
+            f"DELETE FROM {spec['name']} "  # noqa: S608
+            "WHERE period_start >= :start AND period_start < :end",
+            bounds,
+        ),
+        (f"INSERT INTO {spec['name']} {select_sql}", bounds),
+    ]
+
+
+def refresh_rollups(engine, source, start, end):
+    """Recomputes the periods of every rollup of source that overlap the
+    dates [start, end], creating rollup tables that don't exist yet
+
+    :param engine: SQLAlchemy engine
+    :type engine: sqlalchemy engine
+    :param source: daily table that has just been loaded
+    :type source: str
+    :param start: first date loaded
+    :type start: datetime-like
+    :param end: last date loaded
+    :type end: datetime-like
+    :return: names of the rollups refreshed
+    :rtype: list[str]
+    """
+    if source not in DAILY_TABLES:
+        return []
+
+    ensure_date_column(engine, source)
+    refreshed = []
+    for spec in available_rollups(engine, source):
+        with engine.begin() as conn:
+            for sql, params in _refresh_statements(spec, start, end):
+                conn.execute(text(sql), params)
+        refreshed.append(spec["name"])
+
+    return refreshed
+
+
+def rebuild_rollups(engine):
+    """Recomputes every rollup over the full date range of its source"""
+    for source in DAILY_TABLES:
+        if not inspect(engine).has_table(source):
+            continue
+        ensure_date_column(engine, source)
+        with engine.connect() as conn:
+            start, end = conn.execute(
+                text(f"SELECT MIN(date), MAX(date) FROM {source}")  # noqa: S608
+            ).one()
+        if start is not None:
+            refresh_rollups(engine, source, start, end)
+
+
+def choose_rollup(engine, area_level, grain, source=None):
+    """Picks the coarsest available rollup that can answer a request
+
+    :param engine: SQLAlchemy engine
+    :type engine: sqlalchemy engine
+    :param area_level: 'lsoa', 'msoa', 'hex', 'highstreet' or 'borough'
+    :type area_level: str
+    :param grain: 'day', 'week' or 'month'
+    :type grain: str
+    :param source: daily table to use when several could answer (e.g. LSOA
+    or hex data for high streets), defaults to None (any)
+    :type source: str, optional
+    :return: the rollup's spec, or None if no rollup can answer the request
+    :rtype: dict
+    """
+    available = available_rollups(engine, source)
+    for candidate_grain in COMPATIBLE_GRAINS[grain]:
+        for spec in available:
+            if spec["area_level"] == area_level and spec["grain"] == candidate_grain:
+                if inspect(engine).has_table(spec["name"]):
+                    return spec
+    return None
+
+
+def query_footfall(engine, area_level, grain, start, end, area_ids=None, source=None):
+    """Footfall by area and period, read from the coarsest rollup that
+    answers the request and re-aggregated in the database if the rollup is
+    finer than the requested grain
+
+    :param engine: SQLAlchemy engine
+    :type engine: sqlalchemy engine
+    :param area_level: 'lsoa', 'msoa', 'hex', 'highstreet' or 'borough'
+    :type area_level: str
+    :param grain: 'day', 'week' or 'month'
+    :type grain: str
+    :param start: first date of the request
+    :type start: datetime-like
+    :param end: last date of the request
+    :type end: datetime-like
+    :param area_ids: only return these areas, defaults to None (all)
+    :type area_ids: list, optional
+    :param source: daily table to use, defaults to None (any)
+    :type source: str, optional
+    :return: one row per area and period
+    :rtype: pandas dataframe
+    """
+    spec = choose_rollup(engine, area_level, grain, source)
+    if spec is None:
+        raise ValueError(f"No rollup available for {area_level} by {grain}")
+
+    unit = TIME_GRAINS[grain]
+    group = spec["group_col"]
+    first, stop = _period_bounds(grain, start, end)
+    params = {"start": first, "end": stop}
+
+    area_filter = ""
+    if area_ids is not None:
+        area_filter = f"AND {group} = ANY(:area_ids) "
+        params["area_ids"] = list(area_ids)
+
+    def weighted_mean(col):
+        return (
+            f"SUM({col} * scaled_volume) / NULLIF(SUM("
+            f"CASE WHEN {col} IS NOT NULL THEN scaled_volume END), 0) AS {col}"
+        )
+
+    sql = (
+        f"SELECT {group}, "  # noqa: S608
+        f"date_trunc('{unit}', period_start) AS period_start, "
+        "SUM(scaled_volume) AS scaled_volume, "
+        f"{weighted_mean('dwell_time')}, "
+        f"{weighted_mean('loyalty_percentage')}, "
+        "SUM(n_records) AS n_records "
+        f"FROM {spec['name']} "
+        "WHERE period_start >= :start AND period_start < :end "
+        f"{area_filter}"
+        f"GROUP BY {group}, date_trunc('{unit}', period_start) "
+        f"ORDER BY period_start, {group}"
+    )
+
+    with engine.connect() as conn:
+        return pd.read_sql_query(text(sql), conn, params=params)
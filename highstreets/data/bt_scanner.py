@@ -0,0 +1,310 @@
+"""
+Discovery of the BT deliveries in the received folder, and reading of their
+files ahead of processing.
+
+Deliveries are folders named <anything>_DD_MM_YYYY, each with a 'files'
+folder holding the csv files. scan_deliveries walks them with os.scandir,
+whose entries cache the type and stat information so each folder and file
+costs a single directory listing on network shares. Deliveries are returned
+oldest first; folders whose names don't end in a valid date are reported
+and skipped instead of failing the whole scan.
+
+Files may be plain csv, gzip (.csv.gz) or zstandard (.csv.zst) compressed
+csv, or zip archives of csv files. The format is detected from each file's
+first bytes rather than its extension, and each csv in a zip archive is
+listed as a file of its own (with the archive as path and the csv's name as
+member). open_file returns a binary stream of the csv, decompressed in a
+background thread so parsing doesn't wait on decompression. Reading .zst
+files needs the zstandard package (the 'zstd' extra).
+
+prefetch reads the (compressed) bytes of the next files in a background
+thread while the current one is processed, so reading from the share
+overlaps with cleaning and loading.
+
+Usage:
+    deliveries, malformed = scan_deliveries()
+    files = [f for delivery in deliveries for f in delivery.files]
+    for bt_file, data in prefetch(files):
+        df = pd.read_csv(data)
+"""
+import contextlib
+import functools
+import gzip
+import io
+import os
+import queue
+import re
+import threading
+import zipfile
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from highstreets import config
+
+Delivery = namedtuple("Delivery", ["date", "name", "files_dir", "files"])
+BTFile = namedtuple(
+    "BTFile",
+    ["path", "name", "delivery_date", "size", "mtime", "compression", "member"],
+    defaults=[None, None],
+)
+
+# leading bytes of each compressed format
+MAGIC_BYTES = {
+    "gzip": b"\x1f\x8b",
+    "zstd": b"\x28\xb5\x2f\xfd",
+    "zip": b"PK\x03\x04",
+}
+
+_FOLDER_DATE = re.compile(r"(\d{2})_(\d{2})_(\d{4})$")
+
+
+def parse_folder_date(name):
+    """Delivery date at the end of a folder name (DD_MM_YYYY)
+
+    :param name: folder name
+    :type name: str
+    :return: the date, or None if the name doesn't end in a valid date
+    :rtype: pandas timestamp
+    """
+    match = _FOLDER_DATE.search(name)
+    if match is None:
+        return None
+    day, month, year = (int(g) for g in match.groups())
+    try:
+        return pd.Timestamp(year=year, month=month, day=day)
+    except ValueError:
+        return None
+
+
+def detect_compression(head):
+    """Compression format from a file's first bytes
+
+    :param head: at least the first 4 bytes of the file
+    :type head: bytes
+    :return: 'gzip', 'zstd', 'zip', or None for uncompressed files
+    :rtype: str
+    """
+    for compression, magic in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def scan_files(files_dir, delivery_date):
+    """Lists the files of a delivery, with each csv in a zip archive listed
+    separately
+
+    :param files_dir: the delivery's 'files' folder
+    :type files_dir: str
+    :param delivery_date: date of the delivery
+    :type delivery_date: pandas timestamp
+    :return: the files, sorted by name
+    :rtype: list[BTFile]
+    """
+    files = []
+    with os.scandir(files_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            with open(entry.path, "rb") as f:
+                compression = detect_compression(f.read(4))
+            bt_file = BTFile(
+                entry.path,
+                entry.name,
+                delivery_date,
+                stat.st_size,
+                stat.st_mtime,
+                compression,
+            )
+            if compression == "zip":
+                with zipfile.ZipFile(entry.path) as archive:
+                    files.extend(
+                        bt_file._replace(
+                            name=os.path.basename(info.filename), member=info.filename
+                        )
+                        for info in archive.infolist()
+                        if not info.is_dir()
+                    )
+            else:
+                files.append(bt_file)
+    return sorted(files, key=lambda f: f.name)
+
+
+def scan_deliveries(input_dir=None, verbose=True):
+    """Finds the deliveries and their files
+
+    :param input_dir: folder the deliveries are received in, defaults to
+    BT_DIR/received
+    :type input_dir: str, optional
+    :param verbose: print the folders that are skipped, defaults to True
+    :type verbose: bool, optional
+    :return: the deliveries, oldest first, and the names of the folders
+    skipped because their name has no valid date or they have no 'files'
+    folder
+    :rtype: tuple(list[Delivery], list[str])
+    """
+    if input_dir is None:
+        input_dir = os.path.join(config.BT_DIR, "received")
+
+    deliveries, malformed = [], []
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            date = parse_folder_date(entry.name)
+            files_dir = os.path.join(entry.path, "files")
+            if date is None or not os.path.isdir(files_dir):
+                malformed.append(entry.name)
+                continue
+            deliveries.append(
+                Delivery(date, entry.name, files_dir, scan_files(files_dir, date))
+            )
+
+    if verbose:
+        for name in sorted(malformed):
+            print(f"Skipping folder {name}: not a DD_MM_YYYY delivery with files")
+
+    return sorted(deliveries, key=lambda d: (d.date, d.name)), sorted(malformed)
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class _ThreadedReader(io.RawIOBase):
+    """Binary stream of the output of another stream, read in a background
+    thread into a bounded queue of chunks"""
+
+    def __init__(self, open_stream, chunk_size=2**20, max_chunks=8):
+        super().__init__()
+        self._queue = queue.Queue(max_chunks)
+        self._buffer = memoryview(b"")
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._produce, args=(open_stream, chunk_size), daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, open_stream, chunk_size):
+        try:
+            with open_stream() as stream:
+                while not self._stop.is_set():
+                    chunk = stream.read(chunk_size)
+                    if not chunk or not self._put(chunk):
+                        break
+        except Exception as e:  # re-raised in the reading thread
+            self._put(e)
+            return
+        self._put(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self._eof:
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                raise item
+            if item == b"":
+                self._eof = True
+            else:
+                self._buffer = memoryview(item)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        self._stop.set()
+        super().close()
+
+
+@contextlib.contextmanager
+def _decompressed(bt_file, data):
+    """Decompressed stream of a file, from disk if data is None"""
+    with contextlib.ExitStack() as stack:
+        raw = (
+            data if data is not None else stack.enter_context(open(bt_file.path, "rb"))
+        )
+        if bt_file.compression == "gzip":
+            yield stack.enter_context(gzip.GzipFile(fileobj=raw))
+        elif bt_file.compression == "zstd":
+            try:
+                import zstandard
+            except ImportError as e:
+                raise ImportError(
+                    f"{bt_file.name} is zstd compressed, reading it needs the "
+                    "zstandard package (poetry install --extras zstd)"
+                ) from e
+
+            yield stack.enter_context(zstandard.ZstdDecompressor().stream_reader(raw))
+        elif bt_file.compression == "zip":
+            archive = stack.enter_context(zipfile.ZipFile(raw))
+            yield stack.enter_context(archive.open(bt_file.member))
+        else:
+            raise ValueError(f"Unknown compression: {bt_file.compression}")
+
+
+def open_file(bt_file, data=None):
+    """Opens a file as a binary stream of csv, decompressing it in a
+    background thread if it is compressed
+
+    :param bt_file: the file
+    :type bt_file: BTFile
+    :param data: the file's bytes, if already read, defaults to None (read
+    from disk)
+    :type data: binary file object, optional
+    :return: the stream, to be closed by the caller
+    :rtype: binary file object
+    """
+    if bt_file.compression is None:
+        return data if data is not None else open(bt_file.path, "rb")
+    return io.BufferedReader(
+        _ThreadedReader(functools.partial(_decompressed, bt_file, data))
+    )
+
+
+def prefetch(files, depth=2):
+    """Yields each file with its contents, reading up to depth files ahead
+    in a background thread. Files in the same zip archive are read once
+
+    :param files: files to read, in processing order
+    :type files: list[BTFile]
+    :param depth: number of files read ahead, defaults to 2. Memory use is
+    up to depth + 1 files, as the file last yielded may still be held while
+    the next are read
+    :type depth: int, optional
+    :return: (file, contents) pairs, the contents as a binary stream of
+    (decompressed) csv
+    :rtype: generator
+    """
+    files = list(files)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = deque()
+        next_file = 0
+        last_path, last_future = None, None
+        while next_file < len(files) or pending:
+            while next_file < len(files) and len(pending) < depth:
+                bt_file = files[next_file]
+                # members of a zip archive share one read of the archive
+                if bt_file.path != last_path:
+                    last_path = bt_file.path
+                    last_future = executor.submit(_read_bytes, bt_file.path)
+                pending.append((bt_file, last_future))
+                next_file += 1
+            bt_file, future = pending.popleft()
+            yield bt_file, open_file(bt_file, io.BytesIO(future.result()))
@@ -0,0 +1,353 @@
+"""
+Persistent, memory-mapped (weeks x high streets x metrics) cube of the
+weekly series used in modelling: every Mastercard spend metric
+([prefix]txn_{amt,cnt}_{we,wd}_{sector}) and footfall series, so the
+(weeks x high streets) arrays don't have to be pivoted again in every
+session.
+
+A cube is a directory holding:
+    - values.npy: float array of shape (capacity, high streets, metrics),
+        of which the first len(weeks) rows are in use. The spare rows let
+        new weeks be appended without rewriting the file; when they run out
+        the capacity is doubled. Metrics can be added later (add_metrics),
+        which rewrites the file
+    - axes.json: the labels of each axis (week starts, high street ids and
+        names, metric names)
+
+Cubes are opened with numpy memory mapping, so nothing is read until it is
+used and selecting a date range, a metric or a slice of high streets
+returns a view of the file rather than a copy.
+
+Usage:
+    cube = build_cube(cube_dir, hsd_yoy)      # or Cube.open(cube_dir)
+    array = cube.sel("2020-01-01", "2021-12-31", metrics="yoy_txn_amt_wd_retail")
+    cube.append(new_weeks)
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from highstreets import instrumentation as instr
+
+VALUES_FILE = "values.npy"
+AXES_FILE = "axes.json"
+
+
+def spend_metrics(df):
+    """Mastercard spend columns of a frame, [prefix]txn_{amt,cnt}_..."""
+    return [col for col in df.columns if "txn_amt_" in col or "txn_cnt_" in col]
+
+
+class Cube:
+    """A (weeks x high streets x metrics) cube stored in a directory
+
+    :param path: directory of the cube
+    :type path: str
+    :param mode: 'r' for read only, 'r+' to allow appending, defaults to 'r'
+    :type mode: str, optional
+    """
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, AXES_FILE)) as f:
+            axes = json.load(f)
+        self.weeks = pd.DatetimeIndex(axes["weeks"], name="week_start")
+        self.highstreets = pd.Index(axes["highstreet_id"], name="highstreet_id")
+        self.highstreet_names = pd.Index(
+            axes["highstreet_name"], name="highstreet_name"
+        )
+        self.metrics = pd.Index(axes["metrics"], name="metric")
+        self._storage = np.load(os.path.join(path, VALUES_FILE), mmap_mode=mode)
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        return cls(path, mode)
+
+    @classmethod
+    def create(
+        cls,
+        path,
+        highstreet_ids,
+        metrics,
+        highstreet_names=None,
+        capacity=256,
+        dtype="float64",
+    ):
+        """Creates an empty cube
+
+        :param path: directory of the cube, created if needed
+        :type path: str
+        :param highstreet_ids: high street axis
+        :type highstreet_ids: array-like
+        :param metrics: metric axis
+        :type metrics: list[str]
+        :param highstreet_names: names of the high streets, defaults to None
+        :type highstreet_names: array-like, optional
+        :param capacity: number of weeks to allocate, defaults to 256
+        :type capacity: int, optional
+        :param dtype: dtype of the values, defaults to 'float64'
+        :type dtype: str, optional
+        :return: the cube, opened for appending
+        :rtype: Cube
+        """
+        os.makedirs(path, exist_ok=True)
+        highstreet_ids = list(pd.Index(highstreet_ids))
+        if highstreet_names is None:
+            highstreet_names = [""] * len(highstreet_ids)
+
+        storage = np.lib.format.open_memmap(
+            os.path.join(path, VALUES_FILE),
+            mode="w+",
+            dtype=dtype,
+            shape=(capacity, len(highstreet_ids), len(metrics)),
+        )
+        storage[:] = np.nan
+        storage.flush()
+        del storage
+
+        _write_axes(
+            path,
+            {
+                "weeks": [],
+                "highstreet_id": [_to_json(i) for i in highstreet_ids],
+                "highstreet_name": [str(n) for n in highstreet_names],
+                "metrics": list(metrics),
+            },
+        )
+        return cls(path, mode="r+")
+
+    @property
+    def values(self):
+        """(weeks x high streets x metrics) memory-mapped view of the data"""
+        return self._storage[: len(self.weeks)]
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def _axis_slice(self, index, labels):
+        """Positions of labels on an axis, as a slice if they are
+        contiguous (so selecting them is a view) and an array otherwise"""
+        if labels is None:
+            return slice(None)
+        if isinstance(labels, slice):
+            return slice(
+                None if labels.start is None else index.get_loc(labels.start),
+                None if labels.stop is None else index.get_loc(labels.stop) + 1,
+            )
+        if np.isscalar(labels):
+            return index.get_loc(labels)
+        positions = index.get_indexer(labels)
+        if (positions < 0).any():
+            missing = np.asarray(labels)[positions < 0]
+            raise KeyError(f"Not in cube: {list(missing)}")
+        if len(positions) and (np.diff(positions) == 1).all():
+            return slice(positions[0], positions[-1] + 1)
+        return positions
+
+    def sel(self, start=None, end=None, highstreets=None, metrics=None):
+        """Selects part of the cube. Date ranges, single labels and
+        contiguous runs of high streets/metrics are views of the file;
+        other lists of high streets or metrics are copied
+
+        :param start: first week to include, defaults to None (first)
+        :type start: datetime-like, optional
+        :param end: last week to include, defaults to None (last)
+        :type end: datetime-like, optional
+        :param highstreets: a high street id, list of ids or slice of ids,
+        defaults to None (all)
+        :type highstreets: optional
+        :param metrics: a metric, list of metrics or slice of metrics,
+        defaults to None (all)
+        :type metrics: optional
+        :rtype: numpy array
+        """
+        weeks = slice(
+            None if start is None else self.weeks.searchsorted(pd.Timestamp(start)),
+            None
+            if end is None
+            else self.weeks.searchsorted(pd.Timestamp(end), side="right"),
+        )
+        hs = self._axis_slice(self.highstreets, highstreets)
+        metric = self._axis_slice(self.metrics, metrics)
+
+        values = self.values[weeks]
+        # index one axis at a time so two arrays of positions don't broadcast
+        values = values[:, hs]
+        if isinstance(hs, (int, np.integer)):
+            return values[:, metric]
+        return values[:, :, metric]
+
+    def to_frame(self, metric, start=None, end=None):
+        """One metric as a (weeks x high streets) dataframe, in the layout of
+        make_dataset.extract_data_array
+
+        :param metric: metric to extract
+        :type metric: str
+        :param start: first week to include, defaults to None (first)
+        :type start: datetime-like, optional
+        :param end: last week to include, defaults to None (last)
+        :type end: datetime-like, optional
+        :rtype: pandas dataframe
+        """
+        first = 0 if start is None else self.weeks.searchsorted(pd.Timestamp(start))
+        last = (
+            len(self.weeks)
+            if end is None
+            else self.weeks.searchsorted(pd.Timestamp(end), side="right")
+        )
+        columns = pd.MultiIndex.from_arrays(
+            [[metric] * len(self.highstreets), self.highstreets, self.highstreet_names],
+            names=[None, "highstreet_id", "highstreet_name"],
+        )
+        return pd.DataFrame(
+            self.sel(start, end, metrics=metric),
+            index=pd.Index(self.weeks[first:last], name="period_start"),
+            columns=columns,
+        )
+
+    def _reallocate(self, capacity, n_metrics):
+        """Rewrites the file with a new capacity and number of metrics"""
+        values_file = os.path.join(self.path, VALUES_FILE)
+        tmp_file = values_file + ".tmp"
+        new = np.lib.format.open_memmap(
+            tmp_file,
+            mode="w+",
+            dtype=self._storage.dtype,
+            shape=(capacity, len(self.highstreets), n_metrics),
+        )
+        new[:] = np.nan
+        n_used, n_old = len(self.weeks), self._storage.shape[2]
+        new[:n_used, :, :n_old] = self._storage[:n_used]
+        new.flush()
+        del new
+        self._storage = None
+        os.replace(tmp_file, values_file)
+        self._storage = np.load(values_file, mmap_mode="r+")
+
+    def add_metrics(self, metrics):
+        """Adds metrics (e.g. footfall series) to the cube, empty until
+        appended. This rewrites the file
+
+        :param metrics: names of the metrics to add
+        :type metrics: list[str]
+        """
+        if self.mode == "r":
+            raise ValueError("Cube is read only, open it with mode='r+'")
+        new = pd.Index(metrics).difference(self.metrics)
+        if len(new) == 0:
+            return
+        self._reallocate(self._storage.shape[0], len(self.metrics) + len(new))
+        self.metrics = self.metrics.append(new).rename("metric")
+        _write_axes(self.path, self._axes())
+
+    @instr.instrument()
+    def append(self, df):
+        """Adds weeks to the cube, or overwrites weeks already in it
+
+        :param df: one row per week and high street, with week_start,
+        highstreet_id and any of the cube's metrics as columns. Rows of high
+        streets not in the cube are ignored; weeks must not fall between
+        weeks already in the cube
+        :type df: pandas dataframe
+        :return: number of weeks added
+        :rtype: int
+        """
+        if self.mode == "r":
+            raise ValueError("Cube is read only, open it with mode='r+'")
+
+        week_starts = pd.DatetimeIndex(df["week_start"])
+        new_weeks = week_starts.unique().difference(self.weeks).sort_values()
+        if len(new_weeks) and len(self.weeks) and new_weeks[0] < self.weeks[-1]:
+            raise ValueError(
+                "New weeks must come after the last week in the cube "
+                f"({self.weeks[-1]:%Y-%m-%d}), rebuild it to insert earlier weeks"
+            )
+
+        weeks = self.weeks.append(new_weeks)
+        if len(weeks) > self._storage.shape[0]:
+            # double the capacity, so appending weeks one at a time only
+            # rewrites the file log(weeks) times
+            self._reallocate(
+                max(len(weeks), 2 * self._storage.shape[0]), len(self.metrics)
+            )
+
+        week_idx = weeks.get_indexer(week_starts)
+        hs_idx = self.highstreets.get_indexer(df["highstreet_id"])
+        keep = hs_idx >= 0
+        for metric in df.columns.intersection(self.metrics):
+            m = self.metrics.get_loc(metric)
+            self._storage[week_idx[keep], hs_idx[keep], m] = df[metric].to_numpy(
+                dtype=self._storage.dtype
+            )[keep]
+        self._storage.flush()
+
+        self.weeks = pd.DatetimeIndex(weeks, name="week_start")
+        _write_axes(self.path, self._axes())
+        return len(new_weeks)
+
+    def _axes(self):
+        return {
+            "weeks": [w.strftime("%Y-%m-%d") for w in self.weeks],
+            "highstreet_id": [_to_json(i) for i in self.highstreets],
+            "highstreet_name": list(self.highstreet_names),
+            "metrics": list(self.metrics),
+        }
+
+
+def _to_json(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _write_axes(path, axes):
+    # written to a temporary file first so a reader never sees half the file
+    tmp_file = os.path.join(path, AXES_FILE + ".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(axes, f)
+    os.replace(tmp_file, os.path.join(path, AXES_FILE))
+
+
+@instr.instrument()
+def build_cube(path, df, metrics=None, capacity=None, dtype="float64"):
+    """Builds a cube from weekly data, or appends the weeks of df that are
+    new if the cube already exists
+
+    :param path: directory of the cube
+    :type path: str
+    :param df: Mastercard (or footfall) data in wide format, one row per
+    week and high street, with week_start, highstreet_id and (optionally)
+    highstreet_name columns
+    :type df: pandas dataframe
+    :param metrics: columns to store, defaults to every spend column
+    :type metrics: list[str], optional
+    :param capacity: number of weeks to allocate, defaults to twice the
+    number of weeks in df
+    :type capacity: int, optional
+    :param dtype: dtype of the values, defaults to 'float64'
+    :type dtype: str, optional
+    :return: the cube, opened for appending
+    :rtype: Cube
+    """
+    if os.path.exists(os.path.join(path, AXES_FILE)):
+        cube = Cube.open(path, mode="r+")
+        cube.append(df[~df["week_start"].isin(cube.weeks)])
+        return cube
+
+    metrics = spend_metrics(df) if metrics is None else list(metrics)
+    highstreets = df.drop_duplicates("highstreet_id").sort_values("highstreet_id")
+    names = highstreets["highstreet_name"] if "highstreet_name" in highstreets else None
+    capacity = capacity or 2 * df["week_start"].nunique()
+
+    cube = Cube.create(
+        path,
+        highstreets["highstreet_id"],
+        metrics,
+        highstreet_names=names,
+        capacity=capacity,
+        dtype=dtype,
+    )
+    cube.append(df)
+    return cube
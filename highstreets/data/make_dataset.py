@@ -1,106 +1,219 @@
-# standard library
-import os
+import re
 
+import numpy as np
 import pandas as pd
-from dotenv import find_dotenv, load_dotenv
 
-load_dotenv(find_dotenv())
-
-DATA_PATH = os.environ.get("DATA_PATH")
-YOY_FILE = os.environ.get("YOY_FILE")
-PROFILE_FILE = os.environ.get("PROFILE_FILE")
-TC_LOOKUP = os.environ.get("TC_LOOKUP")
-PROJECT_ROOT = os.environ.get("PROJECT_ROOT")
+from highstreets import config
+from highstreets import instrumentation as instr
 
 
 def main():
     """Runs data processing scripts to turn raw data from (../raw) into
     cleaned data ready to be analyzed (saved in ../processed).
     """
-    print(DATA_PATH)
-    print("year over year file: ", YOY_FILE)
-    print("profile file: ", PROFILE_FILE)
+    print(config.DATA_PATH)
+    print("year over year file: ", config.YOY_FILE)
+    print("profile file: ", config.PROFILE_FILE)
 
 
-def avg_retail_wd_we(df, spend_col_prefix=""):
-    """Averages retail spending between weekend and weekday
+SPEND_GROUPS = ["txn_amt", "txn_cnt"]
+TIME_PERIODS = ["we", "wd"]
+ID_COLS = ["week_start", "highstreet_id", "highstreet_name"]
 
-    :param df: pandas dataframe produced by loading processed yoy
+
+def spend_columns(df, spend_col_prefix="", sectors=None):
+    """Finds the [prefix]txn_{amt,cnt}_{we,wd}_{sector} columns of a frame
+
+    :param df: Mastercard data in wide format
+    :type df: pandas dataframe
+    :param spend_col_prefix: prefix to the spend columns ('yoy_' for yoy
+    spend files), defaults to ''
+    :type spend_col_prefix: str, optional
+    :param sectors: sectors to keep, defaults to None (all)
+    :type sectors: list[str], optional
+    :return: (column, group, time period, sector) of each spend column
+    :rtype: list[tuple]
+    """
+    pattern = re.compile(
+        re.escape(spend_col_prefix)
+        + f"({'|'.join(SPEND_GROUPS)})_({'|'.join(TIME_PERIODS)})_(.+)"
+    )
+    columns = []
+    for col in df.columns:
+        match = pattern.fullmatch(str(col))
+        if match and (sectors is None or match.group(3) in sectors):
+            columns.append((col,) + match.groups())
+    return columns
+
+
+def _spend_array(df, spend_col_prefix="", sectors=None):
+    """Spend columns as a (rows x sectors x time periods x groups) array,
+    NaN where a column is missing"""
+    columns = spend_columns(df, spend_col_prefix, sectors)
+    found = list(dict.fromkeys(sector for _, _, _, sector in columns))
+    sectors = [s for s in sectors if s in found] if sectors is not None else found
+
+    values = np.full(
+        (len(df), len(sectors), len(TIME_PERIODS), len(SPEND_GROUPS)), np.nan
+    )
+    for col, grp, tp, sector in columns:
+        values[
+            :,
+            sectors.index(sector),
+            TIME_PERIODS.index(tp),
+            SPEND_GROUPS.index(grp),
+        ] = df[col].to_numpy(dtype=float)
+    return values, sectors
+
+
+def _repeat_ids(df, repeats):
+    return {col: np.repeat(df[col].to_numpy(), repeats) for col in ID_COLS}
+
+
+@instr.instrument()
+def spend_long_format(df, spend_col_prefix="", sectors=None):
+    """Melts every spend column into a long frame, with one row per week,
+    high street, sector and time period (weekend or weekday) and a txn_amt
+    and txn_cnt column
+
+    :param df: pandas dataframe produced by loading processed (yoy)
     Mastercard data
     :type df: pandas dataframe
     :param spend_col_prefix: prefix to the spend columns ('yoy_' for yoy
     spend files), defaults to ''
     :type spend_col_prefix: str, optional
-    :return: copy of df with a new column for the averaged spend
+    :param sectors: sectors to include, defaults to None (all)
+    :type sectors: list[str], optional
+    :return: the long frame, with sector and we_wd as categoricals
     :rtype: pandas dataframe
     """
+    values, sectors = _spend_array(df, spend_col_prefix, sectors)
+    n_rows, n_sectors, n_periods, _ = values.shape
+    values = values.reshape(-1, len(SPEND_GROUPS))
 
-    spend_categories = ["retail"]
-    time_periods = ["we", "wd"]
-    aggregation_groups = ["txn_amt", "txn_cnt"]
-
-    agg_cols = [
-        [
-            spend_col_prefix + grp + "_" + tp + "_" + cat
-            for cat in spend_categories
-            for tp in time_periods
-        ]
-        for grp in aggregation_groups
-    ]
+    long = pd.DataFrame(_repeat_ids(df, n_sectors * n_periods))
+    long["sector"] = pd.Categorical.from_codes(
+        np.tile(np.repeat(np.arange(n_sectors), n_periods), n_rows), sectors
+    )
+    long["we_wd"] = pd.Categorical.from_codes(
+        np.tile(np.arange(n_periods), n_rows * n_sectors), TIME_PERIODS
+    )
+    for i, grp in enumerate(SPEND_GROUPS):
+        long[grp] = values[:, i]
+    return long
 
-    df_minimal = df.copy()[["week_start", "highstreet_id", "highstreet_name"]]
-    for (i, col) in enumerate(aggregation_groups):
-        df_minimal.loc[:, col] = df[agg_cols[i]].agg("mean", 1)
 
-    df_minimal = df_minimal.rename(columns={"week_start": "period_start"})
-    df_minimal = df_minimal.set_index("period_start", drop=False)
+@instr.instrument()
+def avg_spend_wd_we(df, spend_col_prefix="", sectors=None):
+    """Averages spending between weekend and weekday, for every sector
 
-    return df_minimal
+    :param df: pandas dataframe produced by loading processed (yoy)
+    Mastercard data
+    :type df: pandas dataframe
+    :param spend_col_prefix: prefix to the spend columns ('yoy_' for yoy
+    spend files), defaults to ''
+    :type spend_col_prefix: str, optional
+    :param sectors: sectors to include, defaults to None (all)
+    :type sectors: list[str], optional
+    :return: one row per week, high street and sector, indexed by
+    period_start, with the averaged txn_amt and txn_cnt
+    :rtype: pandas dataframe
+    """
+    values, sectors = _spend_array(df, spend_col_prefix, sectors)
+    n_rows, n_sectors = values.shape[:2]
+
+    # mean of the time periods that aren't missing, as DataFrame.mean does
+    totals = np.zeros((n_rows, n_sectors, len(SPEND_GROUPS)))
+    counts = np.zeros((n_rows, n_sectors, len(SPEND_GROUPS)))
+    for t in range(len(TIME_PERIODS)):
+        present = ~np.isnan(values[:, :, t])
+        totals += np.where(present, values[:, :, t], 0)
+        counts += present
+    with np.errstate(invalid="ignore"):
+        means = (totals / counts).reshape(-1, len(SPEND_GROUPS))
+
+    columns = {
+        "period_start" if col == "week_start" else col: values
+        for col, values in _repeat_ids(df, n_sectors).items()
+    }
+    columns["sector"] = pd.Categorical.from_codes(
+        np.tile(np.arange(n_sectors), n_rows), sectors
+    )
+    for i, grp in enumerate(SPEND_GROUPS):
+        columns[grp] = means[:, i]
+    return pd.DataFrame(
+        columns, index=pd.Index(columns["period_start"], name="period_start")
+    )
 
 
-def stack_retail_we_wd(df, spend_col_prefix=""):
-    """Stacks weekend and weekday retail spending on top of each other
+@instr.instrument()
+def stack_spend_we_wd(df, spend_col_prefix="", sectors=None):
+    """Stacks weekend and weekday spending on top of each other, for every
+    sector. Weekend rows are dated the Saturday of their week
 
-    :param df: pandas dataframe produced by loading processed yoy
+    :param df: pandas dataframe produced by loading processed (yoy)
     Mastercard data
     :type df: pandas dataframe
     :param spend_col_prefix: prefix to the spend columns ('yoy_' for yoy
     spend files), defaults to ''
     :type spend_col_prefix: str, optional
-    :return: copy of df with a new column for the averaged spend
+    :param sectors: sectors to include, defaults to None (all)
+    :type sectors: list[str], optional
+    :return: one row per week, high street, sector and time period, indexed
+    and sorted by period_start
     :rtype: pandas dataframe
     """
+    stacked = spend_long_format(df, spend_col_prefix, sectors).rename(
+        columns={"week_start": "period_start"}
+    )
+    weekend = (stacked["we_wd"] == "we").to_numpy()
+    stacked["period_start"] = stacked["period_start"].to_numpy() + np.where(
+        weekend, np.timedelta64(5, "D"), np.timedelta64(0, "D")
+    )
+    # weekend rows first within a period, as when the periods were concatenated
+    order = np.lexsort((~weekend, stacked["period_start"].to_numpy()))
+    stacked = stacked.take(order)
+    return stacked.set_index(pd.Index(stacked["period_start"], name="period_start"))
 
-    time_periods = ["we", "wd"]
-    aggregation_groups = ["txn_amt", "txn_cnt"]
 
-    main_cols = ["week_start", "highstreet_id", "highstreet_name"]
+@instr.instrument()
+def avg_retail_wd_we(df, spend_col_prefix=""):
+    """Averages retail spending between weekend and weekday
 
-    dfs_to_stack = []
-    for tp in time_periods:
-        cols_to_stack = [
-            spend_col_prefix + grp + "_" + tp + "_retail" for grp in aggregation_groups
-        ]
-        df_temp = df[main_cols + cols_to_stack]
-        df_temp = df_temp.rename(columns={"week_start": "period_start"})
-        df_temp = df_temp.rename(columns=dict(zip(cols_to_stack, aggregation_groups)))
-        if "we" in tp:
-            tvec = df_temp["period_start"] + pd.DateOffset(days=5)
-            df_temp.loc[:, "we_wd"] = "we"
-        else:
-            tvec = df_temp["period_start"]
-            df_temp.loc[:, "we_wd"] = "wd"
+    :param df: pandas dataframe produced by loading processed yoy
+    Mastercard data
+    :type df: pandas dataframe
+    :param spend_col_prefix: prefix to the spend columns ('yoy_' for yoy
+    spend files), defaults to ''
+    :type spend_col_prefix: str, optional
+    :return: copy of df with a new column for the averaged spend
+    :rtype: pandas dataframe
+    """
+    return avg_spend_wd_we(df, spend_col_prefix, sectors=["retail"]).drop(
+        columns="sector"
+    )
 
-        df_temp.loc[:, "period_start"] = tvec
-        dfs_to_stack.append(df_temp)
 
-    df_minimal = pd.concat(dfs_to_stack)
-    df_minimal = df_minimal.set_index("period_start", drop=False)
-    df_minimal.sort_index(inplace=True)
+@instr.instrument()
+def stack_retail_we_wd(df, spend_col_prefix=""):
+    """Stacks weekend and weekday retail spending on top of each other
 
-    return df_minimal
+    :param df: pandas dataframe produced by loading processed yoy
+    Mastercard data
+    :type df: pandas dataframe
+    :param spend_col_prefix: prefix to the spend columns ('yoy_' for yoy
+    spend files), defaults to ''
+    :type spend_col_prefix: str, optional
+    :return: copy of df with a new column for the averaged spend
+    :rtype: pandas dataframe
+    """
+    stacked = stack_spend_we_wd(df, spend_col_prefix, sectors=["retail"])
+    return stacked[
+        ["period_start", "highstreet_id", "highstreet_name"] + SPEND_GROUPS + ["we_wd"]
+    ].astype({"we_wd": object})
 
 
+@instr.instrument()
 def extract_data_array(hsd_long_format, dates, column):
     """Extract hsd spend data array (with shape N_highstreets x N_weeks)
         and time vector (with shape N_weeks x 1) for modelling
@@ -45,6 +45,8 @@ import numpy as np
 import pandas as pd
 import pandera as pa
 
+from highstreets import instrumentation as instr
+
 days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
 times_of_day = ["Morning", "Noon", "Evening", "Night"]
 
@@ -230,10 +232,12 @@ def clean_base(df, file_date, file_name):
     return df
 
 
+@instr.instrument()
 def clean_hex_daily(df, file_date, file_name):
     df = clean_base(df, file_date, file_name)
 
-    # convert hex_grid_id to int
+    # convert data types
+    df["date"] = pd.to_datetime(df["date"])
     df["hex_grid_id"] = df["hex_grid_id"].astype(int)
     df["time_indicator"] = df["time_indicator"].str[:2].astype(int)
 
@@ -243,6 +247,7 @@ def clean_hex_daily(df, file_date, file_name):
     return df
 
 
+@instr.instrument()
 def clean_hex_monthly(df, file_date, file_name):
     df = clean_base(df, file_date, file_name)
 
@@ -258,6 +263,7 @@ def clean_hex_monthly(df, file_date, file_name):
     return df
 
 
+@instr.instrument()
 def clean_lsoa_daily(df, file_date, file_name):
     df = clean_base(df, file_date, file_name)
 
@@ -277,6 +283,7 @@ def clean_lsoa_daily(df, file_date, file_name):
     return df
 
 
+@instr.instrument()
 def clean_lsoa_monthly(df, file_date, file_name):
     df = clean_base(df, file_date, file_name)
 
@@ -297,6 +304,7 @@ def clean_lsoa_monthly(df, file_date, file_name):
     return df
 
 
+@instr.instrument()
 def clean_msoa_daily(df, file_date, file_name):
     df = clean_base(df, file_date, file_name)
 
@@ -316,6 +324,7 @@ def clean_msoa_daily(df, file_date, file_name):
     return df
 
 
+@instr.instrument()
 def clean_msoa_monthly(df, file_date, file_name):
     df = clean_base(df, file_date, file_name)
 
@@ -0,0 +1,309 @@
+"""
+Deterministic synthetic versions of the data sets used in the package, for
+benchmarking and trying out code without access to the real files.
+
+Every generator takes a scale argument: scale=1 produces roughly London-sized
+data (number of high streets, LSOAs, MSOAs and hex cells) and larger scales
+multiply the number of areas, e.g. scale=100 for stress testing. Output for a
+given (scale, seed) is always the same.
+
+The frames match the layout of the raw files:
+    - make_mcard_yoy: Mastercard weekly spend per high street (YOY_FILE)
+    - make_o2_hourly: O2 hourly footfall counts per MSOA
+    - make_hs_msoa_lookup: MSOA to high street lookup (HS_MSOA_LOOKUP)
+    - make_bt_daily / make_bt_monthly: BT footfall files as received, before
+        cleaning with the functions in highstreets.data.schema
+    - make_area_weights: BT area to high street weight table (see
+        highstreets.data.area_weights)
+"""
+import numpy as np
+import pandas as pd
+
+from highstreets.data import schema
+
+N_HIGHSTREETS = 600
+N_LSOA = 4835
+N_MSOA = 983
+N_HEX = 6000
+
+SECTORS = ["retail", "eating", "apparel"]
+TIME_PERIODS = ["we", "wd"]
+AGGREGATION_GROUPS = ["txn_amt", "txn_cnt"]
+O2_COUNT_TYPES = ["Visitor", "Resident", "Worker"]
+HEX_TIME_BANDS = [f"{h:02d}-{h + 3:02d}" for h in range(0, 24, 3)]
+
+# area id column for each type of BT file
+BT_AREA_COLUMNS = {"lsoa": "lsoa_id", "msoa": "msoa_id", "hex": "hex_grid_id"}
+BT_N_AREAS = {"lsoa": N_LSOA, "msoa": N_MSOA, "hex": N_HEX}
+
+
+def _n(base, scale):
+    return max(int(round(base * scale)), 1)
+
+
+def _recovery_curve(weeks, n_series, rng):
+    """Yoy-style series: flat, a lockdown dip and a noisy recovery"""
+    t = np.arange(len(weeks))[:, np.newaxis]
+    dip_start = np.searchsorted(weeks, pd.Timestamp("2020-03-23"))
+    depth = rng.uniform(0.3, 0.9, n_series)
+    rate = rng.uniform(0.005, 0.05, n_series)
+    level = 1 - depth * (t >= dip_start) * np.exp(
+        -rate * np.clip(t - dip_start, 0, None)
+    )
+    return level * rng.lognormal(0, 0.1, (len(weeks), n_series))
+
+
+def make_mcard_yoy(
+    scale=1,
+    start="2019-01-07",
+    end="2022-06-27",
+    spend_col_prefix="yoy_",
+    seed=0,
+):
+    """Mastercard weekly spend per high street, one row per high street and
+    week, with a [prefix]txn_{amt,cnt}_{we,wd}_{sector} column per sector
+
+    :param scale: multiple of the number of London high streets, defaults to 1
+    :type scale: float, optional
+    :param start: first week_start, defaults to '2019-01-07'
+    :type start: str, optional
+    :param end: last week_start, defaults to '2022-06-27'
+    :type end: str, optional
+    :param spend_col_prefix: prefix of the spend columns, defaults to 'yoy_'
+    :type spend_col_prefix: str, optional
+    :param seed: random seed, defaults to 0
+    :type seed: int, optional
+    :rtype: pandas dataframe
+    """
+    rng = np.random.default_rng(seed)
+    n_hs = _n(N_HIGHSTREETS, scale)
+    weeks = pd.date_range(start, end, freq="W-MON")
+
+    df = pd.DataFrame(
+        {
+            "yr": np.repeat(weeks.isocalendar().year.to_numpy(), n_hs),
+            "wk": np.repeat(weeks.isocalendar().week.to_numpy(), n_hs),
+            "week_start": np.repeat(weeks, n_hs),
+            "highstreet_id": np.tile(np.arange(1, n_hs + 1), len(weeks)),
+            "highstreet_name": np.tile(
+                [f"High Street {i}" for i in range(1, n_hs + 1)], len(weeks)
+            ),
+        }
+    )
+
+    base = _recovery_curve(weeks, n_hs, rng)
+    for grp in AGGREGATION_GROUPS:
+        for tp in TIME_PERIODS:
+            for sector in SECTORS:
+                values = base * rng.lognormal(0, 0.05, base.shape)
+                if spend_col_prefix != "yoy_":
+                    values = values * rng.uniform(1e3, 1e5, n_hs)
+                df[f"{spend_col_prefix}{grp}_{tp}_{sector}"] = values.reshape(-1)
+
+    return df
+
+
+def make_o2_hourly(
+    scale=1,
+    start="2021-05-01",
+    end="2022-04-30",
+    count_types=O2_COUNT_TYPES,
+    seed=0,
+):
+    """O2 hourly footfall counts per MSOA, one row per MSOA, day and count
+    type, with one column per hour (h00 to h23)
+
+    :param scale: multiple of the number of London MSOAs, defaults to 1
+    :type scale: float, optional
+    :param start: first count_date, defaults to '2021-05-01'
+    :type start: str, optional
+    :param end: last count_date, defaults to '2022-04-30'
+    :type end: str, optional
+    :param count_types: count types to generate, defaults to
+    ('Visitor', 'Resident', 'Worker')
+    :type count_types: list[str], optional
+    :param seed: random seed, defaults to 0
+    :type seed: int, optional
+    :rtype: pandas dataframe
+    """
+    rng = np.random.default_rng(seed)
+    n_msoa = _n(N_MSOA, scale)
+    days = pd.date_range(start, end, freq="D")
+    msoas = [f"E0200{i:04d}" for i in range(n_msoa)]
+
+    n_rows = n_msoa * len(days) * len(count_types)
+    df = pd.DataFrame(
+        {
+            "msoa11cd": np.tile(np.repeat(msoas, len(count_types)), len(days)),
+            "count_date": np.repeat(days, n_msoa * len(count_types)),
+            "count_type": np.tile(count_types, n_msoa * len(days)),
+        }
+    )
+
+    hours = np.arange(24)
+    daily_shape = np.exp(-0.5 * ((hours - 13) / 4) ** 2) + 0.05
+    size = rng.lognormal(6, 1, n_msoa)[
+        np.tile(np.repeat(np.arange(n_msoa), len(count_types)), len(days))
+    ]
+    counts = rng.poisson(size[:, np.newaxis] * daily_shape, (n_rows, 24))
+    for h in hours:
+        df[f"h{h:02d}"] = counts[:, h]
+
+    return df
+
+
+def make_hs_msoa_lookup(scale=1, seed=0):
+    """Lookup from MSOA to the high streets within it
+
+    :param scale: multiple of London size, defaults to 1
+    :type scale: float, optional
+    :param seed: random seed, defaults to 0
+    :type seed: int, optional
+    :return: one row per (msoa11cd, highstreet) pair
+    :rtype: pandas dataframe
+    """
+    rng = np.random.default_rng(seed)
+    n_hs = _n(N_HIGHSTREETS, scale)
+    n_msoa = _n(N_MSOA, scale)
+    msoa_idx = rng.integers(0, n_msoa, n_hs)
+
+    return pd.DataFrame(
+        {
+            "msoa11cd": [f"E0200{i:04d}" for i in msoa_idx],
+            "highstreet_id": np.arange(1, n_hs + 1),
+            "highstreet_name": [f"High Street {i}" for i in range(1, n_hs + 1)],
+        }
+    )
+
+
+def _area_ids(kind, n_areas):
+    if kind == "lsoa":
+        return np.array([f"E0100{i:04d}" for i in range(n_areas)])
+    if kind == "msoa":
+        return np.array([f"E0200{i:04d}" for i in range(n_areas)])
+    if kind == "hex":
+        return np.arange(1, n_areas + 1)
+    raise ValueError(f"Unknown BT file kind: {kind}")
+
+
+def _bt_measures(df, kind, n_rows, rng, ide_fraction):
+    """Adds the measure columns, with a fraction of 'IDE' (insufficient
+    data) entries as in the raw files"""
+    measures = {
+        "scaled_volume": rng.lognormal(6, 1.5, n_rows),
+        "loyalty_percentage": rng.uniform(1, 100, n_rows),
+        "dwell_time": rng.lognormal(4, 0.5, n_rows),
+    }
+    if kind != "hex":
+        measures["worker_population_percentage"] = rng.uniform(1, 100, n_rows)
+        measures["resident_population_percentage"] = rng.uniform(1, 100, n_rows)
+
+    for col, values in measures.items():
+        values = values.round(2).astype(object)
+        values[rng.random(n_rows) < ide_fraction] = "IDE"
+        df[col] = values
+
+    return df
+
+
+def make_bt_daily(kind, scale=1, month="2022-01-01", ide_fraction=0.01, seed=0):
+    """A BT daily file (LSOA, MSOA or TfL hex) as received, covering one month
+
+    :param kind: 'lsoa', 'msoa' or 'hex'
+    :type kind: str
+    :param scale: multiple of the number of London areas, defaults to 1
+    :type scale: float, optional
+    :param month: first day of the month covered, defaults to '2022-01-01'
+    :type month: str, optional
+    :param ide_fraction: fraction of measures reported as 'IDE', defaults
+    to 0.01
+    :type ide_fraction: float, optional
+    :param seed: random seed, defaults to 0
+    :type seed: int, optional
+    :rtype: pandas dataframe
+    """
+    rng = np.random.default_rng(seed)
+    areas = _area_ids(kind, _n(BT_N_AREAS[kind], scale))
+    days = pd.date_range(month, periods=pd.Timestamp(month).days_in_month, freq="D")
+    times = HEX_TIME_BANDS if kind == "hex" else schema.times_of_day
+
+    n_rows = len(areas) * len(days) * len(times)
+    df = pd.DataFrame(
+        {
+            BT_AREA_COLUMNS[kind]: np.repeat(areas, len(days) * len(times)),
+            "date": np.tile(
+                np.repeat(days.strftime("%Y-%m-%d"), len(times)), len(areas)
+            ),
+            "time_indicator": np.tile(times, len(areas) * len(days)),
+        }
+    )
+
+    return _bt_measures(df, kind, n_rows, rng, ide_fraction)
+
+
+def make_bt_monthly(kind, scale=1, month="2022-01-01", ide_fraction=0.01, seed=0):
+    """A BT monthly file (LSOA, MSOA or TfL hex) as received, with one row
+    per area, day of the week and time of day
+
+    :param kind: 'lsoa', 'msoa' or 'hex'
+    :type kind: str
+    :param scale: multiple of the number of London areas, defaults to 1
+    :type scale: float, optional
+    :param month: month covered, defaults to '2022-01-01'
+    :type month: str, optional
+    :param ide_fraction: fraction of measures reported as 'IDE', defaults
+    to 0.01
+    :type ide_fraction: float, optional
+    :param seed: random seed, defaults to 0
+    :type seed: int, optional
+    :rtype: pandas dataframe
+    """
+    rng = np.random.default_rng(seed)
+    areas = _area_ids(kind, _n(BT_N_AREAS[kind], scale))
+    times = HEX_TIME_BANDS if kind == "hex" else schema.times_of_day
+    days = schema.days
+
+    n_rows = len(areas) * len(days) * len(times)
+    df = pd.DataFrame(
+        {
+            BT_AREA_COLUMNS[kind]: np.repeat(areas, len(days) * len(times)),
+            "month": month,
+            "day_name": np.tile(np.repeat(days, len(times)), len(areas)),
+            "time_indicator": np.tile(times, len(areas) * len(days)),
+        }
+    )
+
+    return _bt_measures(df, kind, n_rows, rng, ide_fraction)
+
+
+def make_area_weights(kind, scale=1, max_areas=8, seed=0):
+    """BT area to high street weight table, with each high street
+    overlapping between 1 and max_areas areas
+
+    :param kind: 'lsoa', 'msoa' or 'hex'
+    :type kind: str
+    :param scale: multiple of London size, defaults to 1
+    :type scale: float, optional
+    :param max_areas: most areas a high street overlaps, defaults to 8
+    :type max_areas: int, optional
+    :param seed: random seed, defaults to 0
+    :type seed: int, optional
+    :return: one row per (area, high street) pair, with the fraction of the
+    area within the high street
+    :rtype: pandas dataframe
+    """
+    rng = np.random.default_rng(seed)
+    n_hs = _n(N_HIGHSTREETS, scale)
+    areas = _area_ids(kind, _n(BT_N_AREAS[kind], scale))
+
+    n_overlaps = rng.integers(1, max_areas + 1, n_hs)
+    df = pd.DataFrame(
+        {
+            BT_AREA_COLUMNS[kind]: areas[rng.integers(0, len(areas), n_overlaps.sum())],
+            "highstreet_id": np.repeat(np.arange(1, n_hs + 1), n_overlaps),
+            "weight": rng.uniform(0.01, 0.5, n_overlaps.sum()).round(4),
+        }
+    )
+    return df.drop_duplicates([BT_AREA_COLUMNS[kind], "highstreet_id"]).reset_index(
+        drop=True
+    )
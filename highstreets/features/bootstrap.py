@@ -0,0 +1,247 @@
+"""
+Bootstrap confidence intervals for the recovery statistics of every high
+street (the mean and the least squares slope of its series, as used by
+get_fit_lines and group_highstreets), and for the group means of the
+group_highstreets quadrants.
+
+Each resample draws the weeks of the series with replacement. The resample
+indices are drawn once, as a (resamples x weeks) matrix shared by every high
+street, and turned into a matrix of counts (how often each week is drawn), so
+the sums behind every mean and slope are matrix products:
+    counts (resamples x weeks) @ series (weeks x high streets)
+which gives the estimates of all high streets in all resamples at once.
+Resamples are processed in blocks of block_size, so memory is bounded by the
+block rather than the number of resamples.
+
+Each resample's means and slopes are also grouped as group_highstreets
+groups them (into n_grp rows by mean, then n_grp columns by slope within
+each row), giving how often each high street stays in its group.
+
+Usage:
+    data = make_dataset.extract_data_array(hsd_long, dates, "txn_amt")
+    highstreets, groups = bootstrap_recovery(data, n_resamples=1000)
+"""
+import numpy as np
+import pandas as pd
+
+from highstreets import instrumentation as instr
+
+
+def resample_indices(n_obs, n_resamples, random_state=0):
+    """(resamples x observations) indices of observations drawn with
+    replacement
+
+    :param n_obs: number of observations (weeks)
+    :type n_obs: int
+    :param n_resamples: number of resamples
+    :type n_resamples: int
+    :param random_state: random seed, defaults to 0
+    :type random_state: int, optional
+    :rtype: numpy array
+    """
+    rng = np.random.default_rng(random_state)
+    return rng.integers(0, n_obs, size=(n_resamples, n_obs))
+
+
+def _counts(indices, n_obs):
+    """(resamples x observations) number of times each observation is drawn"""
+    rows = np.arange(len(indices))[:, None] * n_obs
+    return np.bincount(
+        (rows + indices).ravel(), minlength=len(indices) * n_obs
+    ).reshape(len(indices), n_obs)
+
+
+@instr.instrument()
+def bootstrap_estimates(t, values, indices, block_size=200):
+    """Mean and least squares slope of every series in every resample
+
+    :param t: (observations) time of each observation, e.g. days since the
+    start date as in get_fit_lines
+    :type t: numpy array
+    :param values: (observations x series) values, NaN where missing
+    :type values: numpy array
+    :param indices: (resamples x observations) resample indices, as returned
+    by resample_indices
+    :type indices: numpy array
+    :param block_size: number of resamples computed at once, defaults to 200
+    :type block_size: int, optional
+    :return: (resamples x series) means and slopes, NaN where a resample
+    has no observations (means) or fewer than two distinct weeks (slopes)
+    :rtype: tuple(numpy array, numpy array)
+    """
+    t = np.asarray(t, dtype=float)
+    values = np.asarray(values, dtype=float)
+    # time from the middle of the period, so the sums stay small
+    t = t - t.mean()
+
+    present = (~np.isnan(values)).astype(float)
+    y = np.where(present > 0, values, 0)
+    t_present = t[:, None] * present
+    sums = {
+        "n": present,
+        "t": t_present,
+        "tt": t[:, None] * t_present,
+        "y": y,
+        "ty": t[:, None] * y,
+    }
+
+    n_resamples = len(indices)
+    means = np.empty((n_resamples, values.shape[1]))
+    slopes = np.empty((n_resamples, values.shape[1]))
+    for start in range(0, n_resamples, block_size):
+        block = slice(start, start + block_size)
+        counts = _counts(indices[block], len(t)).astype(float)
+        s = {name: counts @ matrix for name, matrix in sums.items()}
+        # a resample with fewer than two distinct weeks has no slope
+        denominator = s["n"] * s["tt"] - s["t"] ** 2
+        degenerate = denominator <= 1e-9 * s["n"] * s["tt"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means[block] = s["y"] / s["n"]
+            slopes[block] = np.where(
+                degenerate, np.nan, (s["n"] * s["ty"] - s["t"] * s["y"]) / denominator
+            )
+    return means, slopes
+
+
+def _split_groups(n, n_grp):
+    """Group of each position of n sorted values split as np.array_split
+    splits them"""
+    sizes = [len(a) for a in np.array_split(np.arange(n), n_grp)]
+    return np.repeat(np.arange(n_grp), sizes), sizes
+
+
+def quadrant_groups(means, slopes, n_grp=4):
+    """Rows and columns of the group_highstreets groups, for many sets of
+    estimates at once
+
+    :param means: (sets x high streets) means, split into n_grp rows
+    :type means: numpy array
+    :param slopes: (sets x high streets) slopes, split into n_grp columns
+    within each row
+    :type slopes: numpy array
+    :param n_grp: number of rows and columns, defaults to 4
+    :type n_grp: int, optional
+    :return: (sets x high streets) rows and columns, from 0
+    :rtype: tuple(numpy array, numpy array)
+    """
+    means = np.atleast_2d(means)
+    slopes = np.atleast_2d(slopes)
+    n_sets, n_hs = means.shape
+    sets = np.arange(n_sets)[:, None]
+    row_of_position, row_sizes = _split_groups(n_hs, n_grp)
+
+    rows = np.empty((n_sets, n_hs), dtype=int)
+    rows[sets, np.argsort(means, axis=1, kind="stable")] = row_of_position
+
+    # positions ordered by row then slope have fixed columns, as the row sizes
+    # are the same in every set
+    column_of_position = np.concatenate(
+        [_split_groups(size, n_grp)[0] for size in row_sizes]
+    )
+    columns = np.empty((n_sets, n_hs), dtype=int)
+    columns[sets, np.lexsort((slopes, rows), axis=1)] = column_of_position
+    return rows, columns
+
+
+def _group_means(estimates, membership):
+    """(sets x groups) means of the non-missing estimates of each group's
+    members"""
+    present = ~np.isnan(estimates)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (np.where(present, estimates, 0) @ membership) / (present @ membership)
+
+
+def _percentiles(draws, level):
+    tail = (1 - level) / 2 * 100
+    with np.errstate(invalid="ignore"):
+        return np.nanpercentile(draws, [tail, 100 - tail], axis=0)
+
+
+@instr.instrument()
+def bootstrap_recovery(
+    data,
+    start_date=None,
+    n_grp=4,
+    n_resamples=1000,
+    level=0.95,
+    block_size=200,
+    random_state=0,
+):
+    """Bootstrap intervals of the mean and slope of every high street, of the
+    means of the group_highstreets groups, and the stability of each high
+    street's group
+
+    :param data: weekly series, one row per week and one column per high
+    street, as returned by make_dataset.extract_data_array
+    :type data: pandas dataframe
+    :param start_date: date slopes are measured from, as in get_fit_lines,
+    defaults to None (the first week). Only the intercept depends on it
+    :type start_date: datetime-like, optional
+    :param n_grp: number of rows and columns of groups, defaults to 4
+    :type n_grp: int, optional
+    :param n_resamples: number of resamples, defaults to 1000
+    :type n_resamples: int, optional
+    :param level: coverage of the intervals, defaults to 0.95
+    :type level: float, optional
+    :param block_size: number of resamples computed at once, defaults to 200
+    :type block_size: int, optional
+    :param random_state: random seed, defaults to 0
+    :type random_state: int, optional
+    :return: one row per high street with its mean and slope, their
+    intervals, its group and the share of resamples in which it stays in the
+    group (and in its row and column); and one row per group with the
+    intervals of the group's mean of means and of slopes
+    :rtype: tuple(pandas dataframe, pandas dataframe)
+    """
+    tvec = pd.DatetimeIndex(data.index)
+    t0 = pd.to_datetime(start_date) if start_date is not None else tvec[0]
+    t = (tvec - t0).days.to_numpy(dtype=float)
+    values = data.to_numpy(dtype=float)
+
+    means, slopes = bootstrap_estimates(
+        t, values, np.arange(len(t))[None, :], block_size
+    )
+    draws = bootstrap_estimates(
+        t,
+        values,
+        resample_indices(len(t), n_resamples, random_state),
+        block_size,
+    )
+    rows, columns = quadrant_groups(means, slopes, n_grp)
+    draw_rows, draw_columns = quadrant_groups(*draws, n_grp)
+    same_row = draw_rows == rows
+    same_column = draw_columns == columns
+
+    highstreets = pd.DataFrame(
+        {"mean": means[0], "slope": slopes[0]}, index=data.columns
+    )
+    for name, estimates in zip(["mean", "slope"], draws):
+        highstreets[f"{name} lower"], highstreets[f"{name} upper"] = _percentiles(
+            estimates, level
+        )
+    highstreets["group"] = rows[0] * n_grp + columns[0] + 1
+    highstreets["row"] = rows[0] + 1
+    highstreets["column"] = columns[0] + 1
+    highstreets["group stability"] = (same_row & same_column).mean(axis=0)
+    highstreets["row stability"] = same_row.mean(axis=0)
+    highstreets["column stability"] = same_column.mean(axis=0)
+
+    # group means of every resample, for the groups of the full data, with
+    # (high streets x groups) matrix products
+    group_codes = highstreets["group"].to_numpy() - 1
+    membership = np.zeros((len(group_codes), n_grp * n_grp))
+    membership[np.arange(len(group_codes)), group_codes] = 1
+
+    groups = pd.DataFrame(index=pd.RangeIndex(1, n_grp * n_grp + 1, name="group"))
+    groups["size"] = np.bincount(group_codes, minlength=n_grp * n_grp)
+    for name, full, estimates in zip(["mean", "slope"], (means, slopes), draws):
+        groups[name] = _group_means(full, membership)[0]
+        groups[f"{name} lower"], groups[f"{name} upper"] = _percentiles(
+            _group_means(estimates, membership), level
+        )
+    groups["stability"] = (
+        pd.Series(highstreets["group stability"].to_numpy())
+        .groupby(group_codes + 1)
+        .mean()
+    )
+    return highstreets, groups
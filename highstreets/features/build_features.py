@@ -1,19 +1,13 @@
-import os
 from itertools import product
 
 import numpy as np
 import pandas as pd
-from dotenv import find_dotenv, load_dotenv
-from scipy import stats as spstat
-from sklearn.linear_model import HuberRegressor, LinearRegression
-from sklearn.multioutput import MultiOutputRegressor
 
-load_dotenv(find_dotenv())
-
-YOY_FILE = os.environ.get("YOY_FILE")
-O2_CLUSTERS = os.environ.get("O2_CLUSTERS")
+from highstreets import config
+from highstreets import instrumentation as instr
 
 
+@instr.instrument()
 def clean_hs_profiles(stats):
     """Cleans high street profile data
 
@@ -98,6 +92,7 @@ def clean_hs_profiles(stats):
     return stats
 
 
+@instr.instrument()
 def add_split_group_vals(data, n_grp=4, split_cols=("mean 2020", "slope 2020")):
 
     # sort by the first column
@@ -128,10 +123,13 @@ def add_split_group_vals(data, n_grp=4, split_cols=("mean 2020", "slope 2020")):
     return data
 
 
-def append_profile_features(hsp, data, reg_model):
+@instr.instrument()
+def append_profile_features(hsp, data, reg_model, hs_o2_clusters=None):
 
-    hsd_yoy = pd.read_csv(YOY_FILE, parse_dates=["week_start"])
-    hs_o2_clusters = pd.read_csv(O2_CLUSTERS)
+    hsd_yoy = pd.read_csv(config.YOY_FILE, parse_dates=["week_start"])
+    if hs_o2_clusters is None:
+        # clusters written by highstreets.features.clustering.save_clusters
+        hs_o2_clusters = pd.read_csv(config.O2_CLUSTERS)
 
     means_2020 = (
         data.loc["2020-03-14":"2020-11-01", :]
@@ -206,16 +204,19 @@ def append_profile_features(hsp, data, reg_model):
     stats["slope 2020"] = [x[0] for x in slopes_2020]
     stats["slope 2021"] = [x[0] for x in slopes_2021]
 
-    hs_o2_clusters.set_index("highstreet_id")
+    hs_o2_clusters = hs_o2_clusters.set_index("highstreet_id")
     stats = stats.join(
-        hs_o2_clusters[["cluster_hourly", "cluster_daily", "cluster_size"]],
-        on="highstreet_id",
+        hs_o2_clusters[["cluster_hourly", "cluster_daily", "cluster_size"]]
     )
 
     return stats.join(hsp.set_index("highstreet_id"), how="left")
 
 
+@instr.instrument()
 def get_fit_lines(start_date, tvec, array_in, robust=False):
+    from sklearn.linear_model import HuberRegressor, LinearRegression
+    from sklearn.multioutput import MultiOutputRegressor
+
     t0 = pd.to_datetime(start_date)
     days_since_reopen = (tvec - t0).days.values
 
@@ -229,6 +230,7 @@ def get_fit_lines(start_date, tvec, array_in, robust=False):
     return reg, reg.predict(X)
 
 
+@instr.instrument()
 def group_highstreets(
     data,
     group_cols,
@@ -300,6 +302,7 @@ def group_highstreets(
     return highstreets_by_group
 
 
+@instr.instrument()
 def hist2d_highstreets(
     data,
     n_grp=4,
@@ -308,6 +311,7 @@ def hist2d_highstreets(
     high_pct=90,
     rcg_names=("row", "column", "group"),
 ):
+    from scipy import stats as spstat
 
     bin_one = np.linspace(
         np.percentile(data[group_cols[0]], low_pct),
@@ -0,0 +1,218 @@
+"""
+Clustering of high streets by their O2 footfall profiles, producing the
+cluster_hourly, cluster_daily and cluster_size columns that
+build_features.append_profile_features reads from O2_CLUSTERS.
+
+Each high street is described by:
+    - hourly profile: its mean count in each hour of the day, as a share of
+        its mean daily total (24 values summing to 1)
+    - daily profile: its mean daily total on each day of the week, as a
+        share of the weekly total (7 values summing to 1)
+    - size: log of its mean daily total
+
+and each description is clustered separately with mini-batch k-means, which
+scales to thousands of high streets and many re-runs. Size clusters are
+numbered from smallest to largest.
+
+Re-clustering after new data lands can start from the previous assignment:
+the previous clusters' members give the starting centres, so a run takes a
+few mini-batch steps instead of a full fit and clusters keep their numbers
+from run to run.
+
+Usage:
+    clusters = o2_clusters(o2_hs, count_type="Visitor")
+    save_clusters(clusters)                                  # to O2_CLUSTERS
+    clusters = o2_clusters(o2_hs_updated, previous=load_clusters())
+"""
+import numpy as np
+import pandas as pd
+
+from highstreets import config
+from highstreets import instrumentation as instr
+from highstreets.features import o2_hourly
+
+CLUSTER_COLS = ["cluster_hourly", "cluster_daily", "cluster_size"]
+
+
+def _normalise(profiles):
+    """Scales each row to sum to 1, rows without counts being NaN"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return profiles / np.nansum(profiles, axis=1, keepdims=True)
+
+
+def profile_features(array, days):
+    """Hourly and daily profiles and size of each high street
+
+    :param array: (high streets x days x 24) counts, as returned by
+    o2_hourly.hourly_array
+    :type array: numpy array
+    :param days: day labels of the second axis
+    :type days: pandas datetime index
+    :return: (high streets x 24) hourly profiles, (high streets x 7) daily
+    profiles (Monday first) and (high streets x 1) sizes
+    :rtype: dict
+    """
+    days = pd.DatetimeIndex(days)
+    with np.errstate(invalid="ignore"):
+        hourly = _normalise(np.nanmean(array, axis=1))
+
+        # days with no counts at all are left out of the daily totals
+        daily_totals = np.where(
+            np.isnan(array).all(axis=2), np.nan, np.nansum(array, axis=2)
+        )
+        weekdays = days.dayofweek.to_numpy()
+        daily = np.column_stack(
+            [np.nanmean(daily_totals[:, weekdays == d], axis=1) for d in range(7)]
+        )
+        size = np.log1p(np.nanmean(daily_totals, axis=1))[:, None]
+
+    return {"hourly": hourly, "daily": _normalise(daily), "size": size}
+
+
+def _warm_start_centres(X, previous_labels, n_clusters, rng):
+    """Starting centres from a previous assignment: the mean of each
+    previous cluster's members, or a random high street for clusters that
+    have none"""
+    centres = X[rng.choice(len(X), n_clusters, replace=len(X) < n_clusters)]
+    labelled = previous_labels >= 0
+    for k in np.unique(previous_labels[labelled]):
+        if k < n_clusters:
+            centres[k] = X[previous_labels == k].mean(axis=0)
+    return centres
+
+
+@instr.instrument()
+def cluster_profiles(
+    X,
+    n_clusters,
+    previous_labels=None,
+    batch_size=1024,
+    random_state=0,
+):
+    """Clusters rows of X with mini-batch k-means
+
+    :param X: one row per high street, without NaNs
+    :type X: numpy array
+    :param n_clusters: number of clusters
+    :type n_clusters: int
+    :param previous_labels: previous cluster of each row (-1 for rows new
+    since), to start from, defaults to None (k-means++ start)
+    :type previous_labels: numpy array, optional
+    :param batch_size: rows per mini-batch, defaults to 1024
+    :type batch_size: int, optional
+    :param random_state: random seed, defaults to 0
+    :type random_state: int, optional
+    :return: the cluster of each row and the cluster centres
+    :rtype: tuple(numpy array, numpy array)
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    n_clusters = min(n_clusters, len(X))
+    if previous_labels is None:
+        init, n_init = "k-means++", 3
+    else:
+        rng = np.random.default_rng(random_state)
+        init = _warm_start_centres(X, np.asarray(previous_labels), n_clusters, rng)
+        n_init = 1
+
+    model = MiniBatchKMeans(
+        n_clusters=n_clusters,
+        init=init,
+        n_init=n_init,
+        batch_size=batch_size,
+        random_state=random_state,
+    ).fit(X)
+    return model.labels_, model.cluster_centers_
+
+
+def _relabel_by_centre(labels, centres):
+    """Numbers 1-d clusters in increasing order of their centre"""
+    rank = np.empty(len(centres), dtype=int)
+    rank[np.argsort(centres[:, 0])] = np.arange(len(centres))
+    return rank[labels]
+
+
+@instr.instrument()
+def o2_clusters(
+    df,
+    n_hourly=6,
+    n_daily=4,
+    n_size=3,
+    previous=None,
+    key="highstreet_id",
+    count_type=None,
+    random_state=0,
+):
+    """Hourly, daily and size clusters of every high street from O2 counts
+
+    :param df: O2 hourly counts joined to high streets, one row per area,
+    day and count type
+    :type df: pandas dataframe
+    :param n_hourly: number of hourly profile clusters, defaults to 6
+    :type n_hourly: int, optional
+    :param n_daily: number of daily profile clusters, defaults to 4
+    :type n_daily: int, optional
+    :param n_size: number of size clusters, defaults to 3
+    :type n_size: int, optional
+    :param previous: clusters from an earlier run, to start from, defaults
+    to None
+    :type previous: pandas dataframe, optional
+    :param key: high street column, defaults to 'highstreet_id'
+    :type key: str, optional
+    :param count_type: count type to use (e.g. 'Visitor'), defaults to None
+    (every row of df)
+    :type count_type: str, optional
+    :param random_state: random seed, defaults to 0
+    :type random_state: int, optional
+    :return: one row per high street with counts, with key and the
+    CLUSTER_COLS columns
+    :rtype: pandas dataframe
+    """
+    if count_type is not None:
+        df = df[df["count_type"] == count_type]
+    array, highstreets, days = o2_hourly.hourly_array(df, key=key)
+    features = profile_features(array, days)
+
+    keep = np.all([~np.isnan(X).any(axis=1) for X in features.values()], axis=0)
+    clusters = pd.DataFrame({key: highstreets[keep]})
+
+    n_clusters = {"hourly": n_hourly, "daily": n_daily, "size": n_size}
+    for name, X in features.items():
+        col = f"cluster_{name}"
+        previous_labels = None
+        if previous is not None:
+            previous_labels = (
+                previous.set_index(key)[col]
+                .reindex(clusters[key])
+                .fillna(-1)
+                .to_numpy(dtype=int)
+            )
+        labels, centres = cluster_profiles(
+            X[keep], n_clusters[name], previous_labels, random_state=random_state
+        )
+        if name == "size" and previous is None:
+            labels = _relabel_by_centre(labels, centres)
+        clusters[col] = labels
+
+    return clusters
+
+
+def save_clusters(clusters, clusters_file=None):
+    """Writes clusters to csv, as read by append_profile_features
+
+    :param clusters: as returned by o2_clusters
+    :type clusters: pandas dataframe
+    :param clusters_file: csv file, defaults to O2_CLUSTERS
+    :type clusters_file: str, optional
+    """
+    clusters.to_csv(clusters_file or config.O2_CLUSTERS, index=False)
+
+
+def load_clusters(clusters_file=None):
+    """Reads clusters written by save_clusters
+
+    :param clusters_file: csv file, defaults to O2_CLUSTERS
+    :type clusters_file: str, optional
+    :rtype: pandas dataframe
+    """
+    return pd.read_csv(clusters_file or config.O2_CLUSTERS)
@@ -0,0 +1,135 @@
+"""
+Batched classical seasonal decomposition of many weekly series at once.
+
+Every series (column) of a (weeks x high streets) array, or of a
+(weeks x high streets x metrics) cube as returned by Cube.sel, is split
+into trend, seasonal and residual parts:
+    - trend: centred moving average over one period (a 2 x period moving
+        average for even periods, as in classical decomposition), computed
+        for all series with one cumulative sum along the week axis. Weeks
+        within half a period of either end, or whose window has missing
+        values, have no trend (NaN)
+    - seasonal: mean of the detrended series at each position in the period,
+        centred to sum to zero (additive) or average one (multiplicative)
+    - residual: what is left
+
+Each step is a handful of array operations over the whole array, so the
+cost grows linearly with the number of series.
+
+Usage:
+    data = make_dataset.extract_data_array(hsd_long, dates, "txn_amt")
+    parts = decompose(data, period=52)
+    parts.trend.loc["2020-03-14":"2020-11-01"]
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from highstreets import instrumentation as instr
+
+Decomposition = namedtuple("Decomposition", ["trend", "seasonal", "resid"])
+
+
+def moving_average(values, window):
+    """Centred moving average along the first axis, NaN where the window is
+    incomplete or has missing values
+
+    :param values: array with time along the first axis
+    :type values: numpy array
+    :param window: window length, in steps. Even windows are centred with a
+    2 x window moving average
+    :type window: int
+    :rtype: numpy array
+    """
+    values = np.asarray(values, dtype=float)
+    n_steps = values.shape[0]
+    result = np.full(values.shape, np.nan)
+    if n_steps < window + (window % 2 == 0):
+        return result
+
+    missing = np.isnan(values)
+    has_gaps = missing.any()
+    zeros = np.zeros((1,) + values.shape[1:])
+    sums = np.concatenate(
+        [zeros, np.cumsum(np.where(missing, 0, values) if has_gaps else values, 0)]
+    )
+
+    # mean of values[i : i + window], for every i
+    means = (sums[window:] - sums[:-window]) / window
+    if has_gaps:
+        gaps = np.concatenate([zeros, np.cumsum(missing, axis=0)])
+        means[(gaps[window:] - gaps[:-window]) > 0] = np.nan
+
+    half = window // 2
+    if window % 2:
+        result[half : n_steps - half] = means
+    else:
+        result[half : n_steps - half] = (means[:-1] + means[1:]) / 2
+    return result
+
+
+def _seasonal_means(detrended, period):
+    """Mean of each position in the period along the first axis, ignoring
+    NaNs"""
+    n_steps = detrended.shape[0]
+    n_cycles = -(-n_steps // period)
+    padded = np.full((n_cycles * period,) + detrended.shape[1:], np.nan)
+    padded[:n_steps] = detrended
+    cycles = padded.reshape((n_cycles, period) + detrended.shape[1:])
+
+    present = ~np.isnan(cycles)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(present, cycles, 0).sum(axis=0) / present.sum(axis=0)
+    return means
+
+
+@instr.instrument()
+def decompose(data, period=52, model="additive"):
+    """Splits every series into trend, seasonal and residual parts
+
+    :param data: series with time along the first axis, e.g. a
+    (weeks x high streets) dataframe as returned by extract_data_array or a
+    (weeks x high streets x metrics) array from Cube.sel
+    :type data: pandas dataframe or numpy array
+    :param period: length of the seasonal cycle, in steps, defaults to 52
+    (yearly, for weekly series)
+    :type period: int, optional
+    :param model: 'additive' (data = trend + seasonal + resid) or
+    'multiplicative' (data = trend * seasonal * resid), defaults to
+    'additive'
+    :type model: str, optional
+    :return: trend, seasonal and resid, each the same shape (and type) as
+    data
+    :rtype: Decomposition
+    """
+    if model not in ("additive", "multiplicative"):
+        raise ValueError(f"model must be 'additive' or 'multiplicative', not {model}")
+
+    values = data.to_numpy(dtype=float) if isinstance(data, pd.DataFrame) else data
+    values = np.asarray(values, dtype=float)
+
+    trend = moving_average(values, period)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if model == "additive":
+            means = _seasonal_means(values - trend, period)
+            means = means - np.nanmean(means, axis=0)
+        else:
+            means = _seasonal_means(values / trend, period)
+            means = means / np.nanmean(means, axis=0)
+
+        n_cycles = -(-values.shape[0] // period)
+        seasonal = np.concatenate([means] * n_cycles)[: values.shape[0]]
+        if model == "additive":
+            resid = values - trend - seasonal
+        else:
+            resid = values / (trend * seasonal)
+
+    if isinstance(data, pd.DataFrame):
+        return Decomposition(
+            *(
+                pd.DataFrame(a, data.index, data.columns)
+                for a in (trend, seasonal, resid)
+            )
+        )
+    return Decomposition(trend, seasonal, resid)
@@ -0,0 +1,326 @@
+"""
+Incrementally updated per high street features of the weekly Mastercard
+series: windowed means, standard deviations, slopes and hit percentages, as
+computed over the whole history by build_features.append_profile_features.
+
+Rather than the series, the store keeps running sufficient statistics for
+each metric, window and high street: the number of weeks n, sum(y),
+sum(y^2), sum(t), sum(t^2) and sum(t*y), with t the days since the start
+of the window (as in build_features.get_fit_lines). Appending a week adds
+that week's values to the statistics of the windows it falls in, in
+O(windows x high streets), and every feature is a closed form of the
+statistics. Missing values are skipped.
+
+check_against_full recomputes the features from the full series and
+reports the largest difference, to check the store against.
+
+Usage:
+    store = FeatureStore(metrics=["txn_amt"])
+    store.append(avg_retail_wd_we(hsd_yoy))    # full history once
+    store.append(new_week)                     # then week by week
+    store.save(store_file)
+    features = store.features("txn_amt")
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from highstreets import instrumentation as instr
+
+# (first, last) dates of each window, both included, as used in
+# build_features.append_profile_features
+DEFAULT_WINDOWS = {
+    "2020": ("2020-03-14", "2020-11-01"),
+    "2021": ("2021-03-14", "2021-11-01"),
+    "lockdown 2020": ("2020-03-24", "2020-06-15"),
+    "pre lockdown 2020": ("2020-01-04", "2020-03-24"),
+    "lockdown 2021": ("2021-01-05", "2021-03-12"),
+    "autumn 2020": ("2020-08-01", "2020-11-05"),
+    "all": (None, None),
+}
+
+# hit percentages, as the ratio of the means of two windows
+DEFAULT_RATIOS = {
+    "2020": ("lockdown 2020", "pre lockdown 2020"),
+    "2021": ("lockdown 2021", "autumn 2020"),
+}
+
+# sufficient statistics kept per metric, window and high street
+STATISTICS = ["n", "sum_y", "sum_y2", "sum_t", "sum_t2", "sum_ty"]
+
+
+class FeatureStore:
+    """Running sufficient statistics of weekly series per high street
+
+    :param metrics: columns of the appended data to keep statistics for,
+    defaults to ('txn_amt',)
+    :type metrics: list[str], optional
+    :param windows: (first, last) dates of each window, None for open
+    ended, defaults to DEFAULT_WINDOWS
+    :type windows: dict, optional
+    :param ratios: hit percentages, as (numerator window, denominator
+    window), defaults to DEFAULT_RATIOS
+    :type ratios: dict, optional
+    :param time_col: column of the week dates, defaults to 'period_start'
+    :type time_col: str, optional
+    :param clip_upper: values are capped at this before being added, as in
+    make_dataset.extract_data_array, defaults to None (not capped)
+    :type clip_upper: float, optional
+    """
+
+    def __init__(
+        self,
+        metrics=("txn_amt",),
+        windows=None,
+        ratios=None,
+        time_col="period_start",
+        clip_upper=None,
+    ):
+        self.metrics = list(metrics)
+        self.windows = dict(DEFAULT_WINDOWS if windows is None else windows)
+        self.ratios = dict(DEFAULT_RATIOS if ratios is None else ratios)
+        self.time_col = time_col
+        self.clip_upper = clip_upper
+        self.highstreets = pd.Index([], name="highstreet_id")
+        self.weeks = pd.DatetimeIndex([])
+        # (statistics x metrics x windows x high streets)
+        self.stats = np.zeros(
+            (len(STATISTICS), len(self.metrics), len(self.windows), 0)
+        )
+
+        self._starts = pd.DatetimeIndex(
+            [pd.Timestamp(s) if s else pd.NaT for s, _ in self.windows.values()]
+        )
+        self._ends = pd.DatetimeIndex(
+            [pd.Timestamp(e) if e else pd.NaT for _, e in self.windows.values()]
+        )
+
+    def _add_highstreets(self, ids):
+        new = pd.Index(ids).unique().difference(self.highstreets)
+        if len(new) == 0:
+            return
+        self.highstreets = self.highstreets.append(new).rename("highstreet_id")
+        pad = np.zeros(self.stats.shape[:3] + (len(new),))
+        self.stats = np.concatenate([self.stats, pad], axis=3)
+
+    def _window_times(self, week):
+        """Days since the start of each window containing the week, and
+        which windows contain it"""
+        in_window = ((self._starts <= week) | self._starts.isna()) & (
+            (self._ends >= week) | self._ends.isna()
+        )
+        # open ended windows count time from the first week appended
+        origin = self._starts.fillna(self.weeks.min() if len(self.weeks) else week)
+        return np.asarray((week - origin).days, dtype=float), np.asarray(in_window)
+
+    @instr.instrument()
+    def append(self, df):
+        """Adds weeks of data to the statistics
+
+        :param df: one row per week and high street, with highstreet_id,
+        the time column and the metrics as columns
+        :type df: pandas dataframe
+        :return: number of weeks added
+        :rtype: int
+        """
+        # make_dataset output is also indexed by the time column
+        df = df.reset_index(drop=True)
+        weeks = pd.DatetimeIndex(df[self.time_col].unique()).sort_values()
+        if weeks.isin(self.weeks).any():
+            raise ValueError(
+                "Weeks already in the store: "
+                f"{list(weeks[weeks.isin(self.weeks)].strftime('%Y-%m-%d'))}"
+            )
+        if len(self.weeks) and weeks[0] < self.weeks.min():
+            # open ended windows count time from the first week
+            raise ValueError("Weeks before the first week in the store")
+        self._add_highstreets(df["highstreet_id"])
+
+        for week, week_df in df.groupby(self.time_col, sort=True):
+            if not len(self.weeks):
+                self.weeks = pd.DatetimeIndex([week])
+            t, in_window = self._window_times(week)
+            hs = self.highstreets.get_indexer(week_df["highstreet_id"])
+
+            # (metrics x high streets in the week)
+            y = week_df[self.metrics].to_numpy(dtype=float).T
+            if self.clip_upper is not None:
+                y = np.minimum(y, self.clip_upper)
+            present = ~np.isnan(y)
+            y = np.where(present, y, 0.0)
+
+            for w in np.flatnonzero(in_window):
+                self.stats[0, :, w, hs] += present.T
+                self.stats[1, :, w, hs] += y.T
+                self.stats[2, :, w, hs] += (y**2).T
+                self.stats[3, :, w, hs] += (t[w] * present).T
+                self.stats[4, :, w, hs] += (t[w] ** 2 * present).T
+                self.stats[5, :, w, hs] += (t[w] * y).T
+
+            self.weeks = self.weeks.union([week])
+        return len(weeks)
+
+    def _stat(self, name, metric, window):
+        return self.stats[
+            STATISTICS.index(name),
+            self.metrics.index(metric),
+            list(self.windows).index(window),
+        ]
+
+    def mean(self, metric, window):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self._stat("sum_y", metric, window) / self._stat("n", metric, window)
+
+    def std(self, metric, window, ddof=1):
+        n = self._stat("n", metric, window)
+        sum_y = self._stat("sum_y", metric, window)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ss = self._stat("sum_y2", metric, window) - sum_y**2 / n
+            return np.sqrt(np.maximum(ss, 0) / (n - ddof))
+
+    def slope(self, metric, window):
+        """Least squares slope per day, as build_features.get_fit_lines"""
+        n = self._stat("n", metric, window)
+        sum_t = self._stat("sum_t", metric, window)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cov = (
+                self._stat("sum_ty", metric, window)
+                - sum_t * self._stat("sum_y", metric, window) / n
+            )
+            var = self._stat("sum_t2", metric, window) - sum_t**2 / n
+            return cov / var
+
+    def hit_percent(self, metric, ratio):
+        numerator, denominator = self.ratios[ratio]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.mean(metric, numerator) / self.mean(metric, denominator)
+
+    def features(self, metric=None):
+        """Every feature of a metric per high street, named as in
+        build_features.append_profile_features ('mean 2020', 'slope 2020',
+        'hit percent 2020', ...)
+
+        :param metric: defaults to the first metric
+        :type metric: str, optional
+        :rtype: pandas dataframe
+        """
+        metric = metric or self.metrics[0]
+        features = {}
+        for window in self.windows:
+            features[f"mean {window}"] = self.mean(metric, window)
+            features[f"sd {window}"] = self.std(metric, window)
+            features[f"slope {window}"] = self.slope(metric, window)
+        for ratio in self.ratios:
+            features[f"hit percent {ratio}"] = self.hit_percent(metric, ratio)
+        return pd.DataFrame(features, index=self.highstreets)
+
+    def save(self, store_file):
+        """Saves the store to an .npz file"""
+        metadata = {
+            "metrics": self.metrics,
+            "windows": self.windows,
+            "ratios": self.ratios,
+            "time_col": self.time_col,
+            "clip_upper": self.clip_upper,
+            "highstreets": [
+                i.item() if isinstance(i, np.generic) else i for i in self.highstreets
+            ],
+            "weeks": [w.strftime("%Y-%m-%d") for w in self.weeks],
+        }
+        np.savez(store_file, stats=self.stats, metadata=json.dumps(metadata))
+
+    @classmethod
+    def load(cls, store_file):
+        """Loads a store saved with save"""
+        with np.load(store_file) as saved:
+            metadata = json.loads(str(saved["metadata"]))
+            stats = saved["stats"]
+        store = cls(
+            metadata["metrics"],
+            {name: tuple(window) for name, window in metadata["windows"].items()},
+            {name: tuple(ratio) for name, ratio in metadata["ratios"].items()},
+            metadata["time_col"],
+            metadata["clip_upper"],
+        )
+        store.highstreets = pd.Index(metadata["highstreets"], name="highstreet_id")
+        store.weeks = pd.DatetimeIndex(metadata["weeks"])
+        store.stats = stats
+        return store
+
+
+def full_features(df, metric, windows=None, ratios=None, time_col="period_start"):
+    """The store's features recomputed from the full series with pandas, to
+    check the store against
+
+    :param df: one row per week and high street
+    :type df: pandas dataframe
+    :param metric: column to compute features of
+    :type metric: str
+    :param windows: defaults to DEFAULT_WINDOWS
+    :type windows: dict, optional
+    :param ratios: defaults to DEFAULT_RATIOS
+    :type ratios: dict, optional
+    :param time_col: column of the week dates, defaults to 'period_start'
+    :type time_col: str, optional
+    :rtype: pandas dataframe
+    """
+    windows = DEFAULT_WINDOWS if windows is None else windows
+    ratios = DEFAULT_RATIOS if ratios is None else ratios
+    wide = (
+        df.reset_index(drop=True)
+        .pivot_table(
+            index=time_col, columns="highstreet_id", values=metric, dropna=False
+        )
+        .sort_index()
+    )
+
+    features, means = {}, {}
+    for window, (first, last) in windows.items():
+        data = wide.loc[first:last]
+        origin = pd.Timestamp(first) if first else wide.index.min()
+        t = (data.index - origin).days.to_numpy(dtype=float)[:, np.newaxis]
+        present = data.notna().to_numpy()
+        y = data.to_numpy()
+        # least squares slope over each column's non-missing weeks
+        t_mean = np.nansum(np.where(present, t, np.nan), axis=0) / present.sum(0)
+        dt = np.where(present, t - t_mean, 0.0)
+        means[window] = data.mean()
+        features[f"mean {window}"] = means[window]
+        features[f"sd {window}"] = data.std()
+        features[f"slope {window}"] = pd.Series(
+            np.nansum(dt * (y - means[window].to_numpy()), axis=0)
+            / (dt**2).sum(axis=0),
+            index=wide.columns,
+        )
+    for ratio, (numerator, denominator) in ratios.items():
+        features[f"hit percent {ratio}"] = means[numerator] / means[denominator]
+    return pd.DataFrame(features)
+
+
+def check_against_full(store, df, metric=None, rtol=1e-6):
+    """Compares the store's features with a full recompute
+
+    :param store: the store, with df appended
+    :type store: FeatureStore
+    :param df: every week appended to the store
+    :type df: pandas dataframe
+    :param metric: defaults to the store's first metric
+    :type metric: str, optional
+    :param rtol: relative tolerance, defaults to 1e-6
+    :type rtol: float, optional
+    :return: whether every feature matches, and the largest relative
+    difference of each feature
+    :rtype: tuple(bool, pandas series)
+    """
+    metric = metric or store.metrics[0]
+    if store.clip_upper is not None:
+        df = df.assign(**{metric: df[metric].clip(upper=store.clip_upper)})
+    incremental = store.features(metric)
+    full = full_features(df, metric, store.windows, store.ratios, store.time_col)
+    full = full.reindex(index=incremental.index, columns=incremental.columns)
+
+    scale = np.maximum(np.abs(full), 1e-12)
+    diff = (np.abs(incremental - full) / scale).max()
+    both_nan = (incremental.isna() == full.isna()).all()
+    return bool(((diff <= rtol) | diff.isna()).all() and both_nan.all()), diff
@@ -0,0 +1,242 @@
+"""
+Aggregation of area level data up a geographic hierarchy, e.g.
+LSOA -> high street -> town centre -> borough -> London, in one pass.
+
+A hierarchy is described by links, each defining a level as a grouping of
+a lower level:
+    (level, child_level, lookup, child_col, parent_col, weight_col)
+where lookup is a dataframe with one row per (child, parent) pair and
+weight_col (optional) the fraction of the child assigned to the parent, as
+in the area to high street weight tables of highstreets.data.area_weights.
+A link with lookup None puts every child into a single parent (e.g. London).
+
+build_hierarchy composes the links into CSR membership matrices from the base
+level to every level and stacks them into one (all parents x base) matrix.
+aggregate_hierarchy then computes totals and weighted averages of every
+level, for every time step and quantity, with a single sparse matrix
+multiply of that matrix with the dense (base x time) arrays.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from highstreets import config
+from highstreets import instrumentation as instr
+
+# column names of the town centre lookup (TC_LOOKUP)
+TC_HIGHSTREET_COL = "highstreet_id"
+TC_TOWN_CENTRE_COL = "tc_name"
+TC_BOROUGH_COL = "borough"
+
+
+def load_tc_lookup(tc_lookup_file=None):
+    """Reads the high street to town centre and borough lookup
+
+    :param tc_lookup_file: csv file, defaults to TC_LOOKUP
+    :type tc_lookup_file: str, optional
+    :return: one row per high street, with its town centre and borough
+    :rtype: pandas dataframe
+    """
+    tc_lookup_file = tc_lookup_file or config.TC_LOOKUP
+    return pd.read_csv(
+        tc_lookup_file,
+        usecols=[TC_HIGHSTREET_COL, TC_TOWN_CENTRE_COL, TC_BOROUGH_COL],
+    )
+
+
+def default_links(area_weights, tc_lookup, area_col):
+    """Links of the area -> high street -> town centre/borough -> London
+    hierarchy
+
+    :param area_weights: area to high street weight table
+    :type area_weights: pandas dataframe
+    :param tc_lookup: town centre lookup, as returned by load_tc_lookup
+    :type tc_lookup: pandas dataframe
+    :param area_col: area id column of area_weights
+    :type area_col: str
+    :rtype: list[tuple]
+    """
+    return [
+        ("highstreet", "area", area_weights, area_col, "highstreet_id", "weight"),
+        (
+            "town_centre",
+            "highstreet",
+            tc_lookup.dropna(subset=[TC_TOWN_CENTRE_COL]),
+            TC_HIGHSTREET_COL,
+            TC_TOWN_CENTRE_COL,
+            None,
+        ),
+        (
+            "borough",
+            "highstreet",
+            tc_lookup.dropna(subset=[TC_BOROUGH_COL]),
+            TC_HIGHSTREET_COL,
+            TC_BOROUGH_COL,
+            None,
+        ),
+        ("london", "highstreet", None, None, None, None),
+    ]
+
+
+def membership_matrix(lookup, child_col, parent_col, child_ids, weight_col=None):
+    """Sparse (parents x children) membership matrix of a lookup
+
+    :param lookup: one row per (child, parent) pair, or None to put every
+    child into a single parent
+    :type lookup: pandas dataframe
+    :param child_col: child id column of lookup
+    :type child_col: str
+    :param parent_col: parent id column of lookup
+    :type parent_col: str
+    :param child_ids: order of the matrix columns. Lookup rows for other
+    children are ignored
+    :type child_ids: pandas index
+    :param weight_col: fraction of the child in the parent, defaults to None
+    (all 1)
+    :type weight_col: str, optional
+    :return: the matrix and the parent ids of its rows
+    :rtype: tuple(scipy csr matrix, pandas index)
+    """
+    if lookup is None:
+        return (
+            sparse.csr_matrix(np.ones((1, len(child_ids)))),
+            pd.Index(["all"]),
+        )
+
+    cols = child_ids.get_indexer(lookup[child_col])
+    keep = cols >= 0
+    parent_codes, parent_ids = pd.factorize(lookup[parent_col][keep], sort=True)
+    weights = (
+        lookup[weight_col].to_numpy(dtype=float)[keep]
+        if weight_col
+        else np.ones(keep.sum())
+    )
+    matrix = sparse.csr_matrix(
+        (weights, (parent_codes, cols[keep])),
+        shape=(len(parent_ids), len(child_ids)),
+    )
+    return matrix, pd.Index(parent_ids)
+
+
+def build_hierarchy(base_ids, links, base_level="area", include_base=False):
+    """Composes links into a stacked membership matrix from the base level
+
+    :param base_ids: ids of the base level, in the order of the rows of the
+    arrays to aggregate
+    :type base_ids: array-like
+    :param links: (level, child_level, lookup, child_col, parent_col,
+    weight_col) tuples, each child_level being the base level or an earlier
+    level
+    :type links: list[tuple]
+    :param base_level: name of the base level, defaults to 'area'
+    :type base_level: str, optional
+    :param include_base: include the base level itself in the output,
+    defaults to False
+    :type include_base: bool, optional
+    :return: the stacked (parents x base) CSR matrix under "matrix" and the
+    (level, id) of each of its rows under "index"
+    :rtype: dict
+    """
+    base_ids = pd.Index(base_ids)
+    levels = {base_level: (sparse.identity(len(base_ids), format="csr"), base_ids)}
+
+    for level, child_level, lookup, child_col, parent_col, weight_col in links:
+        child_matrix, child_ids = levels[child_level]
+        matrix, parent_ids = membership_matrix(
+            lookup, child_col, parent_col, child_ids, weight_col
+        )
+        levels[level] = ((matrix @ child_matrix).tocsr(), parent_ids)
+
+    if not include_base:
+        del levels[base_level]
+
+    return {
+        "matrix": sparse.vstack([m for m, _ in levels.values()], format="csr"),
+        "index": pd.MultiIndex.from_tuples(
+            [(level, i) for level, (_, ids) in levels.items() for i in ids],
+            names=["level", "id"],
+        ),
+    }
+
+
+def to_area_time_array(df, area_col, time_col, value_col, area_ids=None):
+    """Pivots a long frame into a dense (areas x time) array
+
+    :param df: one row per area and time
+    :type df: pandas dataframe
+    :param area_col: area id column
+    :type area_col: str
+    :param time_col: time column
+    :type time_col: str
+    :param value_col: value column
+    :type value_col: str
+    :param area_ids: order of the rows, defaults to the sorted areas of df.
+    Missing areas and times are NaN
+    :type area_ids: array-like, optional
+    :return: the array, and the area and time labels of its rows and columns
+    :rtype: tuple(numpy array, pandas index, pandas index)
+    """
+    area_ids = pd.Index(
+        np.sort(df[area_col].unique()) if area_ids is None else area_ids
+    )
+    time_codes, times = pd.factorize(df[time_col], sort=True)
+    rows = area_ids.get_indexer(df[area_col])
+    keep = rows >= 0
+
+    array = np.full((len(area_ids), len(times)), np.nan)
+    array[rows[keep], time_codes[keep]] = df[value_col].to_numpy(dtype=float)[keep]
+    return array, area_ids, pd.Index(times, name=time_col)
+
+
+@instr.instrument()
+def aggregate_hierarchy(hierarchy, sums=None, means=None, weights=None, times=None):
+    """Totals and weighted averages of every level of a hierarchy
+
+    :param hierarchy: as returned by build_hierarchy
+    :type hierarchy: dict
+    :param sums: (base x time) arrays of quantities to total, by name,
+    defaults to None
+    :type sums: dict, optional
+    :param means: (base x time) arrays of quantities to average, by name,
+    defaults to None
+    :type means: dict, optional
+    :param weights: (base x time) array weighting the averages (e.g.
+    scaled_volume), defaults to None (unweighted averages)
+    :type weights: numpy array, optional
+    :param times: labels of the time axis, defaults to None (0, 1, ...)
+    :type times: array-like, optional
+    :return: a (level, id) x time dataframe per quantity. NaNs in the inputs
+    are left out of totals and averages
+    :rtype: dict
+    """
+    sums, means = sums or {}, means or {}
+    arrays = list(sums.values()) + list(means.values())
+    if not arrays:
+        return {}
+    n_base, n_times = arrays[0].shape
+
+    if weights is None:
+        weights = np.ones((n_base, n_times))
+
+    # side by side blocks of n_times columns: the totals, then the weighted
+    # sums and weight totals of each average
+    blocks = [np.nan_to_num(a) for a in sums.values()]
+    for values in means.values():
+        present = ~np.isnan(values) & ~np.isnan(weights)
+        blocks.append(np.where(present, values * weights, 0.0))
+        blocks.append(np.where(present, weights, 0.0))
+
+    result = hierarchy["matrix"] @ np.hstack(blocks)
+    result = result.reshape(result.shape[0], len(blocks), n_times)
+
+    columns = pd.Index(np.arange(n_times) if times is None else times)
+    out = {}
+    for i, name in enumerate(sums):
+        out[name] = pd.DataFrame(result[:, i], hierarchy["index"], columns)
+    for j, name in enumerate(means):
+        i = len(sums) + 2 * j
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[name] = pd.DataFrame(
+                result[:, i] / result[:, i + 1], hierarchy["index"], columns
+            )
+    return out
@@ -0,0 +1,213 @@
+"""
+Hourly O2 footfall profile features of every high street, for all 24 hours.
+
+The O2 counts (one row per MSOA or high street, day and count type, with
+one column per hour h00 to h23) are reshaped once into a dense
+(high streets x days x 24) array, days without counts being NaN. Every
+feature is then a reduction of that array along the day axis:
+    - mean hXX, sd hXX: mean and standard deviation of each hour's count
+    - slope hXX: least squares trend of each hour's count, per day (as in
+        processing_functions.create_gradient_o2)
+    - peak hour, peak share: hour with the highest mean count and its share
+        of the mean daily total
+    - share night/morning/daytime/evening: share of the mean daily total in
+        each part of the day (see DAY_PARTS)
+    - profile entropy: entropy of the mean hourly profile in bits, from 0
+        (all footfall in one hour) to log2(24) (flat)
+
+Usage:
+    o2_hs = pd.merge(o2, hs_msoa_lookup, on="msoa11cd")
+    features = o2_hourly_features(o2_hs, count_type="Visitor")
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from highstreets import instrumentation as instr
+
+HOUR_COLS = [f"h{hour:02d}" for hour in range(24)]
+
+# (first, last) hours of each part of the day, both included
+DAY_PARTS = {
+    "night": (0, 5),
+    "morning": (6, 9),
+    "daytime": (10, 17),
+    "evening": (18, 23),
+}
+
+
+@instr.instrument()
+def hourly_array(
+    df,
+    key="highstreet_name",
+    date_col="count_date",
+    agg="sum",
+    start=None,
+    end=None,
+):
+    """Reshapes hourly O2 counts into a (high streets x days x 24) array
+
+    :param df: one row per area, day (and count type), with the hour columns
+    :type df: pandas dataframe
+    :param key: high street column, defaults to 'highstreet_name'
+    :type key: str, optional
+    :param date_col: date column, defaults to 'count_date'
+    :type date_col: str, optional
+    :param agg: how to combine the rows of a high street and day (e.g. the
+    MSOAs of a high street), 'sum' or 'mean', defaults to 'sum'
+    :type agg: str, optional
+    :param start: first day to include, defaults to None (first)
+    :type start: datetime-like, optional
+    :param end: last day to include, defaults to None (last)
+    :type end: datetime-like, optional
+    :return: the array, NaN for days without counts, and the high street and
+    day labels of its first two axes
+    :rtype: tuple(numpy array, pandas index, pandas index)
+    """
+    if agg not in ("sum", "mean"):
+        raise ValueError(f"agg must be 'sum' or 'mean', not {agg!r}")
+
+    dates = pd.to_datetime(df[date_col])
+    # rows without a high street or day (factorized to -1) are left out
+    rows = (df[key].notna() & dates.notna()).to_numpy()
+    if start is not None:
+        rows &= (dates >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        rows &= (dates <= pd.Timestamp(end)).to_numpy()
+
+    hs_codes, highstreets = pd.factorize(df[key].to_numpy()[rows], sort=True)
+    day_codes, days = pd.factorize(dates.to_numpy()[rows], sort=True)
+    n_hs, n_days = len(highstreets), len(days)
+
+    # sum the rows of each (high street, day) cell with one sparse
+    # (cells x rows) matrix multiply
+    cells = hs_codes * n_days + day_codes
+    membership = sparse.csr_matrix(
+        (np.ones(len(cells)), (cells, np.arange(len(cells)))),
+        shape=(n_hs * n_days, len(cells)),
+    )
+    values = df[HOUR_COLS].to_numpy(dtype=float)[rows]
+    present = ~np.isnan(values)
+    totals = membership @ np.where(present, values, 0)
+    counts = membership @ present.astype(float)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        array = totals / counts if agg == "mean" else totals
+    array[counts == 0] = np.nan
+
+    return (
+        array.reshape(n_hs, n_days, 24),
+        pd.Index(highstreets, name=key),
+        pd.DatetimeIndex(days, name=date_col),
+    )
+
+
+def _hourly_stats(array, days):
+    """Mean, standard deviation and least squares slope (per day) of each
+    hour along the day axis, leaving out NaNs"""
+    present = ~np.isnan(array)
+    y = np.where(present, array, 0)
+    # days from the middle of the period, so the sums stay small
+    t = (days - days[0]).days.to_numpy(dtype=float)
+    t -= t.mean()
+
+    n = present.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = y.sum(axis=1) / n
+        # second pass over deviations from the mean, so large counts don't
+        # lose precision
+        y = np.where(present, array - mean[:, None, :], 0)
+        sd = np.sqrt(np.einsum("hdk,hdk->hk", y, y) / (n - 1))
+
+        sum_t = np.einsum("hdk,d->hk", present, t)
+        sum_t2 = np.einsum("hdk,d->hk", present, t**2)
+        sum_ty = np.einsum("hdk,d->hk", y, t)
+        slope = sum_ty / (sum_t2 - sum_t**2 / n)
+    return mean, sd, slope
+
+
+def _profile_shape(mean):
+    """Peak hour and day part shares of the mean hourly profiles"""
+    total = np.nansum(mean, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        shares = mean / total[:, None]
+
+    has_profile = (np.isfinite(mean).any(axis=1)) & (total > 0)
+    peak = np.argmax(np.nan_to_num(mean, nan=-np.inf), axis=1)
+    shape = {
+        "peak hour": np.where(has_profile, peak, np.nan),
+        "peak share": np.where(
+            has_profile, np.take_along_axis(shares, peak[:, None], 1)[:, 0], np.nan
+        ),
+    }
+    for part, (first, last) in DAY_PARTS.items():
+        shape[f"share {part}"] = np.where(
+            has_profile, np.nansum(shares[:, first : last + 1], axis=1), np.nan
+        )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = np.where(shares > 0, shares, np.nan)
+        entropy = -np.nansum(p * np.log2(p), axis=1)
+    shape["profile entropy"] = np.where(has_profile, entropy, np.nan)
+    return shape
+
+
+@instr.instrument()
+def hourly_profile_features(array, highstreets, days):
+    """Per hour and profile shape features from a (high streets x days x 24)
+    array
+
+    :param array: as returned by hourly_array
+    :type array: numpy array
+    :param highstreets: high street labels of the first axis
+    :type highstreets: pandas index
+    :param days: day labels of the second axis
+    :type days: pandas datetime index
+    :return: one row per high street, one column per feature
+    :rtype: pandas dataframe
+    """
+    mean, sd, slope = _hourly_stats(array, pd.DatetimeIndex(days))
+
+    columns = {}
+    for name, values in (("mean", mean), ("sd", sd), ("slope", slope)):
+        for hour, col in enumerate(HOUR_COLS):
+            columns[f"{name} {col}"] = values[:, hour]
+    columns.update(_profile_shape(mean))
+    return pd.DataFrame(columns, index=highstreets)
+
+
+@instr.instrument()
+def o2_hourly_features(
+    df,
+    key="highstreet_name",
+    date_col="count_date",
+    count_type=None,
+    agg="sum",
+    start=None,
+    end=None,
+):
+    """Hourly profile features of every high street from O2 counts
+
+    :param df: O2 hourly counts joined to high streets, one row per area,
+    day and count type
+    :type df: pandas dataframe
+    :param key: high street column, defaults to 'highstreet_name'
+    :type key: str, optional
+    :param date_col: date column, defaults to 'count_date'
+    :type date_col: str, optional
+    :param count_type: count type to use (e.g. 'Visitor'), defaults to None
+    (every row of df)
+    :type count_type: str, optional
+    :param agg: how to combine the areas of a high street on a day, 'sum' or
+    'mean', defaults to 'sum'
+    :type agg: str, optional
+    :param start: first day to include, defaults to None (first)
+    :type start: datetime-like, optional
+    :param end: last day to include, defaults to None (last)
+    :type end: datetime-like, optional
+    :return: one row per high street, one column per feature
+    :rtype: pandas dataframe
+    """
+    if count_type is not None:
+        df = df[df["count_type"] == count_type]
+    array, highstreets, days = hourly_array(df, key, date_col, agg, start, end)
+    return hourly_profile_features(array, highstreets, days)
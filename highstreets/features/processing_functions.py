@@ -1,9 +1,14 @@
+from collections import namedtuple
+
+import numpy as np
 import pandas as pd
-from sklearn.linear_model import LinearRegression
+
+from highstreets import instrumentation as instr
 
 
 # create function to take averages of every x months
 # and see which hs fall in which proportion x months after that
+@instr.instrument()
 def create_labels(hs, label_month, comparison_start, comparison_end):
     """Labels high streets at risk, depending on whether
     spending is in which quartile of average of x months prior"""
@@ -35,50 +40,141 @@ def create_labels(hs, label_month, comparison_start, comparison_end):
     return merged_df
 
 
-# loop and select data for relevant months
+# column: column to summarise, statistic: one of STATISTICS, window: values
+# of the time column to include (None for every row), name: output column,
+# defaults to "<statistic>_<column>"
+FeatureSpec = namedtuple(
+    "FeatureSpec", ["column", "statistic", "window", "name"], defaults=[None, None]
+)
+
+STATISTICS = ["count", "sum", "mean", "std", "var", "min", "max"]
+
+
+def _segment_stats(codes, n_groups, values, statistics):
+    """Statistics of values per group code, leaving out NaNs"""
+    present = ~np.isnan(values)
+    codes, values = codes[present], values[present]
+    count = np.bincount(codes, minlength=n_groups).astype(float)
+    out = {"count": count}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        total = np.bincount(codes, weights=values, minlength=n_groups)
+        out["sum"] = total
+        out["mean"] = total / np.where(count > 0, count, np.nan)
+        if {"std", "var"} & set(statistics):
+            # two passes (sum of squared deviations from the group mean) so
+            # large values don't lose precision
+            deviations = values - out["mean"][codes]
+            ssd = np.bincount(codes, weights=deviations**2, minlength=n_groups)
+            out["var"] = ssd / np.where(count > 1, count - 1, np.nan)
+            out["std"] = np.sqrt(out["var"])
+    if "min" in statistics:
+        out["min"] = np.full(n_groups, np.inf)
+        np.minimum.at(out["min"], codes, values)
+    if "max" in statistics:
+        out["max"] = np.full(n_groups, -np.inf)
+        np.maximum.at(out["max"], codes, values)
+    for stat in ("min", "max"):
+        if stat in out:
+            out[stat][count == 0] = np.nan
+    return out
+
+
+@instr.instrument()
+def build_feature_frame(df, specs, key="highstreet_name", time_col="month_year"):
+    """Computes many (column, statistic, window) features per high street in
+    one pass, reading each column once per window
+
+    :param df: one row per high street and time, with any mix of Mastercard
+    and O2 columns
+    :type df: pandas dataframe
+    :param specs: features to compute, as FeatureSpecs or (column,
+    statistic, window[, name]) tuples
+    :type specs: list
+    :param key: high street column, defaults to 'highstreet_name'
+    :type key: str, optional
+    :param time_col: column the windows select values of, defaults to
+    'month_year'
+    :type time_col: str, optional
+    :return: one row per high street with data in any of the windows,
+    sorted by key, with one column per spec
+    :rtype: pandas dataframe
+    """
+    specs = [FeatureSpec(*spec) for spec in specs]
+    unknown = {spec.statistic for spec in specs} - set(STATISTICS)
+    if unknown:
+        raise ValueError(f"Unknown statistics: {sorted(unknown)}")
+
+    codes, keys = pd.factorize(df[key], sort=True)
+    # rows without a high street (code -1) are left out, as groupby does
+    has_key = codes >= 0
+
+    # specs grouped by window, then column, so each is selected once
+    windows = {}
+    for spec in specs:
+        window = None if spec.window is None else tuple(spec.window)
+        windows.setdefault(window, {}).setdefault(spec.column, []).append(spec)
+
+    in_any_window = np.zeros(len(df), dtype=bool)
+    features = {}
+    for window, columns in windows.items():
+        rows = (
+            has_key
+            if window is None
+            else has_key & df[time_col].isin(window).to_numpy()
+        )
+        in_any_window |= rows
+        for column, column_specs in columns.items():
+            stats = _segment_stats(
+                codes[rows],
+                len(keys),
+                df[column].to_numpy(dtype=float)[rows],
+                [spec.statistic for spec in column_specs],
+            )
+            for spec in column_specs:
+                name = spec.name or f"{spec.statistic}_{spec.column}"
+                features[name] = stats[spec.statistic]
+
+    present = np.bincount(codes[in_any_window], minlength=len(keys)) > 0
+    result = pd.DataFrame({key: keys[present]})
+    for name, values in features.items():
+        result[name] = values[present]
+    return result
+
+
+@instr.instrument()
 def create_mean_sd_o2(highstreet_df, predictor_days):
-    df = []
-    for days in predictor_days:
-        df.append(highstreet_df.loc[(highstreet_df["count_date"] == days)])
-    df = pd.concat(df)
-
-    # group to create mean and std across all months
-    mean = df.groupby(["highstreet_name"]).mean().reset_index()
-    # rename and merge so less possibility of mistakes
-    mean = mean.rename({"h13": "mean_o2"}, axis=1)
-    std = df.groupby(["highstreet_name"]).std().reset_index()
-    std = std.rename({"h13": "std_o2"}, axis=1)
-    # merge and select columns
-    features = pd.merge(mean, std, on="highstreet_name")[
-        ["highstreet_name", "mean_o2", "std_o2"]
-    ]
-    return features
-
-    # loop and select data for relevant months
+    """Mean and standard deviation of the 1pm O2 count of each high street
+    over the given days"""
+    return build_feature_frame(
+        highstreet_df,
+        [
+            ("h13", "mean", predictor_days, "mean_o2"),
+            ("h13", "std", predictor_days, "std_o2"),
+        ],
+        time_col="count_date",
+    )
 
 
+@instr.instrument()
 def create_mean_sd_mcard(highstreet_df, predictor_months):
-    df = []
-    for months in predictor_months:
-        df.append(highstreet_df.loc[(highstreet_df["month_year"] == months)])
-    df = pd.concat(df)
-
-    # group to create mean and std across all months
-    mean = df.groupby(["highstreet_name"]).mean().reset_index()
-    # rename and merge so less possibility of mistakes
-    mean = mean.rename({"txn_amt_wd_retail": "mean"}, axis=1)
-    std = df.groupby(["highstreet_name"]).std().reset_index()
-    std = std.rename({"txn_amt_wd_retail": "std"}, axis=1)
-    # merge and select columns
-    features = pd.merge(mean, std, on="highstreet_name")[
-        ["highstreet_name", "mean", "std"]
-    ]
-    return features
+    """Mean and standard deviation of the weekday retail spend of each high
+    street over the given months"""
+    return build_feature_frame(
+        highstreet_df,
+        [
+            ("txn_amt_wd_retail", "mean", predictor_months, "mean"),
+            ("txn_amt_wd_retail", "std", predictor_months, "std"),
+        ],
+        time_col="month_year",
+    )
 
 
+@instr.instrument()
 def create_gradient(hs, months):
     """Use linear regression to calculate gradient of each high street
     over the specified range of months"""
+    from sklearn.linear_model import LinearRegression
+
     df = []
     # create df of 3 months
     for month in months:
@@ -115,9 +211,12 @@ def create_gradient(hs, months):
     return gradients
 
 
+@instr.instrument()
 def create_gradient_o2(hs, months):
     """Use linear regression to calculate gradient of each high street
     over the specified range of months"""
+    from sklearn.linear_model import LinearRegression
+
     df = []
     # create df of 3 months
     for month in months:
@@ -0,0 +1,231 @@
+"""
+Index of "similar high streets": the high streets whose recovery behaved
+most like a given one, by their weekly spend series and (optionally) their
+profile features.
+
+Similarity is a weighted sum of:
+    - the correlation of the two high streets' weekly series (as returned by
+        make_dataset.extract_data_array)
+    - the cosine similarity of their standardised profile features (as
+        returned by build_features.clean_hs_profiles)
+
+The index keeps, rather than the series, their sums and the
+(high streets x high streets) matrix of sums of products over weeks, from
+which every correlation is a closed form. Appending new weeks adds their
+products to these sums, so the index never has to be rebuilt from the full
+history. The similarity matrix is computed once after each append, and
+queries for one high street or all of them are partial sorts of its rows.
+
+Usage:
+    index = SimilarityIndex.build(data, profiles)
+    index.query(highstreet_id, k=10)
+    neighbours = index.query_all(k=5)
+    index.append(new_weeks)
+    index.save(index_file)
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from highstreets import instrumentation as instr
+
+
+def _series_matrix(series):
+    """(weeks x high streets) values and high street ids of a frame in the
+    layout of extract_data_array"""
+    columns = series.columns
+    if isinstance(columns, pd.MultiIndex) and "highstreet_id" in columns.names:
+        ids = columns.get_level_values("highstreet_id")
+    else:
+        ids = columns
+    values = series.to_numpy(dtype=float)
+    if np.isnan(values).any():
+        raise ValueError(
+            "Series have missing values, interpolate them first "
+            "(as extract_data_array does)"
+        )
+    return values, pd.Index(ids, name="highstreet_id")
+
+
+def _profile_vectors(profiles, highstreets):
+    """Unit length rows of standardised numeric profile features, missing
+    features counting as the average"""
+    numeric = profiles.select_dtypes("number").reindex(highstreets)
+    values = numeric.to_numpy(dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values = (values - np.nanmean(values, axis=0)) / np.nanstd(values, axis=0)
+    values = np.nan_to_num(values, nan=0.0, posinf=0.0, neginf=0.0)
+    norms = np.linalg.norm(values, axis=1, keepdims=True)
+    return values / np.where(norms > 0, norms, 1)
+
+
+class SimilarityIndex:
+    """Nearest neighbour index of high streets
+
+    :param highstreets: high street ids
+    :type highstreets: array-like
+    :param profile_weight: weight of the profile features in the
+    similarity, the series having 1 - profile_weight, defaults to 0.5 (0 if
+    there are no profile features)
+    :type profile_weight: float, optional
+    """
+
+    def __init__(self, highstreets, profile_weight=0.5):
+        self.highstreets = pd.Index(highstreets, name="highstreet_id")
+        n = len(self.highstreets)
+        self.profile_weight = profile_weight
+        self.weeks = pd.DatetimeIndex([])
+        self.sums = np.zeros(n)
+        self.products = np.zeros((n, n))
+        self.profile_vectors = None
+        self._similarity = None
+
+    @classmethod
+    @instr.instrument()
+    def build(cls, series, profiles=None, profile_weight=0.5):
+        """Builds an index
+
+        :param series: weekly series, one row per week and one column per
+        high street, as returned by make_dataset.extract_data_array
+        :type series: pandas dataframe
+        :param profiles: profile features, indexed by high street id,
+        defaults to None
+        :type profiles: pandas dataframe, optional
+        :param profile_weight: weight of the profile features, defaults to 0.5
+        :type profile_weight: float, optional
+        :rtype: SimilarityIndex
+        """
+        _, highstreets = _series_matrix(series)
+        index = cls(highstreets, profile_weight if profiles is not None else 0.0)
+        if profiles is not None:
+            index.profile_vectors = _profile_vectors(profiles, index.highstreets)
+        index.append(series)
+        return index
+
+    @instr.instrument()
+    def append(self, series):
+        """Adds weeks to the index
+
+        :param series: weekly series of every high street in the index, in
+        the layout of extract_data_array. Weeks must come after the last
+        week in the index
+        :type series: pandas dataframe
+        """
+        values, ids = _series_matrix(series)
+        weeks = pd.DatetimeIndex(series.index)
+        if len(self.weeks) and len(weeks) and weeks.min() <= self.weeks[-1]:
+            raise ValueError(
+                "New weeks must come after the last week in the index "
+                f"({self.weeks[-1]:%Y-%m-%d})"
+            )
+        columns = ids.get_indexer(self.highstreets)
+        if (columns < 0).any():
+            missing = self.highstreets[columns < 0]
+            raise KeyError(f"No series for high streets: {list(missing)}")
+
+        values = values[:, columns]
+        self.sums += values.sum(axis=0)
+        self.products += values.T @ values
+        self.weeks = self.weeks.append(weeks)
+        self._similarity = None
+
+    def correlation(self):
+        """(high streets x high streets) correlation of the series"""
+        n = len(self.weeks)
+        cov = self.products - np.outer(self.sums, self.sums) / n
+        sd = np.sqrt(np.clip(np.diag(cov), 0, None))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr = cov / np.outer(sd, sd)
+        # constant series are unlike every other
+        return np.nan_to_num(corr, nan=0.0)
+
+    @property
+    def similarity(self):
+        """(high streets x high streets) similarity, computed once per append"""
+        if self._similarity is None:
+            similarity = (1 - self.profile_weight) * self.correlation()
+            if self.profile_vectors is not None and self.profile_weight:
+                similarity += self.profile_weight * (
+                    self.profile_vectors @ self.profile_vectors.T
+                )
+            self._similarity = similarity
+        return self._similarity
+
+    def _top_k(self, rows, k):
+        """Positions and similarities of the k most similar high streets to
+        each row, most similar first, excluding the high street itself"""
+        similarity = self.similarity[rows].copy()
+        similarity[np.arange(len(rows)), rows] = -np.inf
+        k = min(k, len(self.highstreets) - 1)
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        top_sim = np.take_along_axis(similarity, top, axis=1)
+        order = np.argsort(-top_sim, axis=1, kind="stable")
+        return (
+            np.take_along_axis(top, order, axis=1),
+            np.take_along_axis(top_sim, order, axis=1),
+        )
+
+    def query(self, highstreet_id, k=10):
+        """The k high streets most similar to one
+
+        :param highstreet_id: high street to find neighbours of
+        :param k: number of neighbours, defaults to 10
+        :type k: int, optional
+        :return: the neighbours' ids and similarities, most similar first
+        :rtype: pandas dataframe
+        """
+        row = self.highstreets.get_loc(highstreet_id)
+        top, top_sim = self._top_k(np.array([row]), k)
+        return pd.DataFrame(
+            {"highstreet_id": self.highstreets[top[0]], "similarity": top_sim[0]}
+        )
+
+    @instr.instrument()
+    def query_all(self, k=10):
+        """The k most similar high streets to every high street
+
+        :param k: number of neighbours, defaults to 10
+        :type k: int, optional
+        :return: one row per high street and neighbour, with its rank (1 =
+        most similar)
+        :rtype: pandas dataframe
+        """
+        n = len(self.highstreets)
+        top, top_sim = self._top_k(np.arange(n), k)
+        k = top.shape[1]
+        return pd.DataFrame(
+            {
+                "highstreet_id": np.repeat(self.highstreets.to_numpy(), k),
+                "rank": np.tile(np.arange(1, k + 1), n),
+                "neighbour_id": self.highstreets.to_numpy()[top.ravel()],
+                "similarity": top_sim.ravel(),
+            }
+        )
+
+    def save(self, index_file):
+        """Saves the index to an .npz file"""
+        metadata = {
+            "highstreets": [
+                i.item() if isinstance(i, np.generic) else i for i in self.highstreets
+            ],
+            "weeks": [w.strftime("%Y-%m-%d") for w in self.weeks],
+            "profile_weight": self.profile_weight,
+        }
+        arrays = {"sums": self.sums, "products": self.products}
+        if self.profile_vectors is not None:
+            arrays["profile_vectors"] = self.profile_vectors
+        np.savez(index_file, metadata=json.dumps(metadata), **arrays)
+
+    @classmethod
+    def load(cls, index_file):
+        """Loads an index saved with save"""
+        with np.load(index_file) as saved:
+            metadata = json.loads(str(saved["metadata"]))
+            index = cls(metadata["highstreets"], metadata["profile_weight"])
+            index.weeks = pd.DatetimeIndex(metadata["weeks"])
+            index.sums = saved["sums"]
+            index.products = saved["products"]
+            if "profile_vectors" in saved:
+                index.profile_vectors = saved["profile_vectors"]
+        return index
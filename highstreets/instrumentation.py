@@ -0,0 +1,232 @@
+"""
+Lightweight timing and memory instrumentation for pipeline stages.
+
+Instrumentation is off by default, so decorated functions run with only the
+cost of a flag check. It is switched on by setting HIGHSTREETS_INSTRUMENT=1
+in the environment/.env file, or by calling enable(). When on, each stage
+records:
+    - wall_time_s: elapsed wall clock time
+    - cpu_time_s: CPU time used by the process during the stage
+    - peak_rss_mb: the process' peak resident set size at the end of the
+        stage (not available on Windows)
+    - rss_growth_mb: how much the stage raised the peak resident set size
+    - rows_in / rows_out: length of the first dataframe/array argument and of
+        the returned dataframe/array, where there is one
+
+Each record is appended as one JSON line to HIGHSTREETS_INSTRUMENT_LOG (if
+set) and a summary table is printed when the process exits.
+
+The settings are read the first time a decorated function is called (or
+is_enabled is), not at import, so importing the package does not load them.
+
+Usage:
+    from highstreets import instrumentation as instr
+
+    @instr.instrument()
+    def clean(df):
+        ...
+
+    with instr.stage("read csv") as record:
+        df = pd.read_csv(file)
+        record["rows_out"] = len(df)
+"""
+import atexit
+import contextlib
+import functools
+import json
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from highstreets import config
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+# enabled is None until the settings are read
+_state = {"enabled": None, "log_file": None, "summary_registered": False}
+_records = []
+
+
+def _read_settings():
+    _state["enabled"] = config.HIGHSTREETS_INSTRUMENT not in ("", "0", "false", "False")
+    if _state["log_file"] is None:
+        _state["log_file"] = config.HIGHSTREETS_INSTRUMENT_LOG
+    if _state["enabled"]:
+        _register_summary()
+
+
+def enable(log_file=None, summary_at_exit=True):
+    """Switches instrumentation on
+
+    :param log_file: file to append JSON records to, defaults to
+    HIGHSTREETS_INSTRUMENT_LOG
+    :type log_file: str, optional
+    :param summary_at_exit: print a summary table when the process exits,
+    defaults to True
+    :type summary_at_exit: bool, optional
+    """
+    _state["enabled"] = True
+    _state["log_file"] = (
+        log_file or _state["log_file"] or config.HIGHSTREETS_INSTRUMENT_LOG
+    )
+    if summary_at_exit:
+        _register_summary()
+
+
+def disable():
+    """Switches instrumentation off"""
+    _state["enabled"] = False
+
+
+def is_enabled():
+    if _state["enabled"] is None:
+        _read_settings()
+    return _state["enabled"]
+
+
+def reset():
+    """Discards the records collected so far"""
+    _records.clear()
+
+
+def _register_summary():
+    if not _state["summary_registered"]:
+        atexit.register(print_summary)
+        _state["summary_registered"] = True
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _n_rows(obj):
+    """Number of rows of a dataframe/array, or of the first one in a tuple"""
+    if isinstance(obj, tuple):
+        for item in obj:
+            n = _n_rows(item)
+            if n is not None:
+                return n
+        return None
+    shape = getattr(obj, "shape", None)
+    if shape:
+        return shape[0]
+    return None
+
+
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+    """Context manager recording the time and memory used by the code it
+    wraps. Yields a dict to which rows_in/rows_out (or any other JSON
+    serialisable fields) can be added
+
+    :param name: name of the stage
+    :type name: str
+    :param rows_in: number of rows going into the stage, defaults to None
+    :type rows_in: int, optional
+    """
+    record = {"stage": name, "rows_in": rows_in, "rows_out": None}
+    if not is_enabled():
+        yield record
+        return
+
+    rss_start = _peak_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall_time_s"] = time.perf_counter() - wall_start
+        record["cpu_time_s"] = time.process_time() - cpu_start
+        record["peak_rss_mb"] = _peak_rss_mb()
+        record["rss_growth_mb"] = (
+            record["peak_rss_mb"] - rss_start if rss_start is not None else None
+        )
+        record["timestamp"] = datetime.now().isoformat(timespec="milliseconds")
+        _records.append(record)
+        _write(record)
+
+
+def _write(record):
+    if _state["log_file"] is None:
+        return
+    with open(_state["log_file"], "a") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+
+def instrument(name=None):
+    """Decorator recording each call of the decorated function as a stage.
+    rows_in is taken from the first dataframe/array argument and rows_out from
+    the returned value
+
+    :param name: stage name, defaults to <module>.<function>
+    :type name: str, optional
+    """
+
+    def decorator(func):
+        stage_name = name or f"{func.__module__.split('.')[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return func(*args, **kwargs)
+
+            rows_in = next(
+                (n for n in map(_n_rows, args) if n is not None),
+                None,
+            )
+            with stage(stage_name, rows_in=rows_in) as record:
+                result = func(*args, **kwargs)
+                record["rows_out"] = _n_rows(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def records():
+    """Returns the records collected so far as a dataframe, one row per
+    stage call"""
+    return pd.DataFrame(_records)
+
+
+def summary():
+    """Aggregates the records collected so far by stage
+
+    :return: number of calls, total wall and CPU time, maximum peak RSS and
+    total rows in and out per stage, slowest first
+    :rtype: pandas dataframe
+    """
+    df = records()
+    if df.empty:
+        return df
+
+    return (
+        df.groupby("stage", sort=False)
+        .agg(
+            calls=("stage", "size"),
+            wall_time_s=("wall_time_s", "sum"),
+            cpu_time_s=("cpu_time_s", "sum"),
+            peak_rss_mb=("peak_rss_mb", "max"),
+            rows_in=("rows_in", "sum"),
+            rows_out=("rows_out", "sum"),
+        )
+        .sort_values("wall_time_s", ascending=False)
+    )
+
+
+def print_summary():
+    """Prints the summary table, if anything has been recorded"""
+    df = summary()
+    if not df.empty:
+        print("\nStage timings:")
+        print(df.to_string(float_format=lambda x: f"{x:.3f}"))
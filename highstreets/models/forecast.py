@@ -0,0 +1,342 @@
+"""
+Forecasts of the weekly spend of every high street at once, with simple
+exponential smoothing (SES), Holt's linear trend method or the seasonal
+naive method.
+
+The series are the columns of a (weeks x high streets) array, e.g. as
+returned by make_dataset.extract_data_array. Rather than one model object
+per series, each method runs its recursions over the weeks with the state
+of every series (and every candidate parameter value) held in one array:
+    - SES:    l_t = alpha * y_t + (1 - alpha) * l_{t-1}
+              forecast l_T
+    - Holt:   l_t = alpha * y_t + (1 - alpha) * (l_{t-1} + b_{t-1})
+              b_t = beta * (l_t - l_{t-1}) + (1 - beta) * b_{t-1}
+              forecast l_T + h * b_T
+    - seasonal naive: the value one period (e.g. 52 weeks) earlier
+The smoothing parameters of each series are chosen from a grid by the sum of
+squared one step ahead errors, the whole grid being run in one pass.
+Missing weeks are skipped (the state is carried forward). Prediction
+intervals are normal, with the standard deviation of the one step errors
+scaled by each method's h step variance.
+
+backtest evaluates a method from many forecast origins without refitting:
+the parameters are chosen on the weeks before the first origin, and a single
+run over the series gives the state at every origin, so the forecasts from
+every origin come from one array operation.
+
+Usage:
+    data = make_dataset.extract_data_array(hsd_long, dates, "txn_amt")
+    fc = forecast(data, horizon=8, method="holt")
+    summary, errors = backtest(data, horizon=8, origins=range(104, 200, 4))
+"""
+from collections import namedtuple
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from highstreets import instrumentation as instr
+
+Forecast = namedtuple("Forecast", ["mean", "lower", "upper"])
+
+METHODS = ["ses", "holt", "snaive"]
+
+# candidate smoothing parameters
+ALPHA_GRID = np.linspace(0.05, 0.95, 19)
+BETA_GRID = np.linspace(0.05, 0.5, 10)
+
+
+def _smooth(values, alpha, beta=None, keep_states=False):
+    """Runs SES (beta None) or Holt's method over the first axis of values
+
+    :param values: (weeks x series) array
+    :type values: numpy array
+    :param alpha: level smoothing, broadcastable against a row of values
+    (e.g. (grid x 1) to run a grid of values for every series)
+    :type alpha: numpy array
+    :param beta: trend smoothing, defaults to None (no trend)
+    :type beta: numpy array, optional
+    :param keep_states: also return the level, trend and one step error
+    after every week, defaults to False
+    :type keep_states: bool, optional
+    :return: the final state and the sum and number of squared one step
+    errors (and the states, if kept)
+    :rtype: dict
+    """
+    shape = np.broadcast_shapes(np.shape(alpha), np.shape(beta), values.shape[1:])
+    level = np.full(shape, np.nan)
+    trend = np.zeros(shape)
+    sse = np.zeros(shape)
+    n_errors = np.zeros(shape)
+    if keep_states:
+        levels = np.empty((len(values),) + shape)
+        trends = np.empty((len(values),) + shape)
+        errors = np.empty((len(values),) + shape)
+
+    has_gaps = np.isnan(values).any()
+    for t, y in enumerate(values):
+        if not has_gaps:
+            # no masking needed: start the level at the first week
+            if t == 0:
+                level = np.zeros(shape) + y
+            else:
+                prediction = level + trend
+                error = y - prediction
+                sse += error * error
+                new_level = prediction + alpha * error
+                if beta is not None:
+                    trend = trend + beta * (new_level - level - trend)
+                level = new_level
+                n_errors += 1
+            if keep_states:
+                levels[t], trends[t] = level, trend
+                errors[t] = np.nan if t == 0 else error
+            continue
+
+        prediction = level + trend
+        error = y - prediction
+        observed = ~np.isnan(error)
+        sse += np.where(observed, error * error, 0)
+        n_errors += observed
+
+        # the first observation starts the level, missing weeks carry the
+        # prediction forward
+        new_level = np.where(
+            np.isnan(level),
+            y,
+            np.where(np.isnan(y), prediction, prediction + alpha * error),
+        )
+        if beta is not None:
+            trend = np.where(
+                observed, trend + beta * (new_level - level - trend), trend
+            )
+        level = new_level
+
+        if keep_states:
+            levels[t], trends[t], errors[t] = level, trend, error
+
+    result = {"level": level, "trend": trend, "sse": sse, "n_errors": n_errors}
+    if keep_states:
+        result.update(levels=levels, trends=trends, errors=errors)
+    return result
+
+
+def fit_parameters(values, method="ses"):
+    """Chooses the smoothing parameters of every series from ALPHA_GRID (and
+    BETA_GRID) by the sum of squared one step errors
+
+    :param values: (weeks x series) array
+    :type values: numpy array
+    :param method: 'ses' or 'holt', defaults to 'ses'
+    :type method: str, optional
+    :return: alpha and beta (None for SES) of each series
+    :rtype: tuple(numpy array, numpy array)
+    """
+    if method == "ses":
+        alphas, betas = ALPHA_GRID, None
+    else:
+        alphas, betas = (g.ravel() for g in np.meshgrid(ALPHA_GRID, BETA_GRID))
+
+    fit = _smooth(
+        values,
+        alphas[:, None],
+        None if betas is None else betas[:, None],
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mse = fit["sse"] / fit["n_errors"]
+    best = np.argmin(np.nan_to_num(mse, nan=np.inf), axis=0)
+    return alphas[best], None if betas is None else betas[best]
+
+
+def _variance_factor(method, horizons, alpha=None, beta=None, period=52):
+    """(horizons x series) ratio of the h step to the one step forecast
+    variance"""
+    h = horizons[:, None].astype(float)
+    if method == "ses":
+        return 1 + (h - 1) * alpha**2
+    if method == "holt":
+        # with the trend smoothing written as a share of alpha, as in the
+        # state space form of Holt's method
+        b = alpha * beta
+        return 1 + (h - 1) * (alpha**2 + alpha * b * h + b**2 * h * (2 * h - 1) / 6)
+    return np.floor((h - 1) / period) + 1
+
+
+def _seasonal_naive(values, origins, horizons, period):
+    """(origins x horizons x series) value one season before each target
+    week, NaN where that is before the first week, and the one step errors
+    y_t - y_{t - period}"""
+    seasons_back = np.ceil(horizons / period).astype(int) * period
+    rows = origins[:, None] - 1 + horizons[None, :] - seasons_back[None, :]
+    forecasts = values[np.clip(rows, 0, None)]
+    forecasts[rows < 0] = np.nan
+    errors = np.full(values.shape, np.nan)
+    errors[period:] = values[period:] - values[:-period]
+    return forecasts, errors
+
+
+def _rms(errors):
+    """Root mean square of the one step errors of each series, ignoring
+    NaNs (NaN for series without any)"""
+    observed = ~np.isnan(errors)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sqrt(
+            np.where(observed, errors**2, 0).sum(axis=0) / observed.sum(axis=0)
+        )
+
+
+def _as_array(data):
+    if isinstance(data, pd.DataFrame):
+        return data.to_numpy(dtype=float)
+    values = np.asarray(data, dtype=float)
+    return values[:, None] if values.ndim == 1 else values
+
+
+def _future_index(index, horizon):
+    """The horizon steps after the end of a (regular) time index"""
+    step = index[-1] - index[-2] if len(index) > 1 else pd.Timedelta(weeks=1)
+    return pd.Index(
+        [index[-1] + step * h for h in range(1, horizon + 1)], name=index.name
+    )
+
+
+@instr.instrument()
+def forecast(data, horizon=8, method="ses", level=0.95, period=52):
+    """Forecasts every series
+
+    :param data: (weeks x high streets) series, as returned by
+    extract_data_array
+    :type data: pandas dataframe or numpy array
+    :param horizon: number of weeks to forecast, defaults to 8
+    :type horizon: int, optional
+    :param method: 'ses', 'holt' or 'snaive', defaults to 'ses'
+    :type method: str, optional
+    :param level: coverage of the prediction intervals, defaults to 0.95
+    :type level: float, optional
+    :param period: season length of the seasonal naive method, defaults to
+    52
+    :type period: int, optional
+    :return: (horizon x high streets) forecasts and interval bounds, as
+    dataframes indexed by the forecast weeks if data is a dataframe. Seasonal
+    naive forecasts are NaN for weeks with no week one season earlier
+    :rtype: Forecast
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, not {method!r}")
+
+    values = _as_array(data)
+    horizons = np.arange(1, horizon + 1)
+    n_weeks = len(values)
+
+    if method == "snaive":
+        mean, errors = _seasonal_naive(values, np.array([n_weeks]), horizons, period)
+        mean = mean[0]
+        alpha = beta = None
+        sigma = _rms(errors)
+    else:
+        alpha, beta = fit_parameters(values, method)
+        fit = _smooth(values, alpha, beta)
+        mean = fit["level"] + horizons[:, None] * fit["trend"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sigma = np.sqrt(fit["sse"] / fit["n_errors"])
+
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    half_width = (
+        z * sigma * np.sqrt(_variance_factor(method, horizons, alpha, beta, period))
+    )
+    result = Forecast(mean, mean - half_width, mean + half_width)
+
+    if isinstance(data, pd.DataFrame):
+        index = _future_index(data.index, horizon)
+        return Forecast(*(pd.DataFrame(a, index, data.columns) for a in result))
+    return result
+
+
+@instr.instrument()
+def backtest(data, horizon=8, origins=None, method="ses", level=0.95, period=52):
+    """Rolling origin evaluation of a method: forecasts from every origin
+    without refitting, compared with what happened
+
+    :param data: (weeks x high streets) series, as returned by
+    extract_data_array
+    :type data: pandas dataframe or numpy array
+    :param horizon: number of weeks forecast from each origin, defaults to 8
+    :type horizon: int, optional
+    :param origins: number of weeks available at each origin (forecasts
+    start at that week), defaults to every week from the second half of data
+    :type origins: list[int], optional
+    :param method: 'ses', 'holt' or 'snaive', defaults to 'ses'
+    :type method: str, optional
+    :param level: coverage of the prediction intervals, defaults to 0.95
+    :type level: float, optional
+    :param period: season length of the seasonal naive method, defaults to
+    52
+    :type period: int, optional
+    :return: the mean absolute error, root mean squared error and interval
+    coverage at each horizon, and the (origins x horizons x high streets)
+    forecast errors
+    :rtype: tuple(pandas dataframe, numpy array)
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, not {method!r}")
+
+    values = _as_array(data)
+    n_weeks = len(values)
+    if origins is None:
+        origins = range(n_weeks // 2, n_weeks - horizon + 1)
+    origins = np.asarray(list(origins))
+    if origins.min() < 2 or origins.max() > n_weeks - horizon:
+        raise ValueError(
+            f"Origins must be between 2 and {n_weeks - horizon} for {n_weeks} "
+            f"weeks and horizon {horizon}"
+        )
+    if method == "snaive" and origins.min() < period:
+        # earlier origins have no week one season before some target weeks
+        raise ValueError(
+            f"Origins must be at least the period ({period}) for the seasonal "
+            "naive method"
+        )
+    horizons = np.arange(1, horizon + 1)
+
+    alpha = beta = None
+    if method == "snaive":
+        forecasts, one_step_errors = _seasonal_naive(values, origins, horizons, period)
+    else:
+        # parameters from the weeks before the first origin only
+        alpha, beta = fit_parameters(values[: origins.min()], method)
+        fit = _smooth(values, alpha, beta, keep_states=True)
+        last = origins - 1
+        forecasts = (
+            fit["levels"][last][:, None, :]
+            + horizons[None, :, None] * fit["trends"][last][:, None, :]
+        )
+        one_step_errors = fit["errors"]
+
+    actuals = values[origins[:, None] - 1 + horizons[None, :]]
+    errors = actuals - forecasts
+
+    # standard deviation of the one step errors up to each origin
+    observed = ~np.isnan(one_step_errors)
+    sse = np.cumsum(np.where(observed, one_step_errors**2, 0), axis=0)
+    counts = np.cumsum(observed, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sigma = np.sqrt(sse[origins - 1] / counts[origins - 1])
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    half_width = (
+        z
+        * sigma[:, None, :]
+        * np.sqrt(_variance_factor(method, horizons, alpha, beta, period))[None]
+    )
+
+    scored = ~np.isnan(errors) & ~np.isnan(half_width)
+    with np.errstate(invalid="ignore"):
+        covered = np.abs(errors) <= half_width
+    summary = pd.DataFrame(
+        {
+            "mae": np.nanmean(np.abs(errors), axis=(0, 2)),
+            "rmse": np.sqrt(np.nanmean(errors**2, axis=(0, 2))),
+            "coverage": (covered & scored).sum(axis=(0, 2)) / scored.sum(axis=(0, 2)),
+        },
+        index=pd.Index(horizons, name="horizon"),
+    )
+    return summary, errors
@@ -0,0 +1,494 @@
+"""
+Hierarchical linear regression of high street recovery, fitting every high
+street jointly. This is the model explored in the notebook
+0.4-cd-explore-hierarchical-regression-pyro:
+
+    mu_a ~ N(0, (5 m_y)^2),  tau_a ~ Gamma(1, s_y^2)
+    mu_b ~ N(0, (5 s_b)^2),  tau_b ~ Gamma(1, s_b^2)
+    a_i ~ N(mu_a, 1 / tau_a),  b_i ~ N(mu_b, 1 / tau_b)   for each high street i
+    tau ~ Gamma(1, s_y^2)
+    y_ij ~ N(a_i + b_i * weeks_ij, 1 / tau)
+
+where y is e.g. yoy spend and weeks is the number of weeks since the start of
+the recovery period. The notebook put half-normal priors on the standard
+deviations; here they are replaced by gamma priors on the precisions, which
+makes the model conditionally conjugate so it can be fit with closed-form
+variational updates instead of MCMC.
+
+Fixed priors such as Gamma(1, 1) are not weakly informative here: a rate of 1
+puts the prior standard deviations near 1, far above the spread of slopes
+measured per week, and dominates the posterior of sigma_b. The priors are
+instead scaled to the data: s_y is the standard deviation of y, m_y the root
+mean square of y and s_b = s_y / the standard deviation of weeks, so the
+prior standard deviations are of the order of the data's own spread.
+
+The posterior is approximated by
+    q(a_i, b_i) q(mu_a) q(mu_b) q(tau_a) q(tau_b) q(tau)
+(a bivariate normal per high street, normals for the means and gammas for the
+precisions) and fitted with stochastic variational inference: each step
+updates the local factors of a minibatch of high streets in one vectorised
+operation and then takes a natural-gradient step on the global factors. The
+data are reduced to per high street sufficient statistics once, so each
+step's cost depends on the minibatch size only, not the number of weeks.
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import stats as spstat
+from scipy.special import gammaln
+
+# prior hyperparameters, relative to the scales of the data (see _priors)
+PRIOR_MEAN_SCALE = 5.0
+PRIOR_GAMMA_SHAPE = 1.0
+
+GLOBAL_PARAMS = ("mu_a", "mu_b", "tau_a", "tau_b", "tau")
+
+
+def prepare_data(hsd_long_format, dates, column="txn_amt", start_date=None):
+    """Extracts the arrays the model is fit on from Mastercard data in long
+    format (as returned by make_dataset.stack_retail_we_wd)
+
+    :param hsd_long_format: Mastercard data in long format, indexed by
+    period_start
+    :type hsd_long_format: pandas dataframe
+    :param dates: date range to fit the model to
+    :type dates: (str, str)
+    :param column: column to model, defaults to 'txn_amt'
+    :type column: str, optional
+    :param start_date: date from which weeks are counted, defaults to
+    dates[0]
+    :type start_date: str, optional
+    :return: highstreet ids, weeks since start_date and observations, one
+    entry per row of data in the date range
+    :rtype: (numpy array, numpy array, numpy array)
+    """
+    data = hsd_long_format.sort_index().loc[dates[0] : dates[1]].dropna(subset=[column])
+    t0 = pd.to_datetime(start_date if start_date is not None else dates[0])
+    weeks = (data.index - t0) / pd.Timedelta(1, "W")
+
+    return (
+        data["highstreet_id"].to_numpy(),
+        np.asarray(weeks, dtype=float),
+        data[column].to_numpy(dtype=float),
+    )
+
+
+def _sufficient_stats(hs_idx, weeks, obs, n_hs):
+    """Per high street sums needed by the variational updates"""
+
+    def total(x):
+        return np.bincount(hs_idx, weights=x, minlength=n_hs)
+
+    return {
+        "n": np.bincount(hs_idx, minlength=n_hs).astype(float),
+        "sw": total(weeks),
+        "sww": total(weeks * weeks),
+        "sy": total(obs),
+        "swy": total(weeks * obs),
+        "syy": total(obs * obs),
+    }
+
+
+def _priors(stats):
+    """Prior precisions of mu_a and mu_b and prior rates of the gamma factors,
+    scaled to the observations and weeks summarised in stats"""
+    n = stats["n"].sum()
+
+    def spread(total, total_sq):
+        var = total_sq.sum() / n - (total.sum() / n) ** 2
+        return np.sqrt(var) if var > 0 else 1.0
+
+    y_scale = spread(stats["sy"], stats["syy"])
+    y_size = np.sqrt(stats["syy"].sum() / n) or 1.0
+    b_scale = y_scale / spread(stats["sw"], stats["sww"])
+
+    return {
+        "mu_a": 1 / (PRIOR_MEAN_SCALE * y_size) ** 2,
+        "mu_b": 1 / (PRIOR_MEAN_SCALE * b_scale) ** 2,
+        "tau_a": PRIOR_GAMMA_SHAPE * y_scale**2,
+        "tau_b": PRIOR_GAMMA_SHAPE * b_scale**2,
+        "tau": PRIOR_GAMMA_SHAPE * y_scale**2,
+    }
+
+
+def _init_params(n_hs, priors):
+    return {
+        # natural parameters of the gaussian factors: (precision * mean, precision)
+        "mu_a": np.array([0.0, priors["mu_a"]]),
+        "mu_b": np.array([0.0, priors["mu_b"]]),
+        # shape and rate of the gamma factors
+        "tau_a": np.array([PRIOR_GAMMA_SHAPE, priors["tau_a"]]),
+        "tau_b": np.array([PRIOR_GAMMA_SHAPE, priors["tau_b"]]),
+        "tau": np.array([PRIOR_GAMMA_SHAPE, priors["tau"]]),
+        # mean and covariance of q(a_i, b_i)
+        "ab_mean": np.zeros((n_hs, 2)),
+        "ab_cov": np.tile(np.eye(2), (n_hs, 1, 1)),
+        "step": np.array(0),
+    }
+
+
+def _gaussian_moments(natural):
+    mean = natural[0] / natural[1]
+    return mean, mean**2 + 1 / natural[1]
+
+
+def _gamma_mean(shape_rate):
+    return shape_rate[0] / shape_rate[1]
+
+
+def _update_local(params, stats, batch):
+    """Updates q(a_i, b_i) for the high streets in batch, all at once"""
+    e_tau = _gamma_mean(params["tau"])
+    e_tau_a = _gamma_mean(params["tau_a"])
+    e_tau_b = _gamma_mean(params["tau_b"])
+    e_mu_a, _ = _gaussian_moments(params["mu_a"])
+    e_mu_b, _ = _gaussian_moments(params["mu_b"])
+
+    precision = np.empty((len(batch), 2, 2))
+    precision[:, 0, 0] = e_tau * stats["n"][batch] + e_tau_a
+    precision[:, 0, 1] = e_tau * stats["sw"][batch]
+    precision[:, 1, 0] = precision[:, 0, 1]
+    precision[:, 1, 1] = e_tau * stats["sww"][batch] + e_tau_b
+
+    linear = np.stack(
+        [
+            e_tau * stats["sy"][batch] + e_tau_a * e_mu_a,
+            e_tau * stats["swy"][batch] + e_tau_b * e_mu_b,
+        ],
+        axis=1,
+    )
+
+    cov = np.linalg.inv(precision)
+    params["ab_cov"][batch] = cov
+    params["ab_mean"][batch] = np.einsum("nij,nj->ni", cov, linear)
+
+
+def _global_targets(params, stats, priors, batch, n_hs):
+    """Optimal global factors if the whole data set looked like batch"""
+    scale = n_hs / len(batch)
+
+    mean = params["ab_mean"][batch]
+    cov = params["ab_cov"][batch]
+    e_a, e_b = mean[:, 0], mean[:, 1]
+    e_aa = e_a**2 + cov[:, 0, 0]
+    e_bb = e_b**2 + cov[:, 1, 1]
+    e_ab = e_a * e_b + cov[:, 0, 1]
+
+    e_tau_a = _gamma_mean(params["tau_a"])
+    e_tau_b = _gamma_mean(params["tau_b"])
+    e_mu_a, e_mu_aa = _gaussian_moments(params["mu_a"])
+    e_mu_b, e_mu_bb = _gaussian_moments(params["mu_b"])
+
+    # expected residual sum of squares for each high street
+    rss = (
+        stats["syy"][batch]
+        - 2 * (e_a * stats["sy"][batch] + e_b * stats["swy"][batch])
+        + stats["n"][batch] * e_aa
+        + 2 * stats["sw"][batch] * e_ab
+        + stats["sww"][batch] * e_bb
+    )
+
+    return {
+        "mu_a": np.array(
+            [
+                e_tau_a * scale * e_a.sum(),
+                priors["mu_a"] + n_hs * e_tau_a,
+            ]
+        ),
+        "mu_b": np.array(
+            [
+                e_tau_b * scale * e_b.sum(),
+                priors["mu_b"] + n_hs * e_tau_b,
+            ]
+        ),
+        "tau_a": np.array(
+            [
+                PRIOR_GAMMA_SHAPE + n_hs / 2,
+                priors["tau_a"]
+                + 0.5 * scale * (e_aa - 2 * e_a * e_mu_a + e_mu_aa).sum(),
+            ]
+        ),
+        "tau_b": np.array(
+            [
+                PRIOR_GAMMA_SHAPE + n_hs / 2,
+                priors["tau_b"]
+                + 0.5 * scale * (e_bb - 2 * e_b * e_mu_b + e_mu_bb).sum(),
+            ]
+        ),
+        "tau": np.array(
+            [
+                PRIOR_GAMMA_SHAPE + stats["n"].sum() / 2,
+                priors["tau"] + 0.5 * scale * rss.sum(),
+            ]
+        ),
+    }
+
+
+def save_checkpoint(params, checkpoint_file, highstreet_ids):
+    """Saves the variational parameters so a fit can be resumed"""
+    np.savez(checkpoint_file, highstreet_ids=highstreet_ids, **params)
+
+
+def load_checkpoint(checkpoint_file):
+    """Loads variational parameters saved by save_checkpoint
+
+    :return: highstreet ids and variational parameters
+    :rtype: (numpy array, dict)
+    """
+    with np.load(checkpoint_file) as f:
+        params = {k: f[k] for k in f.files}
+    return params.pop("highstreet_ids"), params
+
+
+def fit_hierarchical(
+    highstreet_id,
+    weeks,
+    obs,
+    batch_size=128,
+    n_epochs=200,
+    tol=1e-3,
+    forgetting_rate=0.7,
+    delay=1.0,
+    checkpoint_file=None,
+    checkpoint_every=10,
+    resume=False,
+    random_state=0,
+    verbose=False,
+):
+    """Fits the hierarchical regression to all high streets jointly with
+    minibatched stochastic variational inference
+
+    :param highstreet_id: highstreet id of each observation
+    :type highstreet_id: numpy array
+    :param weeks: weeks since the start of the period for each observation
+    :type weeks: numpy array
+    :param obs: observed values
+    :type obs: numpy array
+    :param batch_size: number of high streets per minibatch, defaults to 128
+    :type batch_size: int, optional
+    :param n_epochs: maximum number of passes over the high streets,
+    defaults to 200
+    :type n_epochs: int, optional
+    :param tol: stop once no global posterior mean changes by more than tol
+    relative to its size over an epoch, defaults to 1e-3. Minibatch noise
+    keeps the global factors moving by about the step size, so this is
+    relative to cope with precisions of very different scales
+    :type tol: float, optional
+    :param forgetting_rate: exponent of the step size schedule
+    (step + delay) ** -forgetting_rate, in (0.5, 1], defaults to 0.7
+    :type forgetting_rate: float, optional
+    :param delay: delay of the step size schedule, defaults to 1.0
+    :type delay: float, optional
+    :param checkpoint_file: .npz file to save the parameters to every
+    checkpoint_every epochs and at the end of the fit, defaults to None
+    :type checkpoint_file: str, optional
+    :param checkpoint_every: epochs between checkpoints, defaults to 10
+    :type checkpoint_every: int, optional
+    :param resume: start from the parameters in checkpoint_file if it exists,
+    defaults to False
+    :type resume: bool, optional
+    :param random_state: seed for the minibatch order, defaults to 0
+    :type random_state: int, optional
+    :param verbose: print progress every epoch, defaults to False
+    :type verbose: bool, optional
+    :return: fitted variational parameters, including 'highstreet_ids' and
+    the number of epochs run
+    :rtype: dict
+    """
+    highstreet_ids, hs_idx = np.unique(highstreet_id, return_inverse=True)
+    n_hs = len(highstreet_ids)
+    stats = _sufficient_stats(
+        hs_idx, np.asarray(weeks, float), np.asarray(obs, float), n_hs
+    )
+
+    priors = _priors(stats)
+    params = _init_params(n_hs, priors)
+    if resume and checkpoint_file is not None and os.path.exists(checkpoint_file):
+        saved_ids, params = load_checkpoint(checkpoint_file)
+        if not np.array_equal(saved_ids, highstreet_ids):
+            raise ValueError(f"{checkpoint_file} was fit to different high streets")
+
+    rng = np.random.default_rng(random_state)
+    batch_size = min(batch_size, n_hs)
+    full_batch = batch_size == n_hs
+
+    epoch = 0
+    for epoch in range(1, n_epochs + 1):
+        previous = _global_means(params)
+
+        order = rng.permutation(n_hs)
+        for start in range(0, n_hs, batch_size):
+            batch = order[start : start + batch_size]
+            _update_local(params, stats, batch)
+            targets = _global_targets(params, stats, priors, batch, n_hs)
+
+            # with a single batch this is plain coordinate ascent
+            rho = 1.0 if full_batch else (params["step"] + delay) ** -forgetting_rate
+            for k in GLOBAL_PARAMS:
+                params[k] = (1 - rho) * params[k] + rho * targets[k]
+            params["step"] = params["step"] + 1
+
+        current = _global_means(params)
+        change = max(
+            abs(current[k] - previous[k]) / max(abs(previous[k]), np.finfo(float).tiny)
+            for k in previous
+        )
+        if verbose:
+            print(f"epoch {epoch}: max relative change in global means {change:.2e}")
+
+        if checkpoint_file is not None and epoch % checkpoint_every == 0:
+            save_checkpoint(params, checkpoint_file, highstreet_ids)
+
+        if change < tol:
+            break
+
+    # bring every high street's local factor up to date with the final globals
+    _update_local(params, stats, np.arange(n_hs))
+    if checkpoint_file is not None:
+        save_checkpoint(params, checkpoint_file, highstreet_ids)
+
+    params["highstreet_ids"] = highstreet_ids
+    params["epochs"] = epoch
+    return params
+
+
+def _global_means(params):
+    return {
+        "mu_a": params["mu_a"][0] / params["mu_a"][1],
+        "mu_b": params["mu_b"][0] / params["mu_b"][1],
+        "tau_a": _gamma_mean(params["tau_a"]),
+        "tau_b": _gamma_mean(params["tau_b"]),
+        "tau": _gamma_mean(params["tau"]),
+    }
+
+
+def posterior_summary(params, interval=0.95):
+    """Summarises the posterior of each high street's intercept (a) and
+    slope (b)
+
+    :param params: variational parameters returned by fit_hierarchical
+    :type params: dict
+    :param interval: width of the credible intervals, defaults to 0.95
+    :type interval: float, optional
+    :return: posterior mean, standard deviation and credible interval of a
+    and b, indexed by highstreet_id
+    :rtype: pandas dataframe
+    """
+    z = spstat.norm.ppf(0.5 + interval / 2)
+
+    summary = pd.DataFrame(
+        index=pd.Index(params["highstreet_ids"], name="highstreet_id")
+    )
+    for i, name in enumerate(["a", "b"]):
+        mean = params["ab_mean"][:, i]
+        sd = np.sqrt(params["ab_cov"][:, i, i])
+        summary[f"{name}_mean"] = mean
+        summary[f"{name}_sd"] = sd
+        summary[f"{name}_lower"] = mean - z * sd
+        summary[f"{name}_upper"] = mean + z * sd
+    summary["ab_corr"] = params["ab_cov"][:, 0, 1] / np.sqrt(
+        params["ab_cov"][:, 0, 0] * params["ab_cov"][:, 1, 1]
+    )
+
+    return summary
+
+
+def global_summary(params, interval=0.95):
+    """Summarises the posterior of the population level parameters, with the
+    precisions converted to standard deviations (sigma_a, sigma_b, sigma)
+
+    :param params: variational parameters returned by fit_hierarchical
+    :type params: dict
+    :param interval: width of the credible intervals, defaults to 0.95
+    :type interval: float, optional
+    :return: posterior mean, standard deviation and credible interval of
+    each population level parameter
+    :rtype: pandas dataframe
+    """
+    lo, hi = 0.5 - interval / 2, 0.5 + interval / 2
+
+    rows = {}
+    for name in ["mu_a", "mu_b"]:
+        mean, precision = params[name][0] / params[name][1], params[name][1]
+        sd = 1 / np.sqrt(precision)
+        rows[name] = [
+            mean,
+            sd,
+            spstat.norm.ppf(lo, mean, sd),
+            spstat.norm.ppf(hi, mean, sd),
+        ]
+
+    for name, sigma_name in [
+        ("tau_a", "sigma_a"),
+        ("tau_b", "sigma_b"),
+        ("tau", "sigma"),
+    ]:
+        shape, rate = params[name]
+        # moments of sigma = tau ** -0.5 under a gamma(shape, rate) posterior
+        mean = np.exp(gammaln(shape - 0.5) - gammaln(shape) + 0.5 * np.log(rate))
+        sd = np.sqrt(max(rate / (shape - 1) - mean**2, 0.0)) if shape > 1 else np.nan
+        rows[sigma_name] = [
+            mean,
+            sd,
+            1 / np.sqrt(spstat.gamma.ppf(hi, shape, scale=1 / rate)),
+            1 / np.sqrt(spstat.gamma.ppf(lo, shape, scale=1 / rate)),
+        ]
+
+    return pd.DataFrame.from_dict(
+        rows, orient="index", columns=["mean", "sd", "lower", "upper"]
+    )
+
+
+def simulate_data(n_highstreets, n_weeks, random_state=0):
+    """Simulates data from the model, e.g. for benchmarking
+
+    :return: highstreet ids, weeks and observations
+    :rtype: (numpy array, numpy array, numpy array)
+    """
+    rng = np.random.default_rng(random_state)
+    a = rng.normal(0.8, 0.2, n_highstreets)
+    b = rng.normal(0.01, 0.005, n_highstreets)
+
+    highstreet_id = np.repeat(np.arange(n_highstreets), n_weeks)
+    weeks = np.tile(np.arange(n_weeks, dtype=float), n_highstreets)
+    obs = a[highstreet_id] + b[highstreet_id] * weeks + rng.normal(0, 0.1, weeks.size)
+
+    return highstreet_id, weeks, obs
+
+
+def benchmark_fit(
+    n_highstreets=(100, 300, 600, 1200, 2400),
+    n_weeks=(26, 52, 104),
+    **fit_kwargs,
+):
+    """Times fit_hierarchical on simulated data of increasing size
+
+    :param n_highstreets: numbers of high streets to time, defaults to
+    (100, 300, 600, 1200, 2400)
+    :type n_highstreets: tuple[int], optional
+    :param n_weeks: numbers of weeks to time, defaults to (26, 52, 104)
+    :type n_weeks: tuple[int], optional
+    :return: fit time, epochs run and time per epoch for each combination
+    :rtype: pandas dataframe
+    """
+    rows = []
+    for n_hs in n_highstreets:
+        for n_wk in n_weeks:
+            data = simulate_data(n_hs, n_wk)
+            t0 = time.perf_counter()
+            params = fit_hierarchical(*data, **fit_kwargs)
+            fit_time = time.perf_counter() - t0
+            rows.append(
+                {
+                    "n_highstreets": n_hs,
+                    "n_weeks": n_wk,
+                    "n_obs": n_hs * n_wk,
+                    "fit_time_s": fit_time,
+                    "epochs": params["epochs"],
+                    "time_per_epoch_s": fit_time / params["epochs"],
+                }
+            )
+
+    return pd.DataFrame(rows)
@@ -0,0 +1,299 @@
+"""
+Scores high streets with a fitted model pipeline (e.g. the best_model returned
+by train_model.run_experiment_w_cv) that has been persisted with dill or saved
+to the model registry (see highstreets.models.registry).
+
+The pipeline is loaded once and cached, and the whole high street feature
+matrix (one row per high street) is scored in a single vectorised call.
+Predictions are binned into quartile labels, as in
+processing_functions.create_labels, and the lowest quartile(s) are flagged
+as at risk. The quartile edges are those of the pipeline's predictions on
+its training data (stored on the pipeline by set_label_edges), so a high
+street's label does not depend on which other high streets are scored with
+it, and a single high street can be scored.
+
+Usage from the command line:
+    - score a feature file:
+        python -m highstreets.models.predict_model model.pkl --features f.csv
+    - score a sequence of weekly updates against a base feature file:
+        python -m highstreets.models.predict_model model.pkl --features f.csv
+            --updates week_1.csv week_2.csv
+    - serve predictions over HTTP (POST a JSON list of records to /score):
+        python -m highstreets.models.predict_model model.pkl --serve 8000
+    - benchmark scoring latency and throughput:
+        python -m highstreets.models.predict_model model.pkl --benchmark
+"""
+import argparse
+import functools
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import dill
+import numpy as np
+import pandas as pd
+
+from highstreets.models import registry
+
+# approximate number of high streets in London, used to size benchmarks
+N_LONDON_HIGHSTREETS = 600
+
+
+@functools.lru_cache(maxsize=8)
+def load_pipeline(model_file):
+    """Loads a fitted pipeline pickled with dill, or a model version folder
+    from the model registry. Loaded pipelines are cached so repeated calls
+    with the same file do not touch the disk again
+
+    :param model_file: path to the pickled pipeline or registry version folder
+    :type model_file: str
+    :return: fitted sklearn estimator or pipeline
+    :rtype: sklearn estimator or registry.LazyModel
+    """
+    if os.path.isdir(model_file):
+        return registry.LazyModel(model_file)
+
+    with open(model_file, "rb") as f:
+        return dill.load(f)
+
+
+def _feature_matrix(pipeline, features):
+    """Orders the feature columns as the pipeline saw them during fitting
+    so the whole matrix can be passed to the pipeline in one call"""
+    feature_names = getattr(pipeline, "feature_names_in_", None)
+    if feature_names is not None:
+        missing = set(feature_names) - set(features.columns)
+        if missing:
+            raise ValueError(f"Features missing from input: {sorted(missing)}")
+        return features[list(feature_names)].astype(float)
+
+    return features.to_numpy(dtype=float)
+
+
+def _predict(pipeline, X):
+    return np.asarray(pipeline.predict(X)).reshape(X.shape[0], -1)[:, 0]
+
+
+def set_label_edges(pipeline, features, n_labels=4):
+    """Stores the quantiles of the pipeline's predictions on its training
+    features as the pipeline's label_edges_, so scores are labelled against
+    the training distribution
+
+    :param pipeline: fitted sklearn estimator or pipeline
+    :type pipeline: sklearn estimator
+    :param features: training feature matrix, one row per high street
+    :type features: pandas dataframe
+    :param n_labels: number of quantile bins, defaults to 4 (quartiles, as
+    in create_labels)
+    :type n_labels: int, optional
+    :return: the pipeline
+    :rtype: sklearn estimator
+    """
+    predictions = _predict(pipeline, _feature_matrix(pipeline, features))
+    pipeline.label_edges_ = np.quantile(
+        predictions, np.linspace(0, 1, n_labels + 1)[1:-1]
+    )
+    return pipeline
+
+
+def score_highstreets(pipeline, features, label_edges=None, at_risk_labels=(0,)):
+    """Scores every high street in one vectorised call to the pipeline
+
+    :param pipeline: fitted sklearn estimator or pipeline
+    :type pipeline: sklearn estimator
+    :param features: feature matrix, one row per high street, indexed by
+    highstreet_id
+    :type features: pandas dataframe
+    :param label_edges: increasing predictions that split the labels (label
+    i is up to and including edge i), defaults to the pipeline's
+    label_edges_ (see set_label_edges)
+    :type label_edges: array-like, optional
+    :param at_risk_labels: labels that count as at risk, defaults to (0,)
+    (the lowest quartile)
+    :type at_risk_labels: tuple, optional
+    :return: dataframe indexed like features with columns 'prediction',
+    'labels' and 'at_risk'
+    :rtype: pandas dataframe
+    """
+    if label_edges is None:
+        label_edges = getattr(pipeline, "label_edges_", None)
+        if label_edges is None:
+            raise ValueError(
+                "The pipeline has no label edges, set them from its training "
+                "data with set_label_edges"
+            )
+    label_edges = np.asarray(label_edges, dtype=float)
+
+    X = _feature_matrix(pipeline, features)
+    predictions = _predict(pipeline, X)
+
+    scores = pd.DataFrame({"prediction": predictions}, index=features.index)
+    scores["labels"] = pd.Categorical(
+        np.searchsorted(label_edges, predictions),
+        categories=range(len(label_edges) + 1),
+    )
+    scores["at_risk"] = scores["labels"].isin(at_risk_labels)
+
+    return scores
+
+
+def update_features(features, update):
+    """Applies a weekly update to the feature matrix. Rows in update replace
+    the matching high streets' values, missing values in update leave the
+    existing values in place and new high streets are appended
+
+    :param features: current feature matrix, indexed by highstreet_id
+    :type features: pandas dataframe
+    :param update: new feature values, indexed by highstreet_id
+    :type update: pandas dataframe
+    :return: updated copy of the feature matrix
+    :rtype: pandas dataframe
+    """
+    return update.combine_first(features)[features.columns]
+
+
+def score_stream(pipeline, features, updates, **kwargs):
+    """Scores a stream of weekly updates, yielding the scores for the full
+    feature matrix after each update is applied
+
+    :param pipeline: fitted sklearn estimator or pipeline
+    :type pipeline: sklearn estimator
+    :param features: feature matrix before the first update, indexed by
+    highstreet_id
+    :type features: pandas dataframe
+    :param updates: iterable of weekly feature updates, indexed by
+    highstreet_id
+    :type updates: iterable of pandas dataframes
+    :yield: updated feature matrix and its scores
+    :rtype: (pandas dataframe, pandas dataframe)
+    """
+    for update in updates:
+        features = update_features(features, update)
+        yield features, score_highstreets(pipeline, features, **kwargs)
+
+
+def benchmark_scoring(
+    pipeline,
+    n_highstreets=N_LONDON_HIGHSTREETS,
+    n_features=None,
+    repeats=50,
+    random_state=0,
+):
+    """Measures the latency and throughput of scoring all high streets
+
+    :param pipeline: fitted sklearn estimator or pipeline
+    :type pipeline: sklearn estimator
+    :param n_highstreets: number of high streets scored per call, defaults
+    to N_LONDON_HIGHSTREETS
+    :type n_highstreets: int, optional
+    :param n_features: number of features, defaults to the number the
+    pipeline was fitted with
+    :type n_features: int, optional
+    :param repeats: number of timed calls, defaults to 50
+    :type repeats: int, optional
+    :param random_state: seed for the synthetic features, defaults to 0
+    :type random_state: int, optional
+    :return: latency statistics in milliseconds and throughput in high
+    streets per second
+    :rtype: dict
+    """
+    feature_names = getattr(pipeline, "feature_names_in_", None)
+    if n_features is None:
+        n_features = (
+            len(feature_names) if feature_names is not None else pipeline.n_features_in_
+        )
+    rng = np.random.default_rng(random_state)
+    features = pd.DataFrame(
+        rng.normal(size=(n_highstreets, n_features)),
+        columns=feature_names,
+    )
+
+    # warm up, so one-off costs don't count towards latency
+    score_highstreets(pipeline, features)
+
+    timings = np.empty(repeats)
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        score_highstreets(pipeline, features)
+        timings[i] = time.perf_counter() - t0
+
+    return {
+        "n_highstreets": n_highstreets,
+        "latency_mean_ms": 1e3 * timings.mean(),
+        "latency_p95_ms": 1e3 * np.percentile(timings, 95),
+        "throughput_hs_per_s": n_highstreets / timings.mean(),
+    }
+
+
+def _read_features(file, index_col="highstreet_id"):
+    return pd.read_csv(file, index_col=index_col)
+
+
+def _make_handler(pipeline):
+    class ScoreHandler(BaseHTTPRequestHandler):
+        """Scores JSON records POSTed to /score with the warm pipeline"""
+
+        def do_POST(self):
+            if self.path != "/score":
+                self.send_error(404)
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                records = json.loads(self.rfile.read(length))
+                features = pd.DataFrame.from_records(records).set_index("highstreet_id")
+                scores = score_highstreets(pipeline, features)
+            except (ValueError, KeyError) as e:
+                self.send_error(400, str(e))
+                return
+
+            body = scores.reset_index().to_json(orient="records").encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ScoreHandler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score high streets")
+    parser.add_argument("model_file", help="pickled pipeline or registry folder")
+    parser.add_argument("--features", help="csv of features by highstreet_id")
+    parser.add_argument("--updates", nargs="*", default=[], help="weekly updates")
+    parser.add_argument("--output", help="csv file to write scores to")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="serve on PORT")
+    parser.add_argument("--benchmark", action="store_true")
+    args = parser.parse_args(argv)
+
+    pipeline = load_pipeline(args.model_file)
+
+    if args.benchmark:
+        print(benchmark_scoring(pipeline))
+
+    if args.serve is not None:
+        server = HTTPServer(("127.0.0.1", args.serve), _make_handler(pipeline))
+        print(f"Serving predictions on http://127.0.0.1:{args.serve}/score")
+        server.serve_forever()
+
+    if args.features is not None:
+        features = _read_features(args.features)
+        if args.updates:
+            updates = (_read_features(f) for f in args.updates)
+            for file, (features, scores) in zip(
+                args.updates, score_stream(pipeline, features, updates)
+            ):
+                print(f"{file}: {scores['at_risk'].sum()} high streets at risk")
+        else:
+            scores = score_highstreets(pipeline, features)
+
+        if args.output is not None:
+            scores.to_csv(args.output)
+        else:
+            print(scores)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+A file based registry for fitted models and pipelines.
+
+Each saved model gets its own versioned folder in the registry:
+    <registry_dir>/<name>/<version>/
+        - metadata.json: features, params, metrics, data hash, label edges
+            (see predict_model.set_label_edges) and file list
+        - model.joblib: the fitted pipeline, dumped uncompressed so that its
+            numpy arrays can be memory-mapped when loading
+        - <step>.json: any xgboost estimators, saved in xgboost's native
+            format rather than pickled
+
+Loading is lazy: load_model reads only the small metadata file and returns a
+LazyModel, which maps the model files the first time the model is used. A
+scoring process can therefore open the registry instantly and only pay for
+the models it actually calls.
+
+The registry directory defaults to MODEL_REGISTRY_DIR from the .env file.
+"""
+import copy
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import joblib
+import pandas as pd
+
+from highstreets import config
+
+MODEL_FILE = "model.joblib"
+METADATA_FILE = "metadata.json"
+
+
+def _registry_dir(registry_dir):
+    registry_dir = registry_dir or config.MODEL_REGISTRY_DIR
+    if registry_dir is None:
+        raise ValueError("No registry_dir given and MODEL_REGISTRY_DIR is not set")
+    return registry_dir
+
+
+def _is_xgboost(estimator):
+    # checked by module name so xgboost is only needed if it is used
+    return type(estimator).__module__.startswith("xgboost")
+
+
+def data_hash(*data):
+    """Hashes the contents of the dataframes or series a model was fitted on,
+    so a saved model can be matched to the data that produced it
+
+    :param data: dataframes or series (e.g. X_train, y_train)
+    :type data: pandas dataframe or series
+    :return: sha256 hex digest
+    :rtype: str
+    """
+    h = hashlib.sha256()
+    for d in data:
+        if isinstance(d, pd.DataFrame):
+            h.update(",".join(map(str, d.columns)).encode())
+        h.update(pd.util.hash_pandas_object(d, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _next_version(model_dir):
+    versions = [
+        int(v[1:])
+        for v in os.listdir(model_dir)
+        if v.startswith("v") and v[1:].isdigit()
+    ]
+    return f"v{max(versions, default=0) + 1:04d}"
+
+
+def save_model(
+    model,
+    name,
+    features=None,
+    params=None,
+    metrics=None,
+    data=None,
+    registry_dir=None,
+):
+    """Saves a fitted model or pipeline as a new version in the registry
+
+    :param model: fitted estimator or pipeline, e.g. the best_model returned
+    by run_experiment_w_cv
+    :type model: sklearn estimator
+    :param name: name the model is registered under
+    :type name: str
+    :param features: names of the features the model expects, defaults to
+    the model's feature_names_in_ if it has them
+    :type features: list[str], optional
+    :param params: model parameters, defaults to model.get_params()
+    :type params: dict, optional
+    :param metrics: evaluation metrics, e.g. as returned by
+    train_model.evaluate
+    :type metrics: dict, optional
+    :param data: dataframes the model was fitted on, used to compute a hash
+    of the training data
+    :type data: tuple of pandas dataframes, optional
+    :param registry_dir: registry folder, defaults to MODEL_REGISTRY_DIR
+    :type registry_dir: str, optional
+    :return: version the model was saved as
+    :rtype: str
+    """
+    from sklearn.pipeline import Pipeline
+
+    model_dir = os.path.join(_registry_dir(registry_dir), name)
+    os.makedirs(model_dir, exist_ok=True)
+    version = _next_version(model_dir)
+    version_dir = os.path.join(model_dir, version)
+    os.makedirs(version_dir)
+
+    if features is None and hasattr(model, "feature_names_in_"):
+        features = list(model.feature_names_in_)
+    if params is None:
+        params = model.get_params(deep=False)
+    label_edges = getattr(model, "label_edges_", None)
+
+    # save xgboost estimators in their native format and pickle the rest
+    xgboost_files = {}
+    if isinstance(model, Pipeline):
+        to_pickle = copy.copy(model)
+        to_pickle.steps = list(model.steps)
+        for i, (step, estimator) in enumerate(model.steps):
+            if _is_xgboost(estimator):
+                xgboost_files[step] = _save_xgboost(estimator, version_dir, step)
+                to_pickle.steps[i] = (step, "passthrough")
+    elif _is_xgboost(model):
+        xgboost_files[None] = _save_xgboost(model, version_dir, "model")
+        to_pickle = None
+    else:
+        to_pickle = model
+
+    files = list(xgboost_files.values())
+    if to_pickle is not None:
+        joblib.dump(to_pickle, os.path.join(version_dir, MODEL_FILE))
+        files.append(MODEL_FILE)
+
+    metadata = {
+        "name": name,
+        "version": version,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "model_class": type(model).__name__,
+        "features": features,
+        "params": params,
+        "metrics": metrics,
+        "data_hash": data_hash(*data) if data is not None else None,
+        "label_edges": None if label_edges is None else list(map(float, label_edges)),
+        "xgboost_steps": {str(k): v for k, v in xgboost_files.items()},
+        "files": files,
+    }
+    with open(os.path.join(version_dir, METADATA_FILE), "w") as f:
+        json.dump(metadata, f, indent=2, default=str)
+
+    return version
+
+
+def _save_xgboost(estimator, version_dir, step):
+    file = f"{step}.json"
+    estimator.save_model(os.path.join(version_dir, file))
+    return {"file": file, "class": type(estimator).__name__}
+
+
+def _load_xgboost(version_dir, xgb_info):
+    import xgboost
+
+    estimator = getattr(xgboost, xgb_info["class"])()
+    estimator.load_model(os.path.join(version_dir, xgb_info["file"]))
+    return estimator
+
+
+class LazyModel:
+    """A registered model whose files are only loaded when it is first used.
+
+    Attribute access (predict, feature_names_in_, ...) is passed through to
+    the underlying model, so a LazyModel can be used wherever the fitted
+    pipeline would be.
+    """
+
+    def __init__(self, version_dir, mmap_mode="r"):
+        self.version_dir = version_dir
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(version_dir, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+        self._model = None
+
+    @property
+    def label_edges_(self):
+        """Label edges of the model, from the metadata so they survive models
+        saved in xgboost's format"""
+        edges = self.metadata.get("label_edges")
+        if edges is None:
+            return getattr(self.load(), "label_edges_", None)
+        return edges
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def load(self):
+        """Loads (once) and returns the underlying model"""
+        if self._model is None:
+            xgboost_steps = self.metadata["xgboost_steps"]
+            if "None" in xgboost_steps:
+                model = _load_xgboost(self.version_dir, xgboost_steps["None"])
+            else:
+                model = joblib.load(
+                    os.path.join(self.version_dir, MODEL_FILE),
+                    mmap_mode=self.mmap_mode,
+                )
+                for i, (step, _) in enumerate(model.steps if xgboost_steps else []):
+                    if step in xgboost_steps:
+                        model.steps[i] = (
+                            step,
+                            _load_xgboost(self.version_dir, xgboost_steps[step]),
+                        )
+            self._model = model
+        return self._model
+
+    def __getattr__(self, attr):
+        # only called for attributes not found on the LazyModel itself
+        if attr.startswith("__") or attr in ("_model", "metadata"):
+            raise AttributeError(attr)
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return (
+            f"LazyModel({self.metadata['name']!r}, {self.metadata['version']!r},"
+            f" loaded={self.loaded})"
+        )
+
+
+def load_model(name, version=None, registry_dir=None, mmap_mode="r"):
+    """Opens a registered model without loading it
+
+    :param name: name the model was registered under
+    :type name: str
+    :param version: version to open, defaults to the latest
+    :type version: str, optional
+    :param registry_dir: registry folder, defaults to MODEL_REGISTRY_DIR
+    :type registry_dir: str, optional
+    :param mmap_mode: joblib memory-map mode for the model's arrays, defaults
+    to 'r' (read only); None reads the arrays into memory
+    :type mmap_mode: str, optional
+    :return: lazily loaded model
+    :rtype: LazyModel
+    """
+    model_dir = os.path.join(_registry_dir(registry_dir), name)
+    if version is None:
+        versions = sorted(v for v in os.listdir(model_dir) if v.startswith("v"))
+        if not versions:
+            raise FileNotFoundError(f"No saved versions of {name} in {model_dir}")
+        version = versions[-1]
+
+    return LazyModel(os.path.join(model_dir, version), mmap_mode=mmap_mode)
+
+
+def list_models(registry_dir=None):
+    """Lists every version of every model in the registry
+
+    :param registry_dir: registry folder, defaults to MODEL_REGISTRY_DIR
+    :type registry_dir: str, optional
+    :return: one row of metadata per saved model version
+    :rtype: pandas dataframe
+    """
+    registry_dir = _registry_dir(registry_dir)
+
+    rows = []
+    for name in sorted(os.listdir(registry_dir)):
+        model_dir = os.path.join(registry_dir, name)
+        if not os.path.isdir(model_dir):
+            continue
+        for version in sorted(os.listdir(model_dir)):
+            metadata_file = os.path.join(model_dir, version, METADATA_FILE)
+            if os.path.isfile(metadata_file):
+                with open(metadata_file) as f:
+                    rows.append(json.load(f))
+
+    return pd.DataFrame(rows)
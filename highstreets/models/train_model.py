@@ -1,13 +1,26 @@
+import time
+from itertools import product
+
 import numpy as np
-import seaborn as sns
-from matplotlib import pyplot as plt
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
 from sklearn.inspection import permutation_importance
-from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
-from sklearn.model_selection import GridSearchCV
+from sklearn.metrics import (
+    get_scorer,
+    mean_absolute_error,
+    mean_squared_error,
+    r2_score,
+)
+from sklearn.model_selection import GridSearchCV, KFold, ParameterGrid
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
 
+from highstreets import instrumentation as instr
+from highstreets.models import predict_model
+
 
+@instr.instrument()
 def run_experiment(model, X_train, X_test, y_train, y_test):
     model.fit(X_train, y_train)
     y_pred = model.predict(X_test)
@@ -30,6 +43,7 @@ def evaluate(model, X, y, rvsc="r"):
         }
 
 
+@instr.instrument()
 def run_experiment_w_cv(
     model,
     tuned_params,
@@ -40,6 +54,8 @@ def run_experiment_w_cv(
     scoring="r2",
     verbose=0,
 ):
+    import seaborn as sns
+    from matplotlib import pyplot as plt
 
     model = Pipeline(
         [
@@ -53,6 +69,7 @@ def run_experiment_w_cv(
     results_pred = run_experiment(model_cv, X_train, X_test, y_train, y_test)
 
     best_model = results_pred["model"].best_estimator_
+    predict_model.set_label_edges(best_model, X_train)
 
     fig, axes = plt.subplots(2, 1, figsize=(15, 10))
 
@@ -98,3 +115,157 @@ def run_experiment_w_cv(
     print("Best score: ", results_pred["R2"])
 
     return best_model, fig
+
+
+def make_shared_folds(X, n_splits=5, shuffle=True, random_state=0):
+    """Splits X into cross-validation folds and fits one scaler per fold,
+    so that the folds and scaling can be shared by every target and model
+    in an experiment sweep
+
+    :param X: feature matrix, one row per high street
+    :type X: pandas dataframe or numpy array
+    :param n_splits: number of cross-validation folds, defaults to 5
+    :type n_splits: int, optional
+    :param shuffle: whether to shuffle rows before splitting, defaults to True
+    :type shuffle: bool, optional
+    :param random_state: seed used when shuffling, defaults to 0
+    :type random_state: int, optional
+    :return: one dict per fold holding the train/validation row indices,
+    the scaler fitted on the training rows and the scaled feature arrays
+    :rtype: list[dict]
+    """
+    X = np.asarray(X, dtype=float)
+    kf = KFold(
+        n_splits=n_splits,
+        shuffle=shuffle,
+        random_state=random_state if shuffle else None,
+    )
+
+    folds = []
+    for train_idx, val_idx in kf.split(X):
+        scaler = StandardScaler().fit(X[train_idx])
+        folds.append(
+            {
+                "train_idx": train_idx,
+                "val_idx": val_idx,
+                "scaler": scaler,
+                "X_train": scaler.transform(X[train_idx]),
+                "X_val": scaler.transform(X[val_idx]),
+            }
+        )
+
+    return folds
+
+
+def _run_job(model, params, folds, y, scoring):
+    """Fits one (model, params) combination on every shared fold of a
+    single target and returns the validation scores and timings"""
+    scorer = get_scorer(scoring)
+
+    scores = []
+    fit_time = 0.0
+    score_time = 0.0
+    for fold in folds:
+        estimator = clone(model).set_params(**params)
+
+        t0 = time.perf_counter()
+        estimator.fit(fold["X_train"], y[fold["train_idx"]])
+        t1 = time.perf_counter()
+        scores.append(scorer(estimator, fold["X_val"], y[fold["val_idx"]]))
+        t2 = time.perf_counter()
+
+        fit_time += t1 - t0
+        score_time += t2 - t1
+
+    return {
+        "mean_score": np.mean(scores),
+        "std_score": np.std(scores),
+        "fit_time": fit_time,
+        "score_time": score_time,
+    }
+
+
+@instr.instrument()
+def run_multi_target_experiments(
+    models,
+    X,
+    y,
+    n_splits=5,
+    scoring="r2",
+    n_jobs=-1,
+    shuffle=True,
+    random_state=0,
+    results_file=None,
+    verbose=0,
+):
+    """Runs every (target x model x params) combination against one shared
+    set of cross-validation folds and fitted scalers, distributing the jobs
+    over a pool of workers
+
+    :param models: mapping from a model name to a tuple of (estimator,
+    parameter grid), where the parameter grid is in the format accepted by
+    GridSearchCV but without the 'model__' prefix
+    :type models: dict[str, (estimator, dict or list[dict])]
+    :param X: feature matrix, one row per high street
+    :type X: pandas dataframe
+    :param y: regression targets, one column per target (e.g. 'mean 2020',
+    'slope 2020', 'hit percent 2021' from append_profile_features)
+    :type y: pandas dataframe
+    :param n_splits: number of cross-validation folds, defaults to 5
+    :type n_splits: int, optional
+    :param scoring: sklearn scoring name, defaults to 'r2'
+    :type scoring: str, optional
+    :param n_jobs: number of workers, defaults to -1 (all cores)
+    :type n_jobs: int, optional
+    :param shuffle: whether to shuffle rows before splitting, defaults to True
+    (False gives the folds of GridSearchCV's default cv)
+    :type shuffle: bool, optional
+    :param random_state: seed used to shuffle the folds, defaults to 0
+    :type random_state: int, optional
+    :param results_file: path of a csv file the results table is written to,
+    defaults to None (not written)
+    :type results_file: str, optional
+    :param verbose: verbosity passed to the worker pool, defaults to 0
+    :type verbose: int, optional
+    :return: one row per job with its cross-validated score, timings and
+    whether it was the best job for its target
+    :rtype: pandas dataframe
+    """
+    if isinstance(y, pd.Series):
+        y = y.to_frame()
+
+    folds = make_shared_folds(
+        X, n_splits=n_splits, shuffle=shuffle, random_state=random_state
+    )
+
+    jobs = [
+        (target, model_name, params)
+        for target, (model_name, (_, grid)) in product(y.columns, models.items())
+        for params in ParameterGrid(grid)
+    ]
+
+    results = Parallel(n_jobs=n_jobs, verbose=verbose)(
+        delayed(_run_job)(
+            models[model_name][0],
+            params,
+            folds,
+            y[target].to_numpy(dtype=float),
+            scoring,
+        )
+        for target, model_name, params in jobs
+    )
+
+    results = pd.DataFrame(
+        [
+            {"target": target, "model": model_name, "params": params, **res}
+            for (target, model_name, params), res in zip(jobs, results)
+        ]
+    )
+    results["best"] = results["mean_score"] == results.groupby("target")[
+        "mean_score"
+    ].transform("max")
+
+    if results_file is not None:
+        results.to_csv(results_file, index=False)
+
+    return results
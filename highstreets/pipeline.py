@@ -0,0 +1,772 @@
+"""
+Runs the path from raw data to features, models and figures as a pipeline of
+stages, re-running only the stages whose inputs, parameters or code have
+changed.
+
+Each stage is a function with declared inputs and outputs (files or
+folders) and parameters. It is called with its inputs, outputs and
+parameters as keyword arguments and must write every output. A stage depends
+on the stages that write its inputs, and the stages run in dependency order,
+independent stages in parallel in a pool of worker threads.
+
+A stage's key is a hash of its name, code, parameters and the contents of
+its inputs. Its code is the source of the stage function, of the functions
+of the package it calls through globals and of every module of the package
+it imports, following their imports in turn, so editing a library function
+a stage uses (e.g. make_dataset.stack_retail_we_wd) re-runs the stage.
+
+After a stage runs its key and the hashes of its outputs are recorded in a
+state file; on the next run it is skipped if its key is unchanged and its
+outputs are still as it left them. Because the key hashes contents rather
+than timestamps, a stage that re-runs but writes the same output does not
+invalidate the stages after it. File hashes are cached by
+size and modification time, so unchanged files are not re-read.
+
+default_pipeline declares the usual stages, from the Mastercard YOY file
+(YOY_FILE), the profile file (PROFILE_FILE), the O2 clusters (O2_CLUSTERS)
+and the BT deliveries (BT_DIR):
+    - spend_long: stack_retail_we_wd of the YOY file
+    - recovery_series: extract_data_array of the 2020, 2021 and full windows
+    - fit_lines: get_fit_lines of each window
+    - groups_2020: group_highstreets by 2020 mean and slope
+    - profile_features: append_profile_features and clean_hs_profiles
+    - model: a ridge regression of a recovery target on the profile features
+    - figures: plot_highstreets_grouped of 2020 and 2021
+    - bt_weekly: high street x week BT aggregates (bt_out_of_core)
+Stages whose settings are not set are left out.
+
+Usage:
+    python -m highstreets.pipeline --work-dir data/interim
+    python -m highstreets.pipeline --targets figures --workers 4
+    python -m highstreets.pipeline --status
+"""
+import argparse
+import ast
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import textwrap
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from highstreets import config
+from highstreets import instrumentation as instr
+
+Stage = namedtuple("Stage", ["name", "func", "inputs", "outputs", "params"])
+
+STATE_FILE = ".pipeline_state.json"
+
+# packages whose code is part of a stage's key
+CODE_PACKAGES = ("highstreets",)
+
+
+def _digest_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class _HashCache:
+    """Content hashes of files and folders, re-read only when a file's size
+    or modification time changes"""
+
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {})
+
+    def file(self, path):
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+        digest = _digest_file(path)
+        self.entries[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def path(self, path):
+        """Hash of a file, or of the names and contents of a folder's files,
+        None if it does not exist"""
+        if os.path.isfile(path):
+            return self.file(path)
+        if not os.path.isdir(path):
+            return None
+        h = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file = os.path.join(root, name)
+                h.update(os.path.relpath(file, path).encode())
+                h.update(self.file(file).encode())
+        return h.hexdigest()
+
+
+def _in_code_packages(name):
+    return any(name == p or name.startswith(p + ".") for p in CODE_PACKAGES)
+
+
+def _imported_modules(tree, package=None):
+    """Names of the modules of CODE_PACKAGES imported in a syntax tree"""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                base = importlib.util.resolve_name("." * node.level + base, package)
+            # imported names may be modules of the package or its attributes
+            names = [base] + [f"{base}.{alias.name}" for alias in node.names]
+        else:
+            continue
+        yield from (name for name in names if _in_code_packages(name))
+
+
+def _module_sources(name, sources):
+    """Adds the source of a module, and of the modules of CODE_PACKAGES it
+    imports, to sources"""
+    if name in sources:
+        return
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        # an attribute imported from a module rather than a module
+        spec = None
+    if spec is None or spec.origin is None or not spec.origin.endswith(".py"):
+        return
+    with open(spec.origin, encoding="utf-8") as f:
+        sources[name] = f.read()
+    for module in _imported_modules(ast.parse(sources[name]), spec.parent):
+        _module_sources(module, sources)
+
+
+def _global_names(code):
+    """Global names used by a code object and the code nested in it"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _global_names(const)
+    return names
+
+
+def _function_sources(func, sources):
+    """Adds the source of a function, and of the functions and modules of
+    CODE_PACKAGES it uses, to sources"""
+    name = f"{func.__module__}.{func.__qualname__}"
+    if name in sources:
+        return
+    try:
+        sources[name] = inspect.getsource(func)
+    except (OSError, TypeError):
+        sources[name] = name
+        return
+
+    package = func.__module__.rpartition(".")[0] or None
+    tree = ast.parse(textwrap.dedent(sources[name]))
+    for module in _imported_modules(tree, package):
+        _module_sources(module, sources)
+
+    for global_name in _global_names(func.__code__):
+        value = func.__globals__.get(global_name)
+        if inspect.ismodule(value) and _in_code_packages(value.__name__):
+            _module_sources(value.__name__, sources)
+        elif inspect.isfunction(value) and (
+            value.__module__ == func.__module__ or _in_code_packages(value.__module__)
+        ):
+            _function_sources(value, sources)
+
+
+def _code_sources(func):
+    """The source of a function and of the code of CODE_PACKAGES it uses,
+    by module or function name"""
+    sources = {}
+    _function_sources(func, sources)
+    return sources
+
+
+def _code_hash(func):
+    """Hash of the source of a function and of the code it uses (see
+    _code_sources), or of its name if the source is not available"""
+    h = hashlib.sha256()
+    for name, source in sorted(_code_sources(func).items()):
+        h.update(name.encode())
+        h.update(source.encode())
+    return h.hexdigest()
+
+
+class Pipeline:
+    """Stages with declared inputs and outputs, run in dependency order
+
+    :param state_file: JSON file recording the key and output hashes of
+    each stage that has run
+    :type state_file: str
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.stages = {}
+
+    def add(self, name, func, inputs=None, outputs=None, params=None):
+        """Adds a stage
+
+        :param name: stage name
+        :type name: str
+        :param func: called as func(**inputs, **outputs, **params), must
+        write every output
+        :type func: callable
+        :param inputs: argument name and path of each input file or folder,
+        defaults to None
+        :type inputs: dict, optional
+        :param outputs: argument name and path of each output file or folder,
+        defaults to None
+        :type outputs: dict, optional
+        :param params: other arguments, JSON serialisable, defaults to None
+        :type params: dict, optional
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage {name!r} is already in the pipeline")
+        written = {
+            os.path.abspath(path): stage.name
+            for stage in self.stages.values()
+            for path in stage.outputs.values()
+        }
+        for path in (outputs or {}).values():
+            if os.path.abspath(path) in written:
+                raise ValueError(
+                    f"{path} is already written by stage "
+                    f"{written[os.path.abspath(path)]!r}"
+                )
+        self.stages[name] = Stage(
+            name, func, dict(inputs or {}), dict(outputs or {}), dict(params or {})
+        )
+
+    def dependencies(self):
+        """The stages each stage reads the outputs of
+
+        :rtype: dict[str, set[str]]
+        """
+        writers = {
+            os.path.abspath(path): stage.name
+            for stage in self.stages.values()
+            for path in stage.outputs.values()
+        }
+        return {
+            stage.name: {
+                writers[os.path.abspath(path)]
+                for path in stage.inputs.values()
+                if os.path.abspath(path) in writers
+            }
+            for stage in self.stages.values()
+        }
+
+    def order(self, targets=None):
+        """Stages in dependency order, only those needed for targets if
+        given
+
+        :param targets: stages to run, defaults to None (all)
+        :type targets: list[str], optional
+        :rtype: list[str]
+        """
+        dependencies = self.dependencies()
+        needed = set(self.stages) if targets is None else set()
+        pending = list(targets or [])
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise KeyError(f"No stage {name!r} in the pipeline")
+            if name not in needed:
+                needed.add(name)
+                pending.extend(dependencies[name])
+
+        order, done = [], set()
+        while len(order) < len(needed):
+            ready = [
+                name
+                for name in self.stages
+                if name in needed and name not in done and dependencies[name] <= done
+            ]
+            if not ready:
+                raise ValueError(f"Stages {sorted(needed - done)} depend on each other")
+            order.extend(ready)
+            done.update(ready)
+        return order
+
+    def _load_state(self):
+        if not os.path.exists(self.state_file):
+            return {"stages": {}, "hashes": {}}
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def _save_state(self, state, hashes):
+        state["hashes"] = hashes.entries
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp_file, self.state_file)
+
+    def _key(self, stage, hashes):
+        """Hash of a stage's name, code, parameters and input contents"""
+        missing = [path for path in stage.inputs.values() if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(
+                f"Inputs of stage {stage.name!r} do not exist: {missing}"
+            )
+        key = {
+            "name": stage.name,
+            "code": _code_hash(stage.func),
+            "params": stage.params,
+            "inputs": {arg: hashes.path(path) for arg, path in stage.inputs.items()},
+        }
+        return hashlib.sha256(
+            json.dumps(key, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def _is_valid(self, stage, key, state, hashes):
+        """Whether a stage's recorded run is for key and its outputs are
+        unchanged since"""
+        recorded = state["stages"].get(stage.name)
+        if recorded is None or recorded["key"] != key:
+            return False
+        return all(
+            hashes.path(path) == recorded["outputs"].get(arg)
+            for arg, path in stage.outputs.items()
+        )
+
+    def status(self, targets=None):
+        """Whether each stage would be skipped, without running anything.
+        Stages after one that would run are reported as 'stale', as their
+        inputs may change
+
+        :param targets: stages to check, defaults to None (all)
+        :type targets: list[str], optional
+        :return: one row per stage with its status: 'valid', 'stale' or
+        'missing inputs'
+        :rtype: pandas dataframe
+        """
+        state = self._load_state()
+        hashes = _HashCache(state["hashes"])
+        dependencies = self.dependencies()
+        statuses = {}
+        for name in self.order(targets):
+            stage = self.stages[name]
+            if any(statuses[d] != "valid" for d in dependencies[name]):
+                statuses[name] = "stale"
+                continue
+            try:
+                key = self._key(stage, hashes)
+            except FileNotFoundError:
+                statuses[name] = "missing inputs"
+                continue
+            valid = self._is_valid(stage, key, state, hashes)
+            statuses[name] = "valid" if valid else "stale"
+        return pd.DataFrame(
+            {"stage": list(statuses), "status": list(statuses.values())}
+        )
+
+    def _run_stage(self, stage):
+        for path in stage.outputs.values():
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        t0 = time.perf_counter()
+        with instr.stage(f"pipeline.{stage.name}"):
+            stage.func(**stage.inputs, **stage.outputs, **stage.params)
+        return time.perf_counter() - t0
+
+    def _record(self, stage, key, state, hashes):
+        """Records a stage's key and output hashes after it has run"""
+        missing = [path for path in stage.outputs.values() if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(
+                f"Stage {stage.name!r} did not write its outputs: {missing}"
+            )
+        state["stages"][stage.name] = {
+            "key": key,
+            "outputs": {arg: hashes.path(path) for arg, path in stage.outputs.items()},
+        }
+        self._save_state(state, hashes)
+
+    def run(self, targets=None, force=False, max_workers=None, verbose=True):
+        """Runs the stages whose outputs are not valid, in dependency order,
+        independent stages in parallel. If a stage fails, the stages already
+        running finish (and are recorded) and the error is raised
+
+        :param targets: stages to bring up to date, with the stages they
+        depend on, defaults to None (all)
+        :type targets: list[str], optional
+        :param force: run every stage, defaults to False
+        :type force: bool, optional
+        :param max_workers: number of stages run at once, defaults to None
+        (ThreadPoolExecutor's default)
+        :type max_workers: int, optional
+        :param verbose: print each stage as it finishes, defaults to True
+        :type verbose: bool, optional
+        :return: one row per stage with whether it ran or was skipped
+        ('cached') and the seconds it took
+        :rtype: pandas dataframe
+        """
+        order = self.order(targets)
+        dependencies = self.dependencies()
+        state = self._load_state()
+        hashes = _HashCache(state["hashes"])
+        keys, results, running = {}, {}, {}
+
+        def finish(name, status, seconds):
+            results[name] = {"stage": name, "status": status, "seconds": seconds}
+            if verbose:
+                print(f"{name}: {status}" + (f" in {seconds:.2f} s" if seconds else ""))
+
+        def next_stage():
+            """The first stage whose dependencies are done, not yet started"""
+            for name in order:
+                if (
+                    name not in results
+                    and name not in running.values()
+                    and dependencies[name] <= results.keys()
+                ):
+                    return name
+            return None
+
+        error = None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                # start every ready stage, skipping those that are valid
+                while error is None and (name := next_stage()) is not None:
+                    stage = self.stages[name]
+                    try:
+                        keys[name] = self._key(stage, hashes)
+                    except FileNotFoundError as e:
+                        error = e
+                    else:
+                        if not force and self._is_valid(
+                            stage, keys[name], state, hashes
+                        ):
+                            finish(name, "cached", 0.0)
+                        else:
+                            running[executor.submit(self._run_stage, stage)] = name
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        seconds = future.result()
+                        self._record(self.stages[name], keys[name], state, hashes)
+                    except Exception as e:  # raised once the pool is done
+                        error = error or e
+                    else:
+                        finish(name, "ran", seconds)
+
+        self._save_state(state, hashes)
+        if error is not None:
+            raise error
+        return pd.DataFrame([results[name] for name in order if name in results])
+
+
+# ================ default stages ==============================================
+def _spend_long(yoy_file, long_file):
+    from highstreets.data import make_dataset
+
+    hsd_yoy = pd.read_csv(yoy_file, parse_dates=["week_start"])
+    make_dataset.stack_retail_we_wd(hsd_yoy, "yoy_").dropna(
+        how="any", axis="rows"
+    ).to_pickle(long_file)
+
+
+def _recovery_series(long_file, series_file, windows):
+    from highstreets.data import make_dataset
+
+    hsd_long = pd.read_pickle(long_file)
+    pd.to_pickle(
+        {
+            name: make_dataset.extract_data_array(hsd_long, dates, "txn_amt")
+            for name, (dates, _) in windows.items()
+        },
+        series_file,
+    )
+
+
+def _fit_lines(series_file, fit_file, windows):
+    import joblib
+
+    from highstreets.features import build_features
+
+    series = pd.read_pickle(series_file)
+    fits = {}
+    for name, (_, start_date) in windows.items():
+        data = series[name]
+        fits[name] = build_features.get_fit_lines(
+            start_date, data.index, data.to_numpy().T
+        )
+    joblib.dump(fits, fit_file)
+
+
+def _recovery_stats(series, fits, window):
+    data = series[window]
+    means = data.mean().to_numpy()[:, None]
+    slopes = fits[window][0].coef_.reshape(-1, 1)
+    return data, means, slopes
+
+
+def _groups(series_file, fit_file, groups_file, window, n_grp):
+    import joblib
+
+    from highstreets.features import build_features
+
+    data, means, slopes = _recovery_stats(
+        pd.read_pickle(series_file), joblib.load(fit_file), window
+    )
+    build_features.group_highstreets(data, (means, slopes), n_grp).to_csv(
+        groups_file, index=False
+    )
+
+
+def _profile_features(
+    series_file, fit_file, profile_file, yoy_file, clusters_file, features_file
+):
+    import joblib
+
+    from highstreets.features import build_features
+
+    series = pd.read_pickle(series_file)
+    reg_model = {name: reg for name, (reg, _) in joblib.load(fit_file).items()}
+    if profile_file.endswith(".csv"):
+        hsp = pd.read_csv(profile_file)
+    else:
+        hsp = pd.read_excel(profile_file)
+
+    # append_profile_features reads the YOY file from the settings, which is
+    # the yoy_file input of this stage
+    stats = build_features.append_profile_features(
+        hsp, series["full"], reg_model, pd.read_csv(clusters_file)
+    )
+    build_features.clean_hs_profiles(stats).to_pickle(features_file)
+
+
+def _model(features_file, model_file, target, alpha, random_state):
+    import joblib
+    from sklearn.linear_model import Ridge
+    from sklearn.model_selection import train_test_split
+    from sklearn.pipeline import Pipeline as SkPipeline
+    from sklearn.preprocessing import StandardScaler
+
+    from highstreets.models import train_model
+
+    stats = pd.read_pickle(features_file).select_dtypes("number").dropna()
+    # the other recovery measures are outcomes too, not features
+    outcomes = stats.filter(regex="^(mean|slope|hit percent) 20").columns
+    X, y = stats.drop(columns=outcomes), stats[target]
+    results = train_model.run_experiment(
+        SkPipeline([("scaler", StandardScaler()), ("model", Ridge(alpha=alpha))]),
+        *train_test_split(X, y, random_state=random_state),
+    )
+    joblib.dump(results, model_file)
+
+
+def _figures(series_file, fit_file, figure_2020, figure_2021, nb_dates, n_grp):
+    import joblib
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    from highstreets.visualisation import visualise
+
+    series = pd.read_pickle(series_file)
+    fits = joblib.load(fit_file)
+    full = series["full"]
+    figures = {"2020": figure_2020, "2021": figure_2021}
+    xlims = {"2020": ("2020-01-01", "2020-12-31"), "2021": ("2021-01-05", "2021-09-01")}
+    for window, figure in figures.items():
+        _, means, slopes = _recovery_stats(series, fits, window)
+        # plot_highstreets_grouped saves to PROJECT_ROOT/reports/figures
+        visualise.plot_highstreets_grouped(
+            full.to_numpy().T,
+            full.index,
+            (means, slopes),
+            pd.to_datetime(nb_dates),
+            os.path.basename(figure),
+            xlim=xlims[window],
+            figure_title=window,
+            n_grp=n_grp,
+        )
+        plt.close("all")
+
+
+def _bt_weekly(input_dir, weights_dir, output_file, kind):
+    from highstreets.data import area_weights, bt_out_of_core
+
+    weights = area_weights.load_area_weights(kind, weights_dir)
+    result, _ = bt_out_of_core.run_out_of_core(
+        kind, weights, input_dir=input_dir, verbose=False
+    )
+    result.to_csv(output_file, index=False)
+
+
+# (dates, fit start date) of each recovery window, as in the regressions
+# notebook
+RECOVERY_WINDOWS = {
+    "2020": (("2020-04-15", "2020-10-31"), "2020-04-01"),
+    "2021": (("2021-02-12", "2021-08-31"), "2021-04-12"),
+    "full": (("2020-01-01", "2021-12-31"), "2020-04-01"),
+}
+
+NB_DATES = [
+    "2020-03-24",  # first lockdown starts
+    "2020-06-15",  # shops reopen
+    "2020-11-05",  # second lockdown starts
+    "2020-12-02",  # back to 'tier 2' (i.e. partial reopening)
+    "2021-01-05",  # third lockdown starts
+    "2021-04-12",  # shops reopen
+]
+
+
+def default_pipeline(work_dir, state_file=None):
+    """The stages from the raw data to features, models and figures, with
+    intermediate files in work_dir. Stages whose settings (or upstream
+    stages) are missing are left out
+
+    :param work_dir: folder for the intermediate files and models
+    :type work_dir: str
+    :param state_file: defaults to STATE_FILE in work_dir
+    :type state_file: str, optional
+    :rtype: Pipeline
+    """
+
+    def work(name):
+        return os.path.join(work_dir, name)
+
+    series_inputs = {
+        "series_file": work("recovery_series.pkl"),
+        "fit_file": work("fit_lines.joblib"),
+    }
+    windows = {
+        k: [list(dates), start] for k, (dates, start) in RECOVERY_WINDOWS.items()
+    }
+    stages = [
+        Stage(
+            "spend_long",
+            _spend_long,
+            {"yoy_file": config.YOY_FILE},
+            {"long_file": work("hsd_long.pkl")},
+            {},
+        ),
+        Stage(
+            "recovery_series",
+            _recovery_series,
+            {"long_file": work("hsd_long.pkl")},
+            {"series_file": work("recovery_series.pkl")},
+            {"windows": windows},
+        ),
+        Stage(
+            "fit_lines",
+            _fit_lines,
+            {"series_file": work("recovery_series.pkl")},
+            {"fit_file": work("fit_lines.joblib")},
+            {"windows": windows},
+        ),
+        Stage(
+            "groups_2020",
+            _groups,
+            series_inputs,
+            {"groups_file": work("groups_2020.csv")},
+            {"window": "2020", "n_grp": 4},
+        ),
+        Stage(
+            "profile_features",
+            _profile_features,
+            {
+                **series_inputs,
+                "profile_file": config.PROFILE_FILE,
+                "yoy_file": config.YOY_FILE,
+                "clusters_file": config.O2_CLUSTERS,
+            },
+            {"features_file": work("profile_features.pkl")},
+            {},
+        ),
+        Stage(
+            "model",
+            _model,
+            {"features_file": work("profile_features.pkl")},
+            {"model_file": work("model_slope_2020.joblib")},
+            {"target": "slope 2020", "alpha": 1.0, "random_state": 0},
+        ),
+        Stage(
+            "bt_weekly",
+            _bt_weekly,
+            {
+                "input_dir": config.BT_DIR and os.path.join(config.BT_DIR, "received"),
+                "weights_dir": config.BT_AREA_WEIGHTS_DIR,
+            },
+            {"output_file": work("bt_hex_weekly.csv")},
+            {"kind": "hex"},
+        ),
+    ]
+    if config.PROJECT_ROOT is not None:
+        figures_dir = os.path.join(config.PROJECT_ROOT, "reports", "figures")
+        stages.append(
+            Stage(
+                "figures",
+                _figures,
+                series_inputs,
+                {
+                    "figure_2020": os.path.join(
+                        figures_dir, "2020_hs_by_mean_slope.png"
+                    ),
+                    "figure_2021": os.path.join(
+                        figures_dir, "2021_hs_by_mean_slope.png"
+                    ),
+                },
+                {"nb_dates": NB_DATES, "n_grp": 4},
+            )
+        )
+
+    pipeline = Pipeline(state_file or work(STATE_FILE))
+    # inputs in work_dir must be written by a stage that is kept
+    work_dir = os.path.abspath(work_dir)
+    written = set()
+    for stage in stages:
+        paths = [p and os.path.abspath(p) for p in stage.inputs.values()]
+        if all(
+            p is not None and (p in written or not p.startswith(work_dir))
+            for p in paths
+        ):
+            pipeline.add(*stage)
+            written.update(os.path.abspath(p) for p in stage.outputs.values())
+    return pipeline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the highstreets pipeline")
+    parser.add_argument(
+        "--work-dir",
+        help="folder for intermediate files, defaults to DATA_PATH/interim",
+    )
+    parser.add_argument("--targets", nargs="*", help="stages to bring up to date")
+    parser.add_argument("--force", action="store_true", help="re-run every stage")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--status", action="store_true", help="show which stages would run"
+    )
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir
+    if work_dir is None:
+        if config.DATA_PATH is None:
+            parser.error("no --work-dir given and DATA_PATH is not set")
+        work_dir = os.path.join(config.DATA_PATH, "interim")
+    pipeline = default_pipeline(os.path.abspath(work_dir))
+
+    if args.status:
+        print(pipeline.status(args.targets).to_string(index=False))
+    else:
+        pipeline.run(args.targets, force=args.force, max_workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
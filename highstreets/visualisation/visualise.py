@@ -1,19 +1,7 @@
-import os
-
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import seaborn as sns
-from dotenv import find_dotenv, load_dotenv
-from matplotlib.backends.backend_pdf import PdfPages
-from scipy import stats as spstat
-
-load_dotenv(find_dotenv())
 
-YOY_FILE = os.environ.get("YOY_FILE")
-PROFILE_FILE = os.environ.get("PROFILE_FILE")
-PROJECT_ROOT = os.environ.get("PROJECT_ROOT")
+from highstreets import config
 
 
 def plot_all_profiles_full(data, fit_lines):
@@ -31,6 +19,11 @@ def plot_all_profiles_full(data, fit_lines):
     highstreet.
     :type fit_lines: Dict of numpy arrays
     """
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from matplotlib.backends.backend_pdf import PdfPages
+
     nrows = 6
     ncols = 3
     colors = sns.color_palette()
@@ -59,7 +52,7 @@ def plot_all_profiles_full(data, fit_lines):
     print("page: ", page)
 
     with PdfPages(
-        PROJECT_ROOT + "/reports/figures/hs_profiles_w_linear_fit.pdf"
+        config.PROJECT_ROOT + "/reports/figures/hs_profiles_w_linear_fit.pdf"
     ) as pdf:
 
         for hs in range(num_hs):
@@ -133,6 +126,9 @@ def plot_highstreets_grouped(
     :param xlim: _description_, defaults to ('2020-01-01','2020-12-31')
     :type xlim: tuple, optional
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from scipy import stats as spstat
 
     sns.set_theme(style="darkgrid")
 
@@ -287,7 +283,7 @@ def plot_highstreets_grouped(
     axes[0][0].set_ylabel("MRLI relative to 2019")
     fig.suptitle(figure_title, fontsize=16, y=0.91)
 
-    plt.savefig(PROJECT_ROOT + "/reports/figures/" + filename)
+    plt.savefig(config.PROJECT_ROOT + "/reports/figures/" + filename)
 
     if equal_hs_per_bin:
         return None
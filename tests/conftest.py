@@ -1 +1,19 @@
 """Add Pytest fixtures in here"""
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--bench-scale",
+        type=float,
+        default=0.1,
+        help="data scale of tests/test_benchmarks.py, 1 being London-sized",
+    )
+
+
+def pytest_configure(config):
+    # the benchmarks run once each, untimed, as a check that they work,
+    # unless timing is asked for with --benchmark-enable or --benchmark-only
+    if hasattr(config.option, "benchmark_disable") and not (
+        config.option.benchmark_enable or config.option.benchmark_only
+    ):
+        config.option.benchmark_disable = True
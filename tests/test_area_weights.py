@@ -0,0 +1,73 @@
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from highstreets.data import area_weights
+
+gpd = pytest.importorskip("geopandas")
+shapely_geometry = pytest.importorskip("shapely.geometry")
+
+
+def box(x0, y0, x1, y1):
+    """Rectangle in metres from a point in central London, in British
+    National Grid coordinates"""
+    return shapely_geometry.box(530_000 + x0, 180_000 + y0, 530_000 + x1, 180_000 + y1)
+
+
+@pytest.fixture
+def areas():
+    # two 10 x 10 squares side by side
+    return gpd.GeoDataFrame(
+        {"lsoa_id": ["A", "B"]},
+        geometry=[box(0, 0, 10, 10), box(10, 0, 20, 10)],
+        crs="EPSG:27700",
+    )
+
+
+def test_compute_area_weights(areas):
+    highstreets = gpd.GeoDataFrame(
+        {"highstreet_id": [1, 2, 3]},
+        geometry=[
+            box(5, 0, 15, 10),  # half of A and half of B
+            box(0, 0, 2, 10),  # a fifth of A
+            box(19.999, 0, 20, 0.001),  # too small a sliver of B to keep
+        ],
+        crs="EPSG:27700",
+    )
+
+    weights = area_weights.compute_area_weights(areas, highstreets, "lsoa_id")
+
+    expected = pd.DataFrame(
+        {
+            "lsoa_id": ["A", "A", "B"],
+            "highstreet_id": [1, 2, 1],
+            "weight": [0.5, 0.2, 0.5],
+        }
+    )
+    pdt.assert_frame_equal(
+        weights.sort_values(["lsoa_id", "highstreet_id"], ignore_index=True),
+        expected,
+        check_dtype=False,
+    )
+
+
+def test_compute_area_weights_reprojects_highstreets(areas):
+    highstreets = gpd.GeoDataFrame(
+        {"highstreet_id": [1]}, geometry=[box(5, 0, 15, 10)], crs="EPSG:27700"
+    ).to_crs("EPSG:4326")
+
+    weights = area_weights.compute_area_weights(areas, highstreets, "lsoa_id")
+
+    assert weights["weight"].tolist() == pytest.approx([0.5, 0.5], rel=1e-3)
+
+
+def test_save_and_load_area_weights(tmp_path):
+    weights = pd.DataFrame(
+        {"lsoa_id": ["A", "B"], "highstreet_id": [1, 1], "weight": [0.5, 0.25]}
+    )
+
+    area_weights.save_area_weights(weights, "lsoa", str(tmp_path))
+
+    pdt.assert_frame_equal(
+        area_weights.load_area_weights("lsoa", str(tmp_path)), weights
+    )
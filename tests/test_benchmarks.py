@@ -0,0 +1,37 @@
+"""
+Runs every benchmark registered in highstreets.benchmarks with
+pytest-benchmark.
+
+A plain pytest run calls each benchmark once on small data, untimed. To time
+them at London scale on one commit and check another against it, as CI does
+with each commit and its parent:
+    pytest tests/test_benchmarks.py --benchmark-only --bench-scale 1
+        --benchmark-save=before
+    (change or check out the other commit)
+    pytest tests/test_benchmarks.py --benchmark-only --bench-scale 1
+        --benchmark-compare --benchmark-compare-fail=min:20%
+Timings are only comparable when taken on the same machine.
+"""
+import pytest
+
+from highstreets import benchmarks
+
+pytest.importorskip("pytest_benchmark")
+
+# build_features.hist2d_highstreets assigns its even groups through a chained
+# index
+pytestmark = pytest.mark.filterwarnings("ignore::pandas.errors.SettingWithCopyWarning")
+
+
+@pytest.fixture(scope="session")
+def bench_dir(tmp_path_factory):
+    # shared, so the files written by the ingest benchmarks are written once
+    return str(tmp_path_factory.mktemp("benchmarks"))
+
+
+@pytest.mark.parametrize("name", list(benchmarks.BENCHMARKS))
+def test_benchmark(benchmark, name, bench_dir, request):
+    func = benchmarks.BENCHMARKS[name](
+        request.config.getoption("bench_scale"), bench_dir
+    )
+    benchmark(func)
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from highstreets.features import bootstrap, build_features
+
+N_GRP = 3
+
+
+def _weekly(n_weeks=80, n_hs=30, seed=0):
+    """Weekly series with columns as make_dataset.extract_data_array"""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2020-04-20", periods=n_weeks, freq="W-MON")
+    t = np.arange(n_weeks)[:, None]
+    values = rng.normal(1, 0.2, n_hs) + rng.normal(0, 0.01, n_hs) * t
+    values = values + rng.normal(0, 0.1, (n_weeks, n_hs))
+    columns = pd.MultiIndex.from_tuples(
+        [("txn_amt", i, f"high street {i}") for i in range(1, n_hs + 1)]
+    )
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def test_matches_get_fit_lines_and_group_highstreets():
+    data = _weekly()
+    reg, _ = build_features.get_fit_lines(data.index[0], data.index, data.to_numpy().T)
+    means = data.mean().to_numpy()[:, None]
+    slopes = reg.coef_.reshape(-1, 1)
+    expected = build_features.group_highstreets(data, (means, slopes), N_GRP)
+    expected = expected.set_index("highstreet_id").loc[data.columns.get_level_values(1)]
+
+    highstreets, _ = bootstrap.bootstrap_recovery(data, n_grp=N_GRP, n_resamples=50)
+
+    np.testing.assert_allclose(highstreets["mean"], means[:, 0])
+    np.testing.assert_allclose(highstreets["slope"], slopes[:, 0])
+    np.testing.assert_array_equal(highstreets["group"], expected["overall_group"])
+    np.testing.assert_array_equal(highstreets["row"], expected["group_1"])
+    np.testing.assert_array_equal(highstreets["column"], expected["group_2"])
+
+
+def test_resamples_of_one_week_have_no_slope():
+    data = _weekly(n_weeks=11, n_hs=2).to_numpy()
+    # each resample draws a single week, every time
+    indices = np.repeat(np.arange(11)[:, None], 11, axis=1)
+
+    means, slopes = bootstrap.bootstrap_estimates(np.arange(11) * 7.0, data, indices)
+
+    np.testing.assert_allclose(means, data)
+    assert np.isnan(slopes).all()
+
+
+@pytest.fixture(scope="module")
+def sparse():
+    """One high street observed in only 2 of the 80 weeks"""
+    data = _weekly()
+    data.iloc[:, 0] = np.nan
+    data.iloc[[10, 50], 0] = [1.13, 0.87]
+    highstreets, groups = bootstrap.bootstrap_recovery(
+        data, n_grp=N_GRP, n_resamples=200
+    )
+    return data, highstreets, groups
+
+
+def test_sparse_highstreet_intervals_are_finite_or_missing(sparse):
+    _, highstreets, groups = sparse
+
+    assert not np.isinf(highstreets.select_dtypes("number")).any().any()
+    # resamples drawing one of the two weeks are left out of the intervals
+    assert highstreets[["slope lower", "slope upper"]].notna().all().all()
+    assert np.isfinite(groups.drop(columns="stability")).all().all()
+
+
+def test_group_means_skip_missing_members(sparse):
+    data, highstreets, groups = sparse
+    t = (data.index - data.index[0]).days.to_numpy(dtype=float)
+    draws = bootstrap.bootstrap_estimates(
+        t, data.to_numpy(), bootstrap.resample_indices(len(t), 200)
+    )
+
+    for name, estimates in zip(["mean", "slope"], draws):
+        for group, members in highstreets.groupby("group").groups.items():
+            member_draws = estimates[:, highstreets.index.get_indexer(members)]
+            expected = np.nanpercentile(np.nanmean(member_draws, axis=1), [2.5, 97.5])
+            np.testing.assert_allclose(
+                groups.loc[group, [f"{name} lower", f"{name} upper"]], expected
+            )
@@ -0,0 +1,74 @@
+import os
+
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from highstreets import config
+from highstreets.data import bt_out_of_core, synthetic
+
+REISSUED = ["2022-01-05", "2022-01-20"]
+
+
+def _write_delivery(input_dir, folder, df):
+    files_dir = os.path.join(input_dir, folder, "files")
+    os.makedirs(files_dir)
+    df.to_csv(
+        os.path.join(files_dir, f"{config.BT_TFL_HEX_DAILY_PREFIX}.csv"), index=False
+    )
+
+
+def _run(input_dir):
+    result, _ = bt_out_of_core.run_out_of_core(
+        "hex",
+        synthetic.make_area_weights("hex", scale=0.002),
+        input_dir=str(input_dir),
+        max_workers=1,
+        verbose=False,
+    )
+    return result
+
+
+@pytest.fixture
+def deliveries():
+    january = synthetic.make_bt_daily("hex", scale=0.002, month="2022-01-01")
+    february = synthetic.make_bt_daily("hex", scale=0.002, month="2022-02-01")
+    # the later delivery re-issues a few sparse January dates, with new volumes
+    reissued = january[january["date"].isin(REISSUED)].copy()
+    reissued["scaled_volume"] = "1000"
+    return january, reissued, february
+
+
+def test_latest_delivery_of_each_date(tmp_path, deliveries):
+    january, reissued, february = deliveries
+    _write_delivery(tmp_path / "received", "01_02_2022", january)
+    _write_delivery(
+        tmp_path / "received",
+        "01_03_2022",
+        pd.concat([reissued, february], ignore_index=True),
+    )
+    # the same rows, each date delivered once
+    deduplicated = pd.concat(
+        [january[~january["date"].isin(REISSUED)], reissued, february],
+        ignore_index=True,
+    )
+    _write_delivery(tmp_path / "reference", "01_03_2022", deduplicated)
+
+    result = _run(tmp_path / "received")
+
+    pdt.assert_frame_equal(result, _run(tmp_path / "reference"))
+
+
+def test_main_without_partitions(tmp_path, capsys):
+    (tmp_path / "received").mkdir()
+    weights_dir = tmp_path / "weights"
+    weights_dir.mkdir()
+    synthetic.make_area_weights("hex", scale=0.002).to_csv(
+        weights_dir / "hex_highstreet_weights.csv", index=False
+    )
+
+    bt_out_of_core.main(
+        ["--input-dir", str(tmp_path / "received"), "--weights-dir", str(weights_dir)]
+    )
+
+    assert "No hex daily files found" in capsys.readouterr().out
@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+from sqlalchemy import MetaData, create_engine
+
+from highstreets.data import bt_read_raw, schema, synthetic
+
+HEX_TABLE = "bt_footfall_tfl_hex_daily"
+
+
+@pytest.fixture
+def sqlite_engine(monkeypatch):
+    """Points the loader at an in-memory sqlite database"""
+    engine = create_engine("sqlite://")
+    monkeypatch.setattr(bt_read_raw, "engine", engine)
+    monkeypatch.setattr(bt_read_raw, "metadata_obj", MetaData())
+    return engine
+
+
+def _hex_daily(file_date="2022-02-01", month="2022-01-01"):
+    df = synthetic.make_bt_daily("hex", scale=0.002, month=month)
+    return schema.clean_hex_daily(df, pd.Timestamp(file_date), "hex.csv")
+
+
+def test_clean_hex_daily_converts_date():
+    df = _hex_daily()
+
+    assert pd.api.types.is_datetime64_any_dtype(df["date"])
+
+
+def test_new_or_changed_rows_hex(sqlite_engine):
+    loaded = _hex_daily()
+    loaded.to_sql(HEX_TABLE, sqlite_engine, index=False)
+
+    assert bt_read_raw.new_or_changed_rows(loaded, HEX_TABLE).empty
+
+    redelivered = _hex_daily(file_date="2022-03-01")
+    redelivered.loc[:4, "scaled_volume"] += 1
+    new_rows = _hex_daily(file_date="2022-03-01", month="2022-02-01")
+    df = pd.concat([redelivered, new_rows], ignore_index=True)
+
+    result = bt_read_raw.new_or_changed_rows(df, HEX_TABLE)
+
+    assert len(result) == 5 + len(new_rows)
+    assert result.index[:5].tolist() == [0, 1, 2, 3, 4]
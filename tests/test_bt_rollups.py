@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+from highstreets.data import bt_rollups
+
+HEX_TABLE = "bt_footfall_tfl_hex_daily"
+
+
+def _spec(name):
+    return next(spec for spec in bt_rollups.ROLLUPS if spec["name"] == name)
+
+
+def test_select_sql_hex_highstreet_week():
+    sql = bt_rollups._select_sql(_spec("bt_footfall_hex_highstreet_week"))
+
+    assert "date_trunc('week', s.date) AS period_start" in sql
+    assert (
+        f"FROM {HEX_TABLE} s JOIN bt_hex_highstreet_lookup l "
+        "ON l.hex_grid_id = s.hex_grid_id" in sql
+    )
+    assert "WHERE s.date >= :start AND s.date < :end" in sql
+    assert sql.endswith("GROUP BY l.highstreet_id, date_trunc('week', s.date)")
+
+
+@pytest.mark.parametrize(
+    "grain, first, stop",
+    [
+        ("day", "2022-01-01", "2022-02-01"),
+        # 1 January 2022 is a Saturday, 31 January a Monday
+        ("week", "2021-12-27", "2022-02-07"),
+        ("month", "2022-01-01", "2022-02-01"),
+    ],
+)
+def test_refresh_windows(grain, first, stop):
+    spec = _spec(f"bt_footfall_hex_{grain}")
+
+    statements = bt_rollups._refresh_statements(
+        spec, pd.Timestamp("2022-01-01"), pd.Timestamp("2022-01-31")
+    )
+
+    bounds = {"start": pd.Timestamp(first), "end": pd.Timestamp(stop)}
+    create, index, delete, insert = statements
+    assert create[0].startswith(f"CREATE TABLE IF NOT EXISTS {spec['name']} AS ")
+    assert delete == (
+        f"DELETE FROM {spec['name']} "
+        "WHERE period_start >= :start AND period_start < :end",
+        bounds,
+    )
+    assert insert == (
+        f"INSERT INTO {spec['name']} {bt_rollups._select_sql(spec)}",
+        bounds,
+    )
+
+
+def test_ensure_date_column_only_converts_postgres():
+    engine = create_engine("sqlite://")
+    pd.DataFrame({"date": ["2022-01-01"]}).to_sql(HEX_TABLE, engine, index=False)
+
+    assert not bt_rollups.ensure_date_column(engine, HEX_TABLE)
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+
+import pytest
+
+from highstreets.data import bt_scanner
+
+
+def test_prefetch_depth(tmp_path, monkeypatch):
+    files = []
+    for i in range(6):
+        path = tmp_path / f"file_{i}.csv"
+        path.write_text(f"x\n{i}\n")
+        stat = os.stat(path)
+        files.append(
+            bt_scanner.BTFile(str(path), path.name, None, stat.st_size, stat.st_mtime)
+        )
+
+    reads = []
+    read_bytes = bt_scanner._read_bytes
+
+    def counted_read(path):
+        reads.append(path)
+        return read_bytes(path)
+
+    monkeypatch.setattr(bt_scanner, "_read_bytes", counted_read)
+
+    depth = 2
+    read_ahead = []
+    for i, (bt_file, stream) in enumerate(bt_scanner.prefetch(files, depth=depth)):
+        assert bt_file == files[i]
+        assert stream.read() == f"x\n{i}\n".encode()
+        stream.close()
+        # let any reads already submitted finish
+        time.sleep(0.05)
+        read_ahead.append(len(reads) - i)
+
+    # file i and depth - 1 files after it have been read when file i is
+    # handed out, so with file i - 1 still held depth + 1 files are in memory
+    assert max(read_ahead) == depth
+
+
+def _zstd_file(tmp_path, data):
+    path = tmp_path / "hex.csv.zst"
+    path.write_bytes(data)
+    (bt_file,) = bt_scanner.scan_files(str(tmp_path), None)
+    return bt_file
+
+
+def test_open_zstd_without_zstandard(tmp_path, monkeypatch):
+    bt_file = _zstd_file(tmp_path, bt_scanner.MAGIC_BYTES["zstd"] + b"\x00" * 8)
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+
+    with bt_scanner.open_file(bt_file) as stream:
+        with pytest.raises(ImportError, match="--extras zstd"):
+            stream.read()
+
+
+def test_open_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    bt_file = _zstd_file(tmp_path, zstandard.ZstdCompressor().compress(b"x\n1\n"))
+
+    assert bt_file.compression == "zstd"
+    with bt_scanner.open_file(bt_file) as stream:
+        assert stream.read() == b"x\n1\n"
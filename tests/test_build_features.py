@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from highstreets import config
+from highstreets.data import make_dataset, synthetic
+from highstreets.features import build_features
+
+
+@pytest.fixture
+def yoy_file(tmp_path, monkeypatch):
+    file = tmp_path / "yoy.csv"
+    synthetic.make_mcard_yoy(scale=0.02).to_csv(file, index=False)
+    monkeypatch.setattr(config.get_settings(), "YOY_FILE", str(file))
+    return str(file)
+
+
+def test_append_profile_features_clusters(yoy_file):
+    hsd_yoy = pd.read_csv(yoy_file, parse_dates=["week_start"])
+    hsd_long = make_dataset.stack_retail_we_wd(hsd_yoy, "yoy_").dropna()
+    data = make_dataset.extract_data_array(
+        hsd_long, ("2020-01-01", "2021-12-31"), "txn_amt"
+    )
+    reg, _ = build_features.get_fit_lines("2020-04-01", data.index, data.to_numpy().T)
+    ids = data.columns.get_level_values("highstreet_id").to_numpy()
+    hsp = pd.DataFrame({"highstreet_id": ids, "area": np.arange(len(ids))})
+    # ids not in row order, as returned by clustering.o2_clusters
+    clusters = pd.DataFrame(
+        {
+            "highstreet_id": ids[::-1],
+            "cluster_hourly": ids[::-1] * 10,
+            "cluster_daily": ids[::-1] * 100,
+            "cluster_size": 1,
+        }
+    )
+
+    stats = build_features.append_profile_features(
+        hsp, data, {"2020": reg, "2021": reg}, clusters
+    )
+
+    np.testing.assert_array_equal(stats["cluster_hourly"], stats.index * 10)
+    np.testing.assert_array_equal(stats["cluster_daily"], stats.index * 100)
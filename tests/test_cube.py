@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from highstreets.data import cube, synthetic
+
+
+@pytest.fixture(scope="module")
+def mcard():
+    return synthetic.make_mcard_yoy(scale=0.01)
+
+
+def _expected(df, start, end, highstreets, metrics):
+    """The same selection with pandas, as (weeks x high streets x metrics)"""
+    rows = df[df["week_start"].between(start, end)]
+    wide = rows.pivot(index="week_start", columns="highstreet_id", values=metrics)
+    return np.stack([wide[m][highstreets].to_numpy() for m in metrics], axis=-1)
+
+
+@pytest.mark.parametrize(
+    "highstreets, metrics",
+    [
+        ("all", ["yoy_txn_amt_wd_retail"]),
+        ("all", ["yoy_txn_cnt_we_apparel", "yoy_txn_amt_we_retail"]),
+        ([1, 3], "all"),
+        ([4, 2, 3], ["yoy_txn_amt_wd_eating", "yoy_txn_amt_wd_retail"]),
+    ],
+)
+def test_sel_matches_pandas(tmp_path, mcard, highstreets, metrics):
+    hs_ids = sorted(mcard["highstreet_id"].unique())
+    c = cube.build_cube(str(tmp_path), mcard)
+    highstreets = hs_ids if highstreets == "all" else [hs_ids[i] for i in highstreets]
+    metrics = cube.spend_metrics(mcard) if metrics == "all" else metrics
+
+    selected = c.sel("2020-03-01", "2020-12-31", highstreets, metrics)
+
+    expected = _expected(mcard, "2020-03-01", "2020-12-31", highstreets, metrics)
+    np.testing.assert_array_equal(selected, expected)
+
+
+def test_contiguous_selections_are_views(tmp_path, mcard):
+    c = cube.build_cube(str(tmp_path), mcard)
+    hs_ids = c.highstreets[1:4].tolist()
+
+    selected = c.sel("2021-01-01", None, hs_ids, "yoy_txn_amt_wd_retail")
+
+    assert np.shares_memory(selected, c.values)
+    assert selected.shape == ((c.weeks >= "2021-01-01").sum(), 3)
+
+
+def test_to_frame_matches_pivot(tmp_path, mcard):
+    c = cube.build_cube(str(tmp_path), mcard)
+
+    frame = c.to_frame("yoy_txn_amt_wd_retail", "2020-01-01", "2020-06-30")
+
+    expected = mcard[mcard["week_start"].between("2020-01-01", "2020-06-30")].pivot(
+        index="week_start",
+        columns=["highstreet_id", "highstreet_name"],
+        values=["yoy_txn_amt_wd_retail"],
+    )
+    pdt.assert_frame_equal(frame, expected, check_names=False)
+
+
+def test_appending_week_by_week_matches_build(tmp_path, mcard):
+    weeks = np.sort(mcard["week_start"].unique())
+    built = cube.build_cube(str(tmp_path / "built"), mcard)
+    c = cube.build_cube(
+        str(tmp_path / "appended"), mcard[mcard["week_start"] == weeks[0]]
+    )
+    capacity = c._storage.shape[0]
+
+    for week in weeks[1:]:
+        assert c.append(mcard[mcard["week_start"] == week]) == 1
+
+    reopened = cube.Cube.open(str(tmp_path / "appended"))
+    pdt.assert_index_equal(reopened.weeks, built.weeks)
+    np.testing.assert_array_equal(reopened.values, built.values)
+    assert c._storage.shape[0] > capacity
+    with pytest.raises(ValueError, match="read only"):
+        reopened.append(mcard)
+    with pytest.raises(ValueError, match="must come after"):
+        c.append(mcard.assign(week_start=pd.Timestamp("2000-01-03")))
+
+
+def test_add_metrics(tmp_path, mcard):
+    c = cube.build_cube(str(tmp_path), mcard, metrics=["yoy_txn_amt_wd_retail"])
+
+    c.add_metrics(["yoy_txn_amt_we_retail"])
+    assert np.isnan(c.sel(metrics="yoy_txn_amt_we_retail")).all()
+    c.append(mcard)
+
+    reopened = cube.Cube.open(str(tmp_path))
+    expected = _expected(
+        mcard,
+        mcard["week_start"].min(),
+        mcard["week_start"].max(),
+        reopened.highstreets.tolist(),
+        ["yoy_txn_amt_wd_retail", "yoy_txn_amt_we_retail"],
+    )
+    np.testing.assert_array_equal(reopened.values, expected)
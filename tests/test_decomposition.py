@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from highstreets.features import decomposition
+
+PERIOD = 13
+
+
+@pytest.fixture
+def series():
+    """Weekly series with a trend, a seasonal cycle, noise and a gap"""
+    rng = np.random.default_rng(0)
+    weeks = np.arange(80)[:, None]
+    values = (
+        0.02 * weeks * rng.normal(size=6)
+        + np.sin(2 * np.pi * weeks / PERIOD) * rng.uniform(0.5, 2, 6)
+        + rng.normal(0, 0.1, (80, 6))
+        + 5
+    )
+    values[30:33, 1] = np.nan
+    return pd.DataFrame(
+        values, index=pd.date_range("2020-01-06", periods=80, freq="W-MON")
+    )
+
+
+def _rolling_trend(df, window):
+    """Centred moving average with pandas, 2 x window for even windows"""
+    if window % 2:
+        return df.rolling(window, center=True).mean()
+    return df.rolling(window).mean().rolling(2).mean().shift(-(window // 2))
+
+
+@pytest.mark.parametrize("window", [PERIOD, 12, 52])
+def test_moving_average_matches_rolling(series, window):
+    trend = decomposition.moving_average(series.to_numpy(), window)
+
+    np.testing.assert_allclose(trend, _rolling_trend(series, window).to_numpy())
+
+
+@pytest.mark.parametrize("model", ["additive", "multiplicative"])
+def test_decompose_matches_pandas(series, model):
+    parts = decomposition.decompose(series, period=PERIOD, model=model)
+
+    trend = _rolling_trend(series, PERIOD)
+    position = np.arange(len(series)) % PERIOD
+    if model == "additive":
+        means = (series - trend).groupby(position).mean()
+        seasonal = (means - means.mean()).loc[position].set_axis(series.index)
+        resid = series - trend - seasonal
+    else:
+        means = (series / trend).groupby(position).mean()
+        seasonal = (means / means.mean()).loc[position].set_axis(series.index)
+        resid = series / (trend * seasonal)
+
+    pdt.assert_frame_equal(parts.trend, trend)
+    pdt.assert_frame_equal(parts.seasonal, seasonal)
+    pdt.assert_frame_equal(parts.resid, resid)
+
+
+def test_decompose_cube_matches_each_metric(series):
+    values = series.to_numpy()
+    cube = np.stack([values, 2 * values + 1], axis=-1)
+
+    parts = decomposition.decompose(cube, period=PERIOD)
+
+    for m in range(cube.shape[-1]):
+        expected = decomposition.decompose(cube[:, :, m], period=PERIOD)
+        for part, single in zip(parts, expected):
+            np.testing.assert_allclose(part[:, :, m], single)
+
+
+def test_unknown_model():
+    with pytest.raises(ValueError, match="additive"):
+        decomposition.decompose(np.ones((60, 2)), model="log")
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from highstreets.data import make_dataset, synthetic
+from highstreets.features import feature_store
+
+
+@pytest.fixture(scope="module")
+def weekly():
+    """avg_retail_wd_we output, indexed by period_start as in the notebooks"""
+    return make_dataset.avg_retail_wd_we(synthetic.make_mcard_yoy(scale=0.02), "yoy_")
+
+
+def test_week_by_week_matches_full_recompute(weekly):
+    store = feature_store.FeatureStore(metrics=["txn_amt", "txn_cnt"])
+    for _, week in weekly.groupby(weekly["period_start"].to_numpy()):
+        store.append(week)
+
+    for metric in store.metrics:
+        matches, diff = feature_store.check_against_full(store, weekly, metric)
+        assert matches, diff
+
+
+def test_history_then_new_weeks(weekly):
+    cutoff = weekly["period_start"].sort_values().unique()[-4]
+    history = weekly[weekly["period_start"] < cutoff]
+    store = feature_store.FeatureStore()
+
+    assert store.append(history) == history["period_start"].nunique()
+    assert store.append(weekly[weekly["period_start"] >= cutoff]) == 4
+
+    matches, diff = feature_store.check_against_full(store, weekly)
+    assert matches, diff
+    assert np.isfinite(store.features()["slope all"]).all()
+
+
+def test_save_load_round_trip(weekly, tmp_path):
+    store = feature_store.FeatureStore()
+    store.append(weekly)
+    store.save(tmp_path / "store.npz")
+
+    loaded = feature_store.FeatureStore.load(tmp_path / "store.npz")
+
+    assert loaded.features().equals(store.features())
+
+
+def test_rejects_weeks_already_in_the_store(weekly):
+    store = feature_store.FeatureStore()
+    store.append(weekly)
+
+    with pytest.raises(ValueError, match="already in the store"):
+        store.append(weekly[weekly["period_start"] == weekly["period_start"].max()])
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from highstreets.models import forecast as fc
+
+
+def _weekly(n_weeks=120, n_series=3, period=52, random_state=0):
+    rng = np.random.default_rng(random_state)
+    weeks = np.arange(n_weeks)[:, None]
+    season = np.sin(2 * np.pi * weeks / period)
+    return (
+        100
+        + season * np.arange(1, n_series + 1)
+        + rng.normal(0, 0.1, (n_weeks, n_series))
+    )
+
+
+def test_snaive_repeats_last_season():
+    values = _weekly()
+
+    result = fc.forecast(values, horizon=8, method="snaive")
+
+    np.testing.assert_array_equal(result.mean, values[120 - 52 : 120 - 52 + 8])
+    assert np.isfinite(result.lower).all()
+
+
+def test_snaive_short_data_is_nan():
+    values = _weekly(n_weeks=30)
+
+    result = fc.forecast(values, horizon=25, method="snaive")
+
+    # week 30 + h is one season after week h - 22, which only exists for h > 22
+    assert np.isnan(result.mean[:22]).all()
+    np.testing.assert_array_equal(result.mean[22:], values[:3])
+    assert np.isnan(result.lower).all()
+
+
+def test_snaive_backtest_origins_before_period():
+    values = _weekly()
+
+    with pytest.raises(ValueError, match="period"):
+        fc.backtest(values, horizon=8, origins=[10, 20], method="snaive")
+
+
+def test_snaive_backtest_matches_forecast():
+    values = _weekly()
+    origins = [60, 80, 100]
+
+    summary, errors = fc.backtest(values, horizon=8, origins=origins, method="snaive")
+
+    for i, origin in enumerate(origins):
+        mean = fc.forecast(values[:origin], horizon=8, method="snaive").mean
+        np.testing.assert_allclose(errors[i], values[origin : origin + 8] - mean)
+    assert summary["mae"].notna().all()
+
+
+@pytest.mark.parametrize("method", ["ses", "holt"])
+def test_forecast_dataframe_index(method):
+    dates = pd.date_range("2021-01-04", periods=60, freq="W-MON")
+    data = pd.DataFrame(_weekly(n_weeks=60), index=dates)
+
+    result = fc.forecast(data, horizon=4, method=method)
+
+    assert result.mean.index[0] == dates[-1] + pd.Timedelta(weeks=1)
+    assert (result.lower.to_numpy() <= result.upper.to_numpy()).all()
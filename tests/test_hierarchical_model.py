@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from highstreets.models import hierarchical_model as hm
+
+# parameters simulate_data draws from
+TRUTH = {"mu_a": 0.8, "mu_b": 0.01, "sigma_a": 0.2, "sigma_b": 0.005, "sigma": 0.1}
+
+
+@pytest.mark.parametrize("batch_size", [64, 300])
+def test_fit_recovers_parameters(batch_size):
+    data = hm.simulate_data(300, 52)
+
+    params = hm.fit_hierarchical(*data, batch_size=batch_size)
+    summary = hm.global_summary(params)
+
+    for name, value in TRUTH.items():
+        assert summary.loc[name, "mean"] == pytest.approx(value, rel=0.1), name
+    # the spread of slopes is small on a per week scale, so is easily swamped
+    # by the prior
+    assert summary.loc["sigma_b", "lower"] <= 0.005 <= summary.loc["sigma_b", "upper"]
+    assert params["epochs"] < 200
+
+
+def test_fit_recovers_slopes():
+    highstreet_id, weeks, obs = hm.simulate_data(300, 52)
+    rng = np.random.default_rng(0)
+    a = rng.normal(0.8, 0.2, 300)
+    b = rng.normal(0.01, 0.005, 300)
+
+    summary = hm.posterior_summary(hm.fit_hierarchical(highstreet_id, weeks, obs))
+
+    assert np.corrcoef(summary["a_mean"], a)[0, 1] > 0.99
+    assert np.corrcoef(summary["b_mean"], b)[0, 1] > 0.95
+    covered = (summary["b_lower"] <= b) & (b <= summary["b_upper"])
+    assert covered.mean() > 0.9
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from highstreets.features import hierarchy
+
+TIMES = pd.date_range("2022-01-03", periods=3, freq="W-MON", name="week_start")
+
+
+@pytest.fixture
+def links():
+    weights = pd.DataFrame(
+        {
+            "lsoa_id": ["A", "A", "B", "C", "D"],
+            "highstreet_id": [1, 2, 2, 3, 3],
+            "weight": [0.25, 0.5, 1.0, 0.5, 0.75],
+        }
+    )
+    tc_lookup = pd.DataFrame(
+        {
+            "highstreet_id": [1, 2, 3],
+            "tc_name": ["Angel", "Angel", np.nan],
+            "borough": ["Islington", "Islington", "Hackney"],
+        }
+    )
+    return weights, hierarchy.default_links(weights, tc_lookup, "lsoa_id")
+
+
+@pytest.fixture
+def long():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        [(a, t) for a in "ABCD" for t in TIMES], columns=["lsoa_id", "week_start"]
+    )
+    df["scaled_volume"] = rng.integers(10, 100, len(df)).astype(float)
+    df["dwell_time"] = rng.uniform(10, 60, len(df))
+    df.loc[3, "dwell_time"] = np.nan
+    return df
+
+
+def _aggregate(links, long):
+    volume, areas, times = hierarchy.to_area_time_array(
+        long, "lsoa_id", "week_start", "scaled_volume"
+    )
+    dwell, _, _ = hierarchy.to_area_time_array(
+        long, "lsoa_id", "week_start", "dwell_time", areas
+    )
+    return hierarchy.aggregate_hierarchy(
+        hierarchy.build_hierarchy(areas, links),
+        sums={"scaled_volume": volume},
+        means={"dwell_time": dwell},
+        weights=volume,
+        times=times,
+    )
+
+
+def test_highstreets_match_pandas(links, long):
+    weights, links = links
+
+    out = _aggregate(links, long)
+
+    df = long.merge(weights, on="lsoa_id")
+    df["volume"] = df["scaled_volume"] * df["weight"]
+    df["dwell_volume"] = df["dwell_time"] * df["volume"]
+    df["dwell_weight"] = df["volume"].where(df["dwell_time"].notna(), 0)
+    grouped = df.groupby(["highstreet_id", "week_start"])[
+        ["volume", "dwell_volume", "dwell_weight"]
+    ].sum()
+    expected_volume = grouped["volume"].unstack()
+    expected_dwell = (grouped["dwell_volume"] / grouped["dwell_weight"]).unstack()
+
+    for name, expected in [
+        ("scaled_volume", expected_volume),
+        ("dwell_time", expected_dwell),
+    ]:
+        result = out[name].loc["highstreet"]
+        result.index = result.index.astype(int)
+        pdt.assert_frame_equal(result, expected, check_names=False)
+
+
+def test_levels_roll_up_the_leaves(links, long):
+    _, links = links
+
+    volume = _aggregate(links, long)["scaled_volume"]
+
+    highstreets = volume.loc["highstreet"]
+    pdt.assert_series_equal(
+        volume.loc[("town_centre", "Angel")],
+        highstreets.loc[[1, 2]].sum(),
+        check_names=False,
+    )
+    pdt.assert_series_equal(
+        volume.loc[("borough", "Hackney")], highstreets.loc[3], check_names=False
+    )
+    pdt.assert_series_equal(
+        volume.loc[("london", "all")], highstreets.sum(), check_names=False
+    )
+    # only the high streets with a town centre
+    assert volume.loc["town_centre"].index.tolist() == ["Angel"]
+
+
+def test_to_area_time_array(long):
+    array, areas, times = hierarchy.to_area_time_array(
+        long, "lsoa_id", "week_start", "dwell_time", area_ids=["D", "A", "E"]
+    )
+
+    expected = long.pivot(index="lsoa_id", columns="week_start", values="dwell_time")
+    np.testing.assert_array_equal(array[:2], expected.loc[["D", "A"]].to_numpy())
+    assert np.isnan(array[2]).all()
+    assert areas.tolist() == ["D", "A", "E"]
+    pdt.assert_index_equal(times, TIMES, check_names=False, exact=False)
@@ -0,0 +1,32 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from highstreets import benchmarks
+
+HEAVY_MODULES = {"sklearn", "matplotlib", "seaborn", "scipy.stats"}
+
+# pandera, which validates the BT files, imports scipy.stats itself
+NEEDED = {
+    "highstreets.data.bt_read_raw": {"scipy.stats"},
+    "highstreets.data.bt_out_of_core": {"scipy.stats"},
+}
+
+
+def _imported(module):
+    """Heavy modules imported by importing module in a fresh interpreter"""
+    check = (
+        f"import json, sys, {module}; "
+        f"print(json.dumps(sorted(set(sys.modules) & {HEAVY_MODULES!r})))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", check], capture_output=True, text=True, check=True
+    )
+    return set(json.loads(result.stdout))
+
+
+@pytest.mark.parametrize("module", benchmarks.STARTUP_MODULES)
+def test_heavy_dependencies_imported_lazily(module):
+    assert _imported(module) <= NEEDED.get(module, set())
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+CHECK = """
+from highstreets import config
+from highstreets import instrumentation as instr
+from highstreets.data import make_dataset
+
+print(config.get_settings.cache_info().currsize)
+print(instr.is_enabled())
+print(config.get_settings.cache_info().currsize)
+"""
+
+
+def _run(env):
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK],
+        env={**os.environ, **env},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.split()[:3]
+
+
+@pytest.mark.parametrize("setting, enabled", [("0", "False"), ("1", "True")])
+def test_settings_read_on_first_use(setting, enabled):
+    # nothing is loaded by the imports, the setting is read on first use
+    assert _run({"HIGHSTREETS_INSTRUMENT": setting}) == ["0", enabled, "1"]
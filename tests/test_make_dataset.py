@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from highstreets.data import make_dataset, synthetic
+
+SECTORS = ["retail", "eating", "apparel"]
+
+
+@pytest.fixture(scope="module")
+def mcard():
+    df = synthetic.make_mcard_yoy(scale=0.01)
+    rng = np.random.default_rng(0)
+    spend = [col for col, *_ in make_dataset.spend_columns(df, "yoy_")]
+    df[spend] = df[spend].mask(rng.random((len(df), len(spend))) < 0.05)
+    return df
+
+
+def _baseline_avg(df, prefix, sector):
+    """Weekend/weekday average the way it was computed before vectorising"""
+    out = df[["week_start", "highstreet_id", "highstreet_name"]].copy()
+    for grp in make_dataset.SPEND_GROUPS:
+        out[grp] = df[[f"{prefix}{grp}_{tp}_{sector}" for tp in ["we", "wd"]]].agg(
+            "mean", 1
+        )
+    out = out.rename(columns={"week_start": "period_start"})
+    return out.set_index("period_start", drop=False)
+
+
+def _baseline_stack(df, prefix, sector):
+    """Weekend rows (dated the Saturday) concatenated with weekday rows"""
+    parts = []
+    for tp in ["we", "wd"]:
+        cols = [f"{prefix}{grp}_{tp}_{sector}" for grp in make_dataset.SPEND_GROUPS]
+        part = df[["week_start", "highstreet_id", "highstreet_name"] + cols].rename(
+            columns=dict(zip(cols, make_dataset.SPEND_GROUPS))
+        )
+        part = part.rename(columns={"week_start": "period_start"})
+        if tp == "we":
+            part["period_start"] = part["period_start"] + pd.DateOffset(days=5)
+        part["we_wd"] = tp
+        parts.append(part)
+    stacked = pd.concat(parts)
+    return stacked.set_index("period_start", drop=False).sort_index(kind="stable")
+
+
+def test_avg_retail_matches_baseline(mcard):
+    pdt.assert_frame_equal(
+        make_dataset.avg_retail_wd_we(mcard, "yoy_"),
+        _baseline_avg(mcard, "yoy_", "retail"),
+    )
+
+
+def test_stack_retail_matches_baseline(mcard):
+    pdt.assert_frame_equal(
+        make_dataset.stack_retail_we_wd(mcard, "yoy_"),
+        _baseline_stack(mcard, "yoy_", "retail"),
+    )
+
+
+def test_avg_spend_every_sector_matches_baseline(mcard):
+    averaged = make_dataset.avg_spend_wd_we(mcard, "yoy_")
+
+    assert averaged["sector"].cat.categories.tolist() == SECTORS
+    for sector in SECTORS:
+        rows = averaged[averaged["sector"] == sector].drop(columns="sector")
+        pdt.assert_frame_equal(rows, _baseline_avg(mcard, "yoy_", sector))
+
+
+def test_spend_long_format_matches_melt(mcard):
+    long = make_dataset.spend_long_format(mcard, "yoy_", sectors=["apparel", "retail"])
+
+    melted = mcard.melt(
+        id_vars=make_dataset.ID_COLS,
+        value_vars=[
+            col
+            for col, *_ in make_dataset.spend_columns(
+                mcard, "yoy_", ["apparel", "retail"]
+            )
+        ],
+    )
+    parts = melted["variable"].str.extract(r"yoy_(txn_\w{3})_(w[de])_(\w+)")
+    melted[["group", "we_wd", "sector"]] = parts.to_numpy()
+    keys = make_dataset.ID_COLS + ["sector", "we_wd"]
+    expected = melted.set_index(keys + ["group"])["value"].unstack().reset_index()
+    result = long.astype({"sector": object, "we_wd": object})
+    pdt.assert_frame_equal(
+        result.sort_values(keys, ignore_index=True),
+        expected.sort_values(keys, ignore_index=True),
+        check_names=False,
+    )
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from highstreets.features import o2_hourly
+
+
+def test_hourly_array_skips_missing_highstreets():
+    df = pd.DataFrame(
+        {
+            "highstreet_name": ["a", "a", None, "b"],
+            "count_date": ["2021-01-01", "2021-01-02", "2021-01-01", "2021-01-02"],
+        }
+    )
+    for hour, column in enumerate(o2_hourly.HOUR_COLS):
+        df[column] = [1.0, 2.0, 50.0, 3.0 + hour]
+
+    array, highstreets, days = o2_hourly.hourly_array(df)
+
+    assert highstreets.tolist() == ["a", "b"]
+    assert len(days) == 2
+    np.testing.assert_array_equal(array[0, :, 0], [1.0, 2.0])
+    np.testing.assert_array_equal(array[1, :, 5], [np.nan, 8.0])
@@ -0,0 +1,176 @@
+import os
+import sys
+import threading
+
+import pytest
+
+from highstreets import pipeline
+
+PACKAGE = "stagelib"
+
+
+def _write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    # so edits within the same clock tick still count as changes
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 1000))
+
+
+@pytest.fixture
+def stagelib(tmp_path, monkeypatch):
+    """A package a stage uses, on the path and part of stage keys"""
+    package_dir = tmp_path / PACKAGE
+    package_dir.mkdir()
+    _write(package_dir / "__init__.py", "")
+    _write(
+        package_dir / "values.py", "from stagelib import base\n\nVALUE = base.BASE\n"
+    )
+    _write(package_dir / "base.py", "BASE = 1\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(pipeline, "CODE_PACKAGES", ("highstreets", PACKAGE))
+    yield package_dir
+    for name in [m for m in sys.modules if m.split(".")[0] == PACKAGE]:
+        del sys.modules[name]
+
+
+def _stage(output_file):
+    from stagelib import values
+
+    with open(output_file, "w") as f:
+        f.write(str(values.VALUE))
+
+
+def _statuses(tmp_path):
+    p = pipeline.Pipeline(str(tmp_path / "state.json"))
+    p.add("stage", _stage, outputs={"output_file": str(tmp_path / "out.txt")})
+    return p.run(verbose=False)["status"].tolist()
+
+
+def test_rerun_when_library_code_changes(tmp_path, stagelib):
+    assert _statuses(tmp_path) == ["ran"]
+    assert _statuses(tmp_path) == ["cached"]
+
+    # a module imported by a module the stage imports
+    _write(stagelib / "base.py", "BASE = 2\n")
+
+    assert _statuses(tmp_path) == ["ran"]
+    assert _statuses(tmp_path) == ["cached"]
+
+
+def test_default_stage_code_includes_library():
+    sources = pipeline._code_sources(pipeline._spend_long)
+    assert "highstreets.data.make_dataset" in sources
+
+    # helpers of the pipeline module the stage calls
+    sources = pipeline._code_sources(pipeline._groups)
+    assert "highstreets.pipeline._recovery_stats" in sources
+    assert "highstreets.features.build_features" in sources
+
+
+def _copy(source, target):
+    with open(source) as f, open(target, "w") as out:
+        out.write(f.read())
+
+
+def _upper(source, target):
+    with open(source) as f, open(target, "w") as out:
+        out.write(f.read().upper())
+
+
+def _chain(tmp_path):
+    """input -> upper -> copy"""
+    p = pipeline.Pipeline(str(tmp_path / "state.json"))
+    p.add(
+        "upper",
+        _upper,
+        inputs={"source": str(tmp_path / "input.txt")},
+        outputs={"target": str(tmp_path / "upper.txt")},
+    )
+    p.add(
+        "copy",
+        _copy,
+        inputs={"source": str(tmp_path / "upper.txt")},
+        outputs={"target": str(tmp_path / "copy.txt")},
+    )
+    return p
+
+
+def _run(p, **kwargs):
+    results = p.run(verbose=False, **kwargs)
+    return dict(zip(results["stage"], results["status"]))
+
+
+def test_skip_unchanged_and_rerun_changed(tmp_path):
+    _write(tmp_path / "input.txt", "abc")
+    p = _chain(tmp_path)
+
+    assert _run(p) == {"upper": "ran", "copy": "ran"}
+    assert _run(p) == {"upper": "cached", "copy": "cached"}
+    assert (tmp_path / "copy.txt").read_text() == "ABC"
+
+    # a changed input re-runs the stage, but the same output leaves the next
+    # stage cached
+    _write(tmp_path / "input.txt", "ABC")
+    assert _run(p) == {"upper": "ran", "copy": "cached"}
+
+    _write(tmp_path / "input.txt", "abcd")
+    assert _run(p) == {"upper": "ran", "copy": "ran"}
+    assert (tmp_path / "copy.txt").read_text() == "ABCD"
+
+    # an output changed (or removed) outside the pipeline is written again
+    _write(tmp_path / "copy.txt", "edited")
+    assert _run(p) == {"upper": "cached", "copy": "ran"}
+    (tmp_path / "upper.txt").unlink()
+    assert _run(p) == {"upper": "ran", "copy": "cached"}
+    assert (tmp_path / "copy.txt").read_text() == "ABCD"
+
+
+def test_independent_stages_run_concurrently(tmp_path):
+    # each stage waits for the other to start, so this only finishes if they
+    # run at the same time
+    barrier = threading.Barrier(2, timeout=10)
+
+    def together(target):
+        barrier.wait()
+        _write(target, "done")
+
+    p = pipeline.Pipeline(str(tmp_path / "state.json"))
+    for name in ["a", "b"]:
+        p.add(name, together, outputs={"target": str(tmp_path / f"{name}.txt")})
+
+    assert _run(p, max_workers=2) == {"a": "ran", "b": "ran"}
+
+
+def test_failing_stage_keeps_finished_stages(tmp_path):
+    failed = threading.Event()
+
+    def slow(target):
+        # still running when the other stage fails
+        failed.wait(timeout=10)
+        _write(target, "done")
+
+    def fail(target):
+        failed.set()
+        raise RuntimeError("stage failed")
+
+    p = pipeline.Pipeline(str(tmp_path / "state.json"))
+    p.add("slow", slow, outputs={"target": str(tmp_path / "slow.txt")})
+    p.add("fail", fail, outputs={"target": str(tmp_path / "fail.txt")})
+    p.add(
+        "after_fail",
+        _copy,
+        inputs={"source": str(tmp_path / "fail.txt")},
+        outputs={"target": str(tmp_path / "after_fail.txt")},
+    )
+
+    with pytest.raises(RuntimeError, match="stage failed"):
+        p.run(max_workers=2, verbose=False)
+
+    assert not (tmp_path / "after_fail.txt").exists()
+    status = p.status()
+    assert dict(zip(status["stage"], status["status"])) == {
+        "slow": "valid",
+        "fail": "stale",
+        "after_fail": "stale",
+    }
+    assert _run(p, targets=["slow"]) == {"slow": "cached"}
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LinearRegression
+
+from highstreets.models import predict_model, registry
+
+
+@pytest.fixture
+def pipeline():
+    X = pd.DataFrame({"x": np.arange(100.0)})
+    model = LinearRegression().fit(X, X["x"])
+    return predict_model.set_label_edges(model, X)
+
+
+def _features(values):
+    return pd.DataFrame(
+        {"x": values}, index=pd.Index(range(len(values)), name="highstreet_id")
+    )
+
+
+def test_label_edges_are_training_quartiles(pipeline):
+    np.testing.assert_allclose(pipeline.label_edges_, [24.75, 49.5, 74.25])
+
+
+def test_score_single_highstreet(pipeline):
+    scores = predict_model.score_highstreets(pipeline, _features([10.0]))
+
+    assert scores["labels"].tolist() == [0]
+    assert scores["at_risk"].tolist() == [True]
+
+
+def test_labels_do_not_depend_on_batch(pipeline):
+    # every high street is in the top quartile of the training data
+    scores = predict_model.score_highstreets(pipeline, _features([80.0, 90, 95, 99]))
+
+    assert scores["labels"].tolist() == [3, 3, 3, 3]
+    assert not scores["at_risk"].any()
+
+
+def test_score_without_label_edges():
+    X = pd.DataFrame({"x": np.arange(10.0)})
+    model = LinearRegression().fit(X, X["x"])
+
+    with pytest.raises(ValueError, match="set_label_edges"):
+        predict_model.score_highstreets(model, _features([1.0]))
+
+
+def test_registry_keeps_label_edges(pipeline, tmp_path):
+    version = registry.save_model(pipeline, "model", registry_dir=tmp_path)
+    model = registry.load_model("model", version, registry_dir=tmp_path)
+
+    np.testing.assert_allclose(model.label_edges_, pipeline.label_edges_)
+    assert not model.loaded
+    scores = predict_model.score_highstreets(model, _features([60.0]))
+    assert scores["labels"].tolist() == [2]
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from highstreets.features import processing_functions as pf
+
+
+def _monthly_spend():
+    return pd.DataFrame(
+        {
+            "highstreet_name": ["b", "a", None, "a", "b", np.nan],
+            "month_year": [
+                "2021-01",
+                "2021-01",
+                "2021-01",
+                "2021-02",
+                "2021-02",
+                "2021-02",
+            ],
+            "txn_amt_wd_retail": [1.0, 2.0, 100.0, 4.0, 3.0, 200.0],
+        }
+    )
+
+
+def test_mean_sd_mcard_skips_missing_highstreets():
+    df = _monthly_spend()
+
+    result = pf.create_mean_sd_mcard(df, ["2021-01", "2021-02"])
+
+    expected = df.groupby("highstreet_name")["txn_amt_wd_retail"].agg(["mean", "std"])
+    assert result["highstreet_name"].tolist() == ["a", "b"]
+    np.testing.assert_allclose(result["mean"], expected["mean"])
+    np.testing.assert_allclose(result["std"], expected["std"])
+
+
+def test_build_feature_frame_all_rows_window():
+    df = _monthly_spend()
+
+    result = pf.build_feature_frame(df, [("txn_amt_wd_retail", "max", None, "max")])
+
+    assert result["max"].tolist() == [4.0, 3.0]
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import Ridge
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from highstreets.models import predict_model, registry
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(40, 3)), columns=["a", "b", "c"])
+    y = X @ [1.0, -0.5, 0.2] + rng.normal(0, 0.1, 40)
+    return X, y
+
+
+def _fit(model, X, y):
+    return Pipeline([("scaler", StandardScaler()), ("model", model)]).fit(X, y)
+
+
+def test_save_load_round_trip(tmp_path, data):
+    X, y = data
+    model = predict_model.set_label_edges(_fit(Ridge(), X, y), X)
+
+    version = registry.save_model(
+        model, "ridge", metrics={"R2": 0.9}, data=(X, y), registry_dir=str(tmp_path)
+    )
+    loaded = registry.load_model("ridge", registry_dir=str(tmp_path))
+
+    assert version == "v0001"
+    assert not loaded.loaded
+    assert loaded.metadata["features"] == ["a", "b", "c"]
+    assert loaded.metadata["metrics"] == {"R2": 0.9}
+    assert loaded.metadata["data_hash"] == registry.data_hash(X, y)
+    np.testing.assert_allclose(loaded.label_edges_, model.label_edges_)
+    assert not loaded.loaded
+    np.testing.assert_allclose(loaded.predict(X), model.predict(X))
+    assert loaded.loaded
+
+
+def test_versions(tmp_path, data):
+    X, y = data
+    for alpha in [1.0, 100.0]:
+        registry.save_model(
+            _fit(Ridge(alpha=alpha), X, y), "ridge", registry_dir=str(tmp_path)
+        )
+
+    first = registry.load_model("ridge", "v0001", registry_dir=str(tmp_path))
+    latest = registry.load_model("ridge", registry_dir=str(tmp_path))
+
+    assert first.named_steps["model"].alpha == 1.0
+    assert latest.named_steps["model"].alpha == 100.0
+    assert registry.list_models(str(tmp_path))["version"].tolist() == [
+        "v0001",
+        "v0002",
+    ]
+
+
+def test_xgboost_step_round_trip(tmp_path, data):
+    xgboost = pytest.importorskip("xgboost")
+    X, y = data
+    model = _fit(xgboost.XGBRegressor(n_estimators=10, max_depth=2), X, y)
+
+    registry.save_model(model, "xgb", registry_dir=str(tmp_path))
+    loaded = registry.load_model("xgb", registry_dir=str(tmp_path))
+
+    assert loaded.metadata["xgboost_steps"]["model"]["file"] == "model.json"
+    np.testing.assert_allclose(loaded.predict(X), model.predict(X), rtol=1e-6)
+
+
+def test_data_hash_changes_with_data(data):
+    X, y = data
+    changed = X.copy()
+    changed.iloc[0, 0] += 1
+
+    assert registry.data_hash(X, y) == registry.data_hash(X.copy(), y.copy())
+    assert registry.data_hash(X, y) != registry.data_hash(changed, y)
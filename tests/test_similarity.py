@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from highstreets.features import similarity
+
+N_HIGHSTREETS = 12
+
+
+@pytest.fixture
+def series():
+    """Weekly series in the layout of extract_data_array"""
+    rng = np.random.default_rng(0)
+    ids = np.arange(100, 100 + N_HIGHSTREETS)
+    columns = pd.MultiIndex.from_arrays(
+        [["txn_amt"] * N_HIGHSTREETS, ids, [f"hs {i}" for i in ids]],
+        names=[None, "highstreet_id", "highstreet_name"],
+    )
+    trend = np.linspace(0, 1, 60)[:, None] * rng.normal(size=N_HIGHSTREETS)
+    return pd.DataFrame(
+        trend + rng.normal(0, 0.3, (60, N_HIGHSTREETS)),
+        index=pd.date_range(
+            "2020-01-06", periods=60, freq="W-MON", name="period_start"
+        ),
+        columns=columns,
+    )
+
+
+@pytest.fixture
+def profiles(series):
+    rng = np.random.default_rng(1)
+    ids = series.columns.get_level_values("highstreet_id")
+    profiles = pd.DataFrame(
+        rng.normal(size=(N_HIGHSTREETS, 3)),
+        index=pd.Index(ids, name="highstreet_id"),
+        columns=["a", "b", "c"],
+    )
+    profiles.iloc[2, 1] = np.nan
+    profiles["name"] = "text columns are ignored"
+    return profiles
+
+
+def _brute_force_top_k(series, profiles, profile_weight, k):
+    """Every pair's similarity with pandas, sorted in full"""
+    ids = series.columns.get_level_values("highstreet_id")
+    corr = series.droplevel([0, 2], axis=1).corr().to_numpy()
+    numeric = profiles[["a", "b", "c"]]
+    standard = ((numeric - numeric.mean()) / numeric.std(ddof=0)).fillna(0)
+    unit = standard.div(np.linalg.norm(standard, axis=1), axis=0).to_numpy()
+    sim = (1 - profile_weight) * corr + profile_weight * unit @ unit.T
+
+    rows = []
+    for i, hs in enumerate(ids):
+        others = sorted(
+            (j for j in range(len(ids)) if j != i), key=lambda j: -sim[i, j]
+        )
+        for rank, j in enumerate(others[:k], start=1):
+            rows.append((hs, rank, ids[j], sim[i, j]))
+    return pd.DataFrame(
+        rows, columns=["highstreet_id", "rank", "neighbour_id", "similarity"]
+    )
+
+
+@pytest.mark.parametrize("profile_weight", [0.0, 0.3])
+def test_query_all_matches_brute_force(series, profiles, profile_weight):
+    index = similarity.SimilarityIndex.build(series, profiles, profile_weight)
+
+    pdt.assert_frame_equal(
+        index.query_all(k=4),
+        _brute_force_top_k(series, profiles, profile_weight, 4),
+        check_dtype=False,
+    )
+
+
+def test_query_matches_query_all(series, profiles):
+    index = similarity.SimilarityIndex.build(series, profiles)
+    everything = index.query_all(k=N_HIGHSTREETS)
+
+    neighbours = index.query(105, k=N_HIGHSTREETS)
+
+    expected = everything[everything["highstreet_id"] == 105]
+    assert len(neighbours) == N_HIGHSTREETS - 1
+    assert neighbours["highstreet_id"].tolist() == expected["neighbour_id"].tolist()
+    np.testing.assert_allclose(neighbours["similarity"], expected["similarity"])
+
+
+def test_appending_weeks_matches_build(series, profiles, tmp_path):
+    index = similarity.SimilarityIndex.build(series.iloc[:20], profiles)
+    index.append(series.iloc[20:45])
+    index.append(series.iloc[45:])
+
+    built = similarity.SimilarityIndex.build(series, profiles)
+    np.testing.assert_allclose(index.similarity, built.similarity)
+    with pytest.raises(ValueError, match="must come after"):
+        index.append(series.iloc[-5:])
+
+    index.save(tmp_path / "index.npz")
+    loaded = similarity.SimilarityIndex.load(tmp_path / "index.npz")
+    pdt.assert_frame_equal(loaded.query_all(k=3), built.query_all(k=3))
+
+
+def test_missing_values_are_rejected(series):
+    series.iloc[3, 2] = np.nan
+
+    with pytest.raises(ValueError, match="missing values"):
+        similarity.SimilarityIndex.build(series)
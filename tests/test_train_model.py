@@ -0,0 +1,95 @@
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import Ridge
+from sklearn.model_selection import GridSearchCV
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from highstreets.models import train_model
+
+matplotlib.use("Agg")
+
+ALPHAS = [0.1, 10.0, 1000.0]
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(60, 4)), columns=["a", "b", "c", "d"])
+    y = pd.DataFrame(
+        {
+            "mean 2020": X @ [1.0, 0.5, 0.0, 0.0] + rng.normal(0, 0.5, 60),
+            "slope 2020": X @ [0.0, 0.0, 0.2, -0.1] + rng.normal(0, 1.0, 60),
+        }
+    )
+    return X, y
+
+
+def test_make_shared_folds(data):
+    X, _ = data
+
+    folds = train_model.make_shared_folds(X, n_splits=5)
+
+    val_rows = np.concatenate([fold["val_idx"] for fold in folds])
+    assert np.array_equal(np.sort(val_rows), np.arange(len(X)))
+    for fold in folds:
+        # scaled with the training rows' statistics only
+        np.testing.assert_allclose(fold["X_train"].mean(axis=0), 0, atol=1e-12)
+        np.testing.assert_allclose(
+            fold["X_val"], fold["scaler"].transform(X.to_numpy()[fold["val_idx"]])
+        )
+
+
+def test_every_target_uses_the_same_folds(data, monkeypatch):
+    X, y = data
+    seen = []
+    run_job = train_model._run_job
+
+    def recording_run_job(model, params, folds, y, scoring):
+        seen.append([fold["train_idx"] for fold in folds])
+        return run_job(model, params, folds, y, scoring)
+
+    monkeypatch.setattr(train_model, "_run_job", recording_run_job)
+
+    train_model.run_multi_target_experiments(
+        {"ridge": (Ridge(), {"alpha": ALPHAS})}, X, y, n_jobs=1
+    )
+
+    assert len(seen) == len(ALPHAS) * y.shape[1]
+    for folds in seen[1:]:
+        for train_idx, first in zip(folds, seen[0]):
+            assert np.array_equal(train_idx, first)
+
+
+def test_parallel_matches_sequential_cv(data):
+    X, y = data
+    models = {"ridge": (Ridge(), {"alpha": ALPHAS})}
+
+    results, sequential = (
+        train_model.run_multi_target_experiments(
+            models, X, y, n_jobs=n_jobs, shuffle=False
+        ).drop(columns=["fit_time", "score_time"])
+        for n_jobs in (2, 1)
+    )
+
+    pd.testing.assert_frame_equal(results, sequential)
+    tuned_params = {"model__alpha": ALPHAS}
+    for target in y.columns:
+        search = GridSearchCV(
+            Pipeline([("scaler", StandardScaler()), ("model", Ridge())]),
+            tuned_params,
+            scoring="r2",
+        ).fit(X, y[target])
+        target_results = results[results["target"] == target]
+        np.testing.assert_allclose(
+            target_results["mean_score"], search.cv_results_["mean_test_score"]
+        )
+
+        best_model, _ = train_model.run_experiment_w_cv(
+            Ridge(), tuned_params, X, X, y[[target]], y[[target]]
+        )
+        best = target_results.loc[target_results["best"], "params"].item()
+        assert best["alpha"] == best_model.named_steps["model"].alpha
+    matplotlib.pyplot.close("all")